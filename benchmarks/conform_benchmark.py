@@ -0,0 +1,172 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+from __future__ import print_function, absolute_import
+
+from datetime import datetime
+from time import time
+
+from numpy import arange, argmin, abs, array, cos, float32, meshgrid, sin, isfinite
+from pyproj import Proj
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+
+from bounds import GeoBounds
+from met.thredds import GridMet
+
+
+class SyntheticScene(object):
+    """ A UTM target grid with a GridMet-like source cube covering it, no network needed.
+
+    The source is an analytic field of lon and lat sampled at GridMet cell centers, so a
+    conformed array can be checked against the same field at the target cell centers.
+
+    :param width: target width in cells
+    :param height: target height in cells
+    :param res: target resolution in meters
+    """
+
+    def __init__(self, width=2000, height=2000, res=30.):
+        west, north = 400000., 5200000.
+        east, south = west + width * res, north - height * res
+        self.width, self.height = width, height
+
+        self.target_profile = {'driver': 'GTiff', 'dtype': 'float32', 'nodata': None,
+                               'width': width, 'height': height, 'count': 1,
+                               'crs': CRS({'init': 'epsg:32612'}),
+                               'transform': Affine(res, 0., west, 0., -res, north)}
+
+        self.utm = Proj(init='epsg:32612')
+        w, n = self.utm(west, north, inverse=True)
+        e, s = self.utm(east, south, inverse=True)
+        self.bbox = GeoBounds(west=w, south=s, east=e, north=n)
+
+        self.clip_feature = {'type': 'Polygon',
+                             'coordinates': [[(west + 0.05 * width * res, north - 0.05 * height * res),
+                                              (east - 0.05 * width * res, north - 0.1 * height * res),
+                                              (east - 0.1 * width * res, south + 0.05 * height * res),
+                                              (west + 0.05 * width * res, south + 0.05 * height * res),
+                                              (west + 0.05 * width * res, north - 0.05 * height * res)]]}
+
+        lat = arange(49.4, 25., -1. / 24)
+        lon = arange(-124.7, -67., 1. / 24)
+        north_ind = argmin(abs(lat - (self.bbox.north + 1.)))
+        south_ind = argmin(abs(lat - (self.bbox.south - 1.)))
+        west_ind = argmin(abs(lon - (self.bbox.west - 1.)))
+        east_ind = argmin(abs(lon - (self.bbox.east + 1.)))
+        self.src_bounds_wsen = (lon[west_ind], lat[south_ind], lon[east_ind], lat[north_ind])
+        self.lon = lon[west_ind:east_ind + 1]
+        self.lat = lat[north_ind:south_ind + 1]
+
+    @staticmethod
+    def field(lon, lat, day=0):
+        return 10. * sin(lon * 3. + day) + 10. * cos(lat * 2.)
+
+    def cube(self, days=1):
+        lon, lat = meshgrid(self.lon, self.lat)
+        return array([self.field(lon, lat, d) for d in range(days)], dtype=float32)
+
+    def truth(self, days=1):
+        cols, rows = meshgrid(arange(self.width) + 0.5, arange(self.height) + 0.5)
+        x, y = self.target_profile['transform'] * (cols, rows)
+        lon, lat = self.utm(x, y, inverse=True)
+        return array([self.field(lon, lat, d) for d in range(days)], dtype=float32)
+
+    def gridmet(self, **kwargs):
+        gridmet = GridMet('pr', date=datetime(2014, 8, 20), bbox=self.bbox,
+                          target_profile=self.target_profile,
+                          clip_feature=self.clip_feature, **kwargs)
+        gridmet.src_bounds_wsen = self.src_bounds_wsen
+        return gridmet
+
+
+def _timed(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t = time()
+        result = func()
+        elapsed = time() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def fused_vs_staged(width=2000, height=2000, res=30., days=10, repeat=3):
+    """ Time the staged conform chain against the fused single warp, and compare values.
+
+    Differences are taken where both engines have data, error against the analytic
+    field is reported for each engine.
+    """
+    scene = SyntheticScene(width, height, res)
+    cube = scene.cube(days)
+    truth = scene.truth(days)
+    GridMet.plan_cache.clear()
+
+    engines = [('staged, temp GeoTIFFs', dict()),
+               ('staged, cached plan', dict(in_memory=True)),
+               ('fused, cached plan', dict(fused=True))]
+
+    results = {}
+    print('{} x {} target, {} days'.format(width, height, days))
+    for name, kwargs in engines:
+        gridmet = scene.gridmet(**kwargs)
+        first, _ = _timed(lambda: gridmet.conform(cube), 1)
+        best, result = _timed(lambda: gridmet.conform(cube), repeat)
+        results[name] = result
+        print('{:>24}: first {:.3f} s, best {:.3f} s'.format(name, first, best))
+
+    staged = results['staged, temp GeoTIFFs']
+    fused = results['fused, cached plan']
+    both = (staged != 0.) & (fused != 0.) & isfinite(staged) & isfinite(fused)
+    diff = abs(staged - fused)[both]
+    print('fused - staged: mean abs {:.4f}, max abs {:.4f}'.format(diff.mean(), diff.max()))
+    for name in ('staged, temp GeoTIFFs', 'fused, cached plan'):
+        err = abs(results[name] - truth)[both]
+        print('{:>24}: mean abs error vs field {:.4f}'.format(name, err.mean()))
+
+    return results
+
+
+def thread_scaling(width=4000, height=4000, res=30., days=10, threads=(1, 2, 4, 8, 16, 32),
+                   gdal_cachemax=None, warp_mem_limit=0, repeat=3):
+    """ Time conform of each engine over a range of GDAL warp thread counts.
+
+    Warp plans are built before timing, so only the warps are measured.
+    """
+    scene = SyntheticScene(width, height, res)
+    cube = scene.cube(days)
+
+    print('{} x {} target, {} days'.format(width, height, days))
+    timings = {}
+    for name, kwargs in [('staged, cached plan', dict(in_memory=True)),
+                         ('fused, cached plan', dict(fused=True))]:
+        base = None
+        for num_threads in threads:
+            gridmet = scene.gridmet(num_threads=num_threads, gdal_cachemax=gdal_cachemax,
+                                    warp_mem_limit=warp_mem_limit, **kwargs)
+            gridmet.warp_plan(cube.shape[1:])
+            best, _ = _timed(lambda: gridmet.conform(cube), repeat)
+            base = best if base is None else base
+            timings[(name, num_threads)] = best
+            print('{:>24}: {:>2} threads {:.3f} s, speedup {:.2f}'.format(name, num_threads,
+                                                                       best, base / best))
+    return timings
+
+
+if __name__ == '__main__':
+    fused_vs_staged()
+    thread_scaling()
+
+# ===============================================================================
@@ -0,0 +1,87 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+from __future__ import print_function, absolute_import
+
+import sys
+from datetime import datetime
+from time import time
+
+from numpy import arange
+from pandas import date_range
+
+from bounds import GeoBounds
+from met.coordinates import CoordinateIndex
+from met.handles import DatasetPool
+from met.thredds import GridMet
+
+# a county-sized box near Missoula, MT
+BBOX = GeoBounds(west=-114.4, south=46.6, east=-113.6, north=47.1)
+
+
+def estimated_bytes(bbox=BBOX, start=datetime(2014, 6, 1), end=datetime(2014, 8, 31)):
+    """ Bytes of one GridMet variable a hyperslab request sends, against the whole year.
+
+    Uses the GridMet grid and calendar, no network needed.
+    """
+    index = CoordinateIndex(arange(49.4, 25., -1. / 24), arange(-124.7, -67., 1. / 24),
+                            time=date_range('2014-01-01', '2014-12-31').values, time_dim='day',
+                            dims=('day', 'lon', 'lat'))
+    space, _ = index.subset(bbox, buffer=1.)
+    days = index.time_slice(start, end)
+
+    full, sliced = index.nbytes(), index.nbytes(space, days)
+    print('whole year, whole grid: {:>12,} bytes'.format(full))
+    print('  bbox and dates only:  {:>12,} bytes, {:.4%}'.format(sliced, sliced / float(full)))
+    return full, sliced
+
+
+def live_request(variable='pr', bbox=BBOX, start=datetime(2014, 6, 1), end=datetime(2014, 8, 31)):
+    """ Time a hyperslab read from the GridMet server on a cold handle against a pooled one.
+
+    The cold read opens the url, costing its DDS, DAS and coordinates, as every read did
+    before handles were pooled. The repeat is sliced from the handle the pool kept open.
+    """
+    gridmet = GridMet(variable, start=start, end=end, bbox=bbox)
+    url = gridmet._build_url()
+    index = gridmet._coordinate_index(url)
+    space, _ = index.subset(bbox, buffer=1.)
+    days = index.time_slice(start, end)
+    name = gridmet.kwords[variable]
+    pool = DatasetPool()
+
+    try:
+        t = time()
+        cold = pool.get(url)[name].isel(day=days, **space).load()
+        opened = time() - t
+
+        t = time()
+        pooled = pool.get(url)[name].isel(day=days, **space).load()
+        repeat = time() - t
+    finally:
+        pool.close()
+
+    assert (cold.values == pooled.values).all()
+    print('open url, then hyperslab: {:.2f} s, {:,} bytes'.format(opened, cold.nbytes))
+    print('  pooled handle:          {:.2f} s'.format(repeat))
+    return opened, repeat
+
+
+if __name__ == '__main__':
+    estimated_bytes()
+    if '--live' in sys.argv:
+        live_request()
+
+# ===============================================================================
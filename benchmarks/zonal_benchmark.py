@@ -0,0 +1,57 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+from __future__ import print_function, absolute_import
+
+from time import time
+
+from numpy import arange, float32
+from numpy.random import RandomState
+from shapely.geometry import Point
+
+from met.zonal import ZonalWeights
+
+
+def zonal_stats(polygons=5000, rows=200, cols=300, days=365):
+    """ Time building coverage weights for many catchment-sized polygons, then a year of means.
+
+    The grid is GridMet's 1/24 degree, the polygons are random buffers of 2 to 10 km.
+    """
+    res = 1. / 24
+    lat = 48. - arange(rows) * res
+    lon = -116. + arange(cols) * res
+    noise = RandomState(0)
+
+    centers = zip(noise.uniform(lon[0], lon[-1], polygons), noise.uniform(lat[-1], lat[0], polygons))
+    features = [Point(x, y).buffer(noise.uniform(0.02, 0.1)) for x, y in centers]
+    cube = noise.rand(days, rows, cols).astype(float32)
+
+    t = time()
+    weights = ZonalWeights.from_coords(lat, lon, features)
+    built = time() - t
+
+    t = time()
+    stats = weights.stats(cube, operations=('mean',))
+    applied = time() - t
+
+    print('{} polygons on a {} x {} grid: weights {:.2f} s, {} days of means {:.2f} s'.format(
+        polygons, rows, cols, built, days, applied))
+    return stats
+
+
+if __name__ == '__main__':
+    zonal_stats()
+
+# ===============================================================================
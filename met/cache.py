@@ -0,0 +1,320 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import os
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from numpy import concatenate
+from xarray import DataArray, open_dataset
+
+from met.handles import NETCDF_LOCK
+
+
+class ChunkCache(object):
+    """ On-disk cache of gridded data in spatial chunks of a year, for Thredds objects.
+
+    The native grid of a dataset is cut into chunk_size by chunk_size cells, a fixed tile
+    grid counted from the grid's first cell, see tiles. Each chunk of a (source, variable,
+    year) is kept as a zlib-compressed NetCDF4 file holding every day of the year in runs
+    of time_chunk days, so any date range of the year is served from it. A read
+    fetches the missing chunks it touches in one request, and least recently used
+    chunks are removed once the cache is over max_bytes.
+
+    :param root: directory of the cache, made if missing
+    :param max_bytes: byte budget of the cache on disk, None for no budget
+    :param chunk_size: chunk edge in grid cells
+    :param complevel: zlib compression level, 1 to 9
+    :param time_chunk: days per run compressed together within a chunk
+    """
+
+    def __init__(self, root, max_bytes=None, chunk_size=64, complevel=4, time_chunk=32):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.complevel = complevel
+        self.time_chunk = time_chunk
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_fetched = 0
+
+        self._lock = Lock()
+        self._files = {}
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._scan()
+
+    @classmethod
+    def tiles(cls, root, degrees=1., resolution=1. / 24, **kwargs):
+        """ Cache of tiles degrees a side, on a grid of resolution, GridMet's by default.
+
+        Tiles are counted from the grid's first cell, so every bbox on the grid snaps to
+        the same tiles and caches of different users and projects on one root share them.
+
+        :param root: directory of the cache
+        :param degrees: tile edge in degrees
+        :param resolution: cell size of the grid in degrees
+        :param kwargs: as ChunkCache
+        :return: ChunkCache
+        """
+        return cls(root, chunk_size=int(round(degrees / resolution)), **kwargs)
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.nc'):
+                    path = os.path.join(dirpath, name)
+                    stat = os.stat(path)
+                    self._files[path] = [stat.st_size, stat.st_mtime]
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(size for size, _ in self._files.values())
+
+    def __len__(self):
+        return len(self._files)
+
+    def path(self, key, chunk, length=None):
+        """ File of one chunk.
+
+        :param key: (source, variable, year)
+        :param chunk: (row, col) of the chunk
+        :param length: time steps held in the chunk, None if not recorded
+        :return: path
+        """
+        # chunks of each size are kept apart, so caches of several sizes can share a root
+        name = '{}_{}.nc'.format(*chunk) if length is None else '{}_{}_n{}.nc'.format(chunk[0], chunk[1], length)
+        return os.path.join(self.root, *[str(k) for k in key] + ['c{}'.format(self.chunk_size), name])
+
+    def chunks(self, space):
+        """ Chunks a request touches.
+
+        :param space: dict of lat and lon index slices on the native grid
+        :return: list of (row, col)
+        """
+        cs = self.chunk_size
+        rows = range(space['lat'].start // cs, (space['lat'].stop - 1) // cs + 1)
+        cols = range(space['lon'].start // cs, (space['lon'].stop - 1) // cs + 1)
+        return [(r, c) for r in rows for c in cols]
+
+    def _chunk_space(self, chunks, shape):
+        cs = self.chunk_size
+        rows, cols = [r for r, _ in chunks], [c for _, c in chunks]
+        return dict(lat=slice(min(rows) * cs, min((max(rows) + 1) * cs, shape[0])),
+                    lon=slice(min(cols) * cs, min((max(cols) + 1) * cs, shape[1])))
+
+    def read(self, key, space, shape, dims, fetch, length=None, time=None):
+        """ Read a variable over space for a year, fetching the chunks not yet cached.
+
+        The file of the current year gains a day each day, so with length a chunk holding
+        a different number of time steps is stale, and is fetched again and replaced.
+        Chunks are stored in runs of time_chunk steps, so a time slice decompresses only
+        the runs it overlaps.
+
+        :param key: (source, variable, year)
+        :param space: dict of lat and lon index slices on the native grid
+        :param shape: (lat, lon) size of the native grid
+        :param dims: dimension names of the variable, including 'lat' and 'lon'
+        :param fetch: function of a dict of lat and lon slices returning a numpy.ndarray
+            of the variable over them for the whole year, in dims order
+        :param length: time steps the source has for the year now, None to not check
+        :param time: slice of the year's time steps to read, default all of them
+        :return: numpy.ndarray in dims order
+        """
+        lat_axis, lon_axis = dims.index('lat'), dims.index('lon')
+        chunks = self.chunks(space)
+        blocks, _ = self._fetch_missing(key, chunks, shape, dims, fetch, length)
+        steps = self._time_index(dims, time)
+
+        for chunk in chunks:
+            if chunk in blocks:
+                blocks[chunk] = blocks[chunk][steps]
+            else:
+                blocks[chunk] = self._read(key, chunk, length, steps)
+
+        block_space = self._chunk_space(chunks, shape)
+        rows = sorted(set(r for r, _ in chunks))
+        cols = sorted(set(c for _, c in chunks))
+        arr = concatenate([concatenate([blocks[(r, c)] for c in cols], axis=lon_axis)
+                           for r in rows], axis=lat_axis)
+
+        index = [slice(None)] * len(dims)
+        index[lat_axis] = slice(space['lat'].start - block_space['lat'].start,
+                                space['lat'].stop - block_space['lat'].start)
+        index[lon_axis] = slice(space['lon'].start - block_space['lon'].start,
+                                space['lon'].stop - block_space['lon'].start)
+        self.evict()
+        return arr[tuple(index)]
+
+    def prefetch(self, key, space, shape, dims, fetch, length=None):
+        """ Fetch and keep the chunks of space not yet cached, without reading any.
+
+        :param key: (source, variable, year)
+        :param space: dict of lat and lon index slices on the native grid
+        :param shape: (lat, lon) size of the native grid
+        :param dims: dimension names of the variable, including 'lat' and 'lon'
+        :param fetch: as read
+        :param length: as read
+        :return: bytes fetched
+        """
+        _, nbytes = self._fetch_missing(key, self.chunks(space), shape, dims, fetch, length)
+        self.evict()
+        return nbytes
+
+    def _fetch_missing(self, key, chunks, shape, dims, fetch, length=None):
+        with self._lock:
+            missing = [chunk for chunk in chunks if self.path(key, chunk, length) not in self._files]
+            self.hits += len(chunks) - len(missing)
+            self.misses += len(missing)
+
+        blocks, nbytes = {}, 0
+        lat_axis, lon_axis = dims.index('lat'), dims.index('lon')
+        for rectangle in self._rectangles(missing):
+            fetched_space = self._chunk_space(rectangle, shape)
+            arr = fetch(fetched_space)
+            nbytes += arr.nbytes
+            with self._lock:
+                self.bytes_fetched += arr.nbytes
+            for chunk in rectangle:
+                block = self._cut(arr, chunk, fetched_space, shape, lat_axis, lon_axis)
+                self._write(key, chunk, block, dims, length)
+                blocks[chunk] = block
+        return blocks, nbytes
+
+    @staticmethod
+    def _rectangles(chunks):
+        """ Cover chunks with rectangles of them holding no other chunk, one fetch each.
+
+        Runs of adjacent chunks along each chunk row are joined with the same run of the
+        rows below, so a whole missing block is one rectangle and cached chunks are never
+        inside one.
+
+        :param chunks: list of (row, col)
+        :return: list of lists of (row, col)
+        """
+        runs = []
+        for chunk in sorted(chunks):
+            row, col = chunk
+            if runs and runs[-1][0] == row and runs[-1][2] == col - 1:
+                runs[-1][2] = col
+            else:
+                runs.append([row, col, col])
+
+        rectangles = {}
+        for row, first, last in runs:
+            above = rectangles.pop((row - 1, first, last), None)
+            rows = (above[0] if above else row, row)
+            rectangles[(row, first, last)] = rows
+        return [[(r, c) for r in range(rows[0], rows[1] + 1) for c in range(first, last + 1)]
+                for (_, first, last), rows in sorted(rectangles.items(), key=lambda item: (item[1], item[0]))]
+
+    @staticmethod
+    def _time_index(dims, time=None):
+        return tuple(slice(None) if dim in ('lat', 'lon') or time is None else time for dim in dims)
+
+    def _cut(self, arr, chunk, fetched_space, shape, lat_axis, lon_axis):
+        chunk_space = self._chunk_space([chunk], shape)
+        index = [slice(None)] * arr.ndim
+        index[lat_axis] = slice(chunk_space['lat'].start - fetched_space['lat'].start,
+                                chunk_space['lat'].stop - fetched_space['lat'].start)
+        index[lon_axis] = slice(chunk_space['lon'].start - fetched_space['lon'].start,
+                                chunk_space['lon'].stop - fetched_space['lon'].start)
+        return arr[tuple(index)]
+
+    def _write(self, key, chunk, block, dims, length=None):
+        path = self.path(key, chunk, length)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+
+        # written under a temporary name and renamed, so readers never see a partial chunk
+        temp = '{}.{}.tmp'.format(path, uuid4().hex)
+        chunksizes = tuple(size if dim in ('lat', 'lon') else min(size, self.time_chunk)
+                           for dim, size in zip(dims, block.shape))
+        with NETCDF_LOCK:
+            DataArray(block, dims=dims, name='data').to_netcdf(
+                temp, engine='netcdf4',
+                encoding={'data': {'zlib': True, 'complevel': self.complevel, 'chunksizes': chunksizes}})
+        os.rename(temp, path)
+        with self._lock:
+            self._files[path] = [os.path.getsize(path), time()]
+        self._remove_stale(key, chunk, path)
+
+    def _remove_stale(self, key, chunk, path):
+        """ Remove the files of chunk holding another number of time steps than path.
+        """
+        directory, prefix = os.path.dirname(path), '{}_{}_n'.format(*chunk)
+        plain = os.path.join(directory, '{}_{}.nc'.format(*chunk))
+        with self._lock:
+            stale = [p for p in self._files if p != path and os.path.dirname(p) == directory and
+                     (p == plain or os.path.basename(p).startswith(prefix))]
+            for p in stale:
+                del self._files[p]
+        for p in stale:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def _read(self, key, chunk, length=None, steps=()):
+        path = self.path(key, chunk, length)
+        with NETCDF_LOCK, open_dataset(path) as ds:
+            block = ds['data'][steps].values
+        with self._lock:
+            if path in self._files:
+                self._files[path][1] = time()
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return block
+
+    def evict(self):
+        """ Remove least recently used chunks until the cache is within max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            total = sum(size for size, _ in self._files.values())
+            for path in sorted(self._files, key=lambda p: self._files[p][1]):
+                if total <= self.max_bytes:
+                    break
+                total -= self._files.pop(path)[0]
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """ Remove every chunk.
+        """
+        with self._lock:
+            for path in self._files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._files.clear()
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,336 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import json
+import os
+from hashlib import sha1
+from threading import Lock
+from time import time as now
+from uuid import uuid4
+
+from numpy import array, asarray, clip, datetime64, load as load_arrays, savez, searchsorted, where
+
+
+class CoordinateIndex(object):
+    """ Nearest-cell lookup on the lat and lon coordinates of a gridded dataset.
+
+    Coordinates are read once, lookups are a binary search and give the same cell
+    as argmin(abs(values - value)), including its choice of the first of two ties.
+
+    :param lat: 1-D array of latitudes, ascending or descending
+    :param lon: 1-D array of longitudes, ascending or descending
+    :param time: 1-D array of ascending datetime64, None for a dataset with no time
+    :param time_dim: name of the time dimension, e.g. 'day' in GridMet
+    :param dims: dimension order of the gridded variables, e.g. ('day', 'lon', 'lat')
+    :param chunks: dict of the file's chunk size by dimension, None if not chunked or not known
+    """
+
+    def __init__(self, lat, lon, time=None, time_dim=None, dims=None, chunks=None):
+        self.lat = asarray(lat)
+        self.lon = asarray(lon)
+        self.time = None if time is None else asarray(time)
+        self.time_dim = time_dim
+        self.dims = dims
+        self.chunks = chunks
+        self._sorted = {'lat': self._ascending(self.lat),
+                        'lon': self._ascending(self.lon)}
+
+    @classmethod
+    def from_dataset(cls, xray):
+        """ Index of an opened xarray.Dataset with lat and lon, and day or time if daily.
+        """
+        time_dim = None
+        for name in ('day', 'time'):
+            if name in xray.coords:
+                time_dim = name
+        time = xray[time_dim].values if time_dim else None
+
+        dims, chunks = None, None
+        for var in xray.data_vars.values():
+            if 'lat' in var.dims and 'lon' in var.dims:
+                dims = var.dims
+                if var.encoding.get('chunksizes'):
+                    chunks = dict(zip(dims, var.encoding['chunksizes']))
+                break
+
+        return cls(xray.lat.values, xray.lon.values, time=time, time_dim=time_dim, dims=dims,
+                   chunks=chunks)
+
+    @staticmethod
+    def _ascending(values):
+        if len(values) > 1 and values[0] > values[-1]:
+            return values[::-1], True
+        return values, False
+
+    @property
+    def shape(self):
+        return len(self.lat), len(self.lon)
+
+    def nearest(self, axis, value):
+        """ Index of the coordinate nearest value.
+
+        :param axis: 'lat' or 'lon'
+        :param value: coordinate to look up
+        :return: int index into the dataset's axis
+        """
+        values = getattr(self, axis)
+        ordered, reversed_ = self._sorted[axis]
+        n = len(values)
+
+        i = int(searchsorted(ordered, value))
+        candidates = [j for j in (i - 1, i) if 0 <= j < n]
+        if reversed_:
+            candidates = [n - 1 - j for j in candidates]
+
+        return min(candidates, key=lambda j: (abs(values[j] - value), j))
+
+    def nearest_many(self, axis, values):
+        """ Indices of the coordinates nearest each of values, as nearest in one step.
+
+        :param axis: 'lat' or 'lon'
+        :param values: 1-D array of coordinates to look up
+        :return: numpy.ndarray of int indices into the dataset's axis
+        """
+        coords = getattr(self, axis)
+        ordered, reversed_ = self._sorted[axis]
+        n = len(coords)
+        values = asarray(values, dtype=float)
+
+        i = searchsorted(ordered, values)
+        below, above = clip(i - 1, 0, n - 1), clip(i, 0, n - 1)
+        if reversed_:
+            below, above = n - 1 - below, n - 1 - above
+
+        d_below, d_above = abs(coords[below] - values), abs(coords[above] - values)
+        pick_above = (d_above < d_below) | ((d_above == d_below) & (above < below))
+        return where(pick_above, above, below)
+
+    def bounds_indices(self, bbox, buffer=0.):
+        """ Nearest indices to the edges of a bounding box.
+
+        :param bbox: bounds.GeoBounds
+        :param buffer: degrees to widen the box by on each side
+        :return: north, south, west, east indices
+        """
+        return (self.nearest('lat', bbox.north + buffer),
+                self.nearest('lat', bbox.south - buffer),
+                self.nearest('lon', bbox.west - buffer),
+                self.nearest('lon', bbox.east + buffer))
+
+    def subset(self, bbox, buffer=0.):
+        """ Index slices and cell-center bounds of the cells nearest a bounding box.
+
+        :param bbox: bounds.GeoBounds
+        :param buffer: degrees to widen the box by on each side
+        :return: dict of lat and lon slices for Dataset.isel, (west, south, east, north)
+        """
+        north_ind, south_ind, west_ind, east_ind = self.bounds_indices(bbox, buffer)
+
+        lat_slice = slice(min(north_ind, south_ind), max(north_ind, south_ind) + 1)
+        lon_slice = slice(min(west_ind, east_ind), max(west_ind, east_ind) + 1)
+        src_bounds = (self.lon[west_ind], self.lat[south_ind],
+                      self.lon[east_ind], self.lat[north_ind])
+
+        return dict(lat=lat_slice, lon=lon_slice), src_bounds
+
+    def save(self, path):
+        """ Write the index to a .npz file, see load.
+
+        :param path: path of the file
+        """
+        meta = json.dumps(dict(time_dim=self.time_dim, dims=list(self.dims) if self.dims else None,
+                               chunks=dict((k, int(v)) for k, v in self.chunks.items()) if self.chunks else None))
+        arrays = dict(lat=self.lat, lon=self.lon, meta=array(meta))
+        if self.time is not None:
+            arrays['time'] = self.time
+        # written under a temporary name and renamed, so other processes never read a partial file
+        temp = '{}.{}.npz'.format(path, uuid4().hex)
+        savez(temp, **arrays)
+        os.rename(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Read an index written by save.
+
+        :param path: path of the file
+        :return: CoordinateIndex
+        """
+        with load_arrays(path) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            return cls(arrays['lat'], arrays['lon'], time=arrays['time'] if 'time' in arrays else None,
+                       time_dim=meta['time_dim'], dims=tuple(meta['dims']) if meta['dims'] else None,
+                       chunks=meta['chunks'])
+
+    def time_slice(self, start, end):
+        """ Index slice of the days from start to end, both included, as .loc slicing.
+
+        :param start: datetime or datetime64
+        :param end: datetime or datetime64
+        :return: slice, or None with no time coordinate
+        """
+        if self.time is None:
+            return None
+        first = int(searchsorted(self.time, datetime64(start), side='left'))
+        last = int(searchsorted(self.time, datetime64(end), side='right'))
+        if last <= first:
+            raise ValueError('No dates from {} to {}, data runs {} to {}'.format(
+                start, end, self.time[0], self.time[-1]))
+        return slice(first, last)
+
+    def aligned_chunks(self, slices, default=None):
+        """ dask chunks of a slice of the grid whose edges fall on the file's own chunk edges.
+
+        :param slices: dict of slices by dimension
+        :param default: dict of chunk sizes for dimensions the file does not chunk, -1 for whole
+        :return: dict of tuples of chunk sizes by dimension, for Dataset.chunk
+        """
+        sizes = dict(default or {})
+        sizes.update(self.chunks or {})
+        chunks = {}
+        for dim, s in slices.items():
+            size = sizes.get(dim, -1)
+            if size is None or size < 1:
+                chunks[dim] = (s.stop - s.start,)
+                continue
+            edges = [s.start] + list(range((s.start // size + 1) * size, s.stop, size)) + [s.stop]
+            chunks[dim] = tuple(b - a for a, b in zip(edges[:-1], edges[1:]))
+        return chunks
+
+    def nbytes(self, space=None, time=None, itemsize=4):
+        """ Bytes of one gridded variable over space and time, all of it by default.
+
+        :param space: dict of lat and lon slices, see subset
+        :param time: slice of time, see time_slice
+        :param itemsize: bytes per value
+        :return: int
+        """
+        space = space or {}
+        lengths = [len(range(*space.get('lat', slice(0, len(self.lat))).indices(len(self.lat)))),
+                   len(range(*space.get('lon', slice(0, len(self.lon))).indices(len(self.lon))))]
+        if self.time is not None:
+            time = time or slice(0, len(self.time))
+            lengths.append(len(range(*time.indices(len(self.time)))))
+        count = 1
+        for n in lengths:
+            count *= n
+        return count * itemsize
+
+
+class CoordinateCache(object):
+    """ CoordinateIndex objects of opened datasets, by url or path.
+
+    With a root directory the indices of remote urls are also kept on disk, so other
+    processes find them without opening the url. Yearly files on the server grow until
+    the year is out, so an index, in memory or on disk, is read again after max_age seconds.
+
+    :param root: directory of the indices on disk, None to keep them in memory only
+    :param max_age: seconds an index is used for
+    """
+
+    def __init__(self, root=None, max_age=86400):
+        self.root = root
+        self.max_age = max_age
+        self._indices = {}
+        self._lock = Lock()
+
+    def path(self, key):
+        """ File of the index of key on disk, None if key is not kept on disk.
+
+        :param key: url or path of the dataset
+        :return: path
+        """
+        if not self.root or not key.startswith(('http://', 'https://')):
+            return None
+        return os.path.join(self.root, '{}.npz'.format(sha1(key.encode('utf-8')).hexdigest()))
+
+    def _load(self, key):
+        path = self.path(key)
+        if path is None or not os.path.isfile(path):
+            return None
+        # aged from when the index was read from the dataset, not from when it is loaded
+        read = os.path.getmtime(path)
+        if now() - read > self.max_age:
+            return None
+        try:
+            return CoordinateIndex.load(path), read
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, key, index):
+        path = self.path(key)
+        if path is None:
+            return
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError:
+                pass
+        index.save(path)
+
+    def _fresh(self, key):
+        entry = self._indices.get(key)
+        return entry is not None and now() - entry[1] <= self.max_age
+
+    def __contains__(self, key):
+        return self._fresh(key)
+
+    def expired(self, key):
+        """ Whether key has an index older than max_age in memory, read before the dataset last grew.
+
+        :param key: url or path of the dataset
+        :return: bool
+        """
+        return key in self._indices and not self._fresh(key)
+
+    def get(self, key, xray=None):
+        """ Get the CoordinateIndex of key, reading it from xray on first use or once expired.
+
+        :param key: url or path of the dataset
+        :param xray: opened xarray.Dataset with lat and lon
+        :return: CoordinateIndex, or None if not cached and no xray is given
+        """
+        with self._lock:
+            if self._fresh(key):
+                return self._indices[key][0]
+            entry = self._load(key)
+            if entry is not None:
+                self._indices[key] = entry
+                return entry[0]
+            if xray is None:
+                return None
+            index = CoordinateIndex.from_dataset(xray)
+            self._indices[key] = index, now()
+            self._save(key, index)
+            return index
+
+    def put(self, key, index):
+        with self._lock:
+            self._indices[key] = index, now()
+            self._save(key, index)
+
+    def clear(self):
+        """ Forget every index, in memory and on disk.
+        """
+        with self._lock:
+            for key in self._indices:
+                path = self.path(key)
+                if path and os.path.isfile(path):
+                    os.remove(path)
+            self._indices.clear()
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,115 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+from threading import Lock, RLock
+from time import time
+
+from xarray import open_dataset
+
+# netCDF-C and HDF5 are not thread-safe, and xarray's own lock covers array reads only,
+# not opening, writing or reading metadata; every netCDF file met touches goes under this one
+NETCDF_LOCK = RLock()
+
+
+class DatasetPool(object):
+    """ Open xarray.Dataset handles by url or path, shared for the life of the process.
+
+    Opening an OPeNDAP url costs the DDS and DAS requests and the coordinate arrays,
+    so a handle is opened once and every later read of the url only moves data.
+    Handles unused for max_idle seconds are closed, as are the least recently used
+    beyond max_open. Arrays sliced from a closed handle reopen it when read.
+
+    :param max_idle: seconds a handle is kept open unused, None to keep it until evicted
+    :param max_open: most handles open at once
+    """
+
+    def __init__(self, max_idle=300, max_open=32):
+        self.max_idle = max_idle
+        self.max_open = max_open
+
+        self.opens = 0
+        self.hits = 0
+
+        self._lock = Lock()
+        self._handles = {}
+
+    def __contains__(self, key):
+        return key in self._handles
+
+    def __len__(self):
+        return len(self._handles)
+
+    def get(self, key):
+        """ Open handle of key, opened on first use.
+
+        :param key: url or path of the dataset
+        :return: xarray.Dataset, not to be closed by the caller
+        """
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None:
+                entry[1] = time()
+                self.hits += 1
+                return entry[0]
+
+        # opened outside the pool's lock so lookups of open keys never wait on it, the first open wins
+        with NETCDF_LOCK:
+            xray = open_dataset(key, lock=NETCDF_LOCK)
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                entry = self._handles[key] = [xray, time()]
+                self.opens += 1
+                xray = None
+            stale = self._stale(keep=key)
+        _close([xray] + stale)
+        return entry[0]
+
+    def _stale(self, keep=None):
+        now = time()
+        order = sorted((k for k in self._handles if k != keep), key=lambda k: self._handles[k][1])
+        stale = [k for k in order if self.max_idle is not None and now - self._handles[k][1] > self.max_idle]
+        over = len(self._handles) - len(stale) - self.max_open
+        stale += [k for k in order if k not in stale][:max(over, 0)]
+        return [self._handles.pop(k)[0] for k in stale]
+
+    def evict_idle(self):
+        """ Close handles unused for max_idle seconds.
+        """
+        with self._lock:
+            stale = self._stale()
+        _close(stale)
+
+    def close(self, key=None):
+        """ Close the handle of key, or every handle.
+
+        :param key: url or path, None for all
+        """
+        with self._lock:
+            keys = [key] if key is not None else list(self._handles)
+            handles = [self._handles.pop(k)[0] for k in keys if k in self._handles]
+        _close(handles)
+
+
+def _close(handles):
+    with NETCDF_LOCK:
+        for handle in handles:
+            if handle is not None:
+                handle.close()
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,218 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from xarray import concat
+
+from met.thredds import GridMet
+
+
+class Fetch(object):
+    """ One hyperslab of a yearly file, covering the pieces of the jobs merged into it.
+
+    :param variable: GridMet variable
+    :param year: year of the file
+    :param space: dict of lat and lon index slices
+    :param time: index slice of the file's days
+    :param pieces: list of (job, space, time) it covers
+    """
+
+    def __init__(self, variable, year, space, time, pieces):
+        self.variable = variable
+        self.year = year
+        self.space = space
+        self.time = time
+        self.pieces = pieces
+
+    @property
+    def cells(self):
+        return ((self.space['lat'].stop - self.space['lat'].start) *
+                (self.space['lon'].stop - self.space['lon'].start) *
+                (self.time.stop - self.time.start))
+
+    def touches(self, other):
+        """ Whether the two overlap or meet on every axis, as any two worth merging do.
+        """
+        return all(a.start <= b.stop and b.start <= a.stop for a, b in
+                   ((self.space['lat'], other.space['lat']), (self.space['lon'], other.space['lon']),
+                    (self.time, other.time)))
+
+    def union(self, other):
+        """ The smallest fetch covering both, on the same file.
+        """
+        def cover(a, b):
+            return slice(min(a.start, b.start), max(a.stop, b.stop))
+        space = dict(lat=cover(self.space['lat'], other.space['lat']),
+                     lon=cover(self.space['lon'], other.space['lon']))
+        return Fetch(self.variable, self.year, space, cover(self.time, other.time),
+                     self.pieces + other.pieces)
+
+
+class GridMetPlanner(object):
+    """ Fetch many (variable, bbox, start, end) jobs in as few hyperslabs as will do.
+
+    Each job is split into its yearly files and buffered as GridMet buffers a bbox.
+    Within a variable's year, two fetches are merged when the box covering both is no
+    larger than the two apart, so overlapping boxes, boxes side by side and adjacent
+    date windows become one request. Each job's subset is then cut from its fetches.
+    Only fetches that overlap or touch can pass that test, so each fetch is compared
+    with its neighbours in a grid of buckets rather than with every other fetch.
+
+    :param jobs: list of (variable, bbox, start, end), bbox a GeoBounds, start and end datetime
+    :param buffer: degrees added around each bbox, as GridMet
+    :param itemsize: bytes per value, for the byte counts of report
+    :param kwargs: as GridMet, e.g. data_root or max_workers
+    """
+
+    def __init__(self, jobs, buffer=GridMet.buffer, itemsize=4, **kwargs):
+        self.jobs = list(jobs)
+        self.buffer = buffer
+        self.itemsize = itemsize
+        self.kwargs = kwargs
+        self.fetches = None
+        self.report = None
+        self._gridmet = {}
+
+    def _pieces(self):
+        pieces = {}
+        for job, (variable, bbox, start, end) in enumerate(self.jobs):
+            # one GridMet per variable builds the urls and reads, the dates of a job are passed to it
+            if variable not in self._gridmet:
+                self._gridmet[variable] = GridMet(variable, start=start, end=end, bbox=bbox, **self.kwargs)
+            gridmet = self._gridmet[variable]
+            for year in range(start.year, end.year + 1):
+                index = gridmet._coordinate_index(gridmet._build_url(year, variable))
+                space, _ = index.subset(bbox, buffer=self.buffer)
+                time = index.time_slice(max(start, datetime(year, 1, 1)), min(end, datetime(year, 12, 31)))
+                pieces.setdefault((variable, year), []).append(Fetch(variable, year, space, time,
+                                                                     [(job, space, time)]))
+        return pieces
+
+    def plan(self):
+        """ Merge the jobs into fetches.
+
+        :return: list of Fetch
+        """
+        fetches, requested = [], 0
+        for (variable, year), group in sorted(self._pieces().items()):
+            requested += sum(f.cells for f in group)
+            fetches.extend(self._merge(group))
+
+        fetched = sum(f.cells for f in fetches)
+        self.fetches = fetches
+        self.report = dict(jobs=len(self.jobs), fetches=len(fetches),
+                           requested_bytes=requested * self.itemsize, fetched_bytes=fetched * self.itemsize,
+                           saved_bytes=(requested - fetched) * self.itemsize)
+        return fetches
+
+    @staticmethod
+    def _merge(group):
+        """ Merge the fetches of one file until no two are worth merging.
+
+        Fetches are kept in buckets of the grid by the cells they cover. A fetch is
+        compared with those sharing a bucket, and the union of a merge is queued to be
+        compared in turn, so the last of any two fetches to be compared saw the other.
+        """
+        def edge(axis):
+            sizes = sorted(f.space[axis].stop - f.space[axis].start for f in group)
+            return max(sizes[len(sizes) // 2], 1)
+
+        size = (edge('lat'), edge('lon'))
+        buckets, alive = {}, {}
+
+        def keys(f):
+            return [(r, c) for r in range(f.space['lat'].start // size[0], f.space['lat'].stop // size[0] + 1)
+                    for c in range(f.space['lon'].start // size[1], f.space['lon'].stop // size[1] + 1)]
+
+        def add(f):
+            alive[id(f)] = f
+            for key in keys(f):
+                buckets.setdefault(key, set()).add(id(f))
+
+        def remove(f):
+            del alive[id(f)]
+            for key in keys(f):
+                buckets[key].discard(id(f))
+
+        group = sorted(group, key=lambda f: (f.space['lat'].start, f.space['lon'].start, f.time.start))
+        for f in group:
+            add(f)
+        queue = deque(group)
+        while queue:
+            f = queue.popleft()
+            if alive.get(id(f)) is not f:
+                continue
+            near = set()
+            for key in keys(f):
+                near.update(buckets.get(key, ()))
+            near.discard(id(f))
+            for other in sorted((alive[i] for i in near), key=lambda o: (o.space['lat'].start,
+                                                                        o.space['lon'].start, o.time.start)):
+                if not f.touches(other):
+                    continue
+                union = f.union(other)
+                if union.cells <= f.cells + other.cells:
+                    remove(f)
+                    remove(other)
+                    add(union)
+                    queue.append(union)
+                    break
+
+        return sorted(alive.values(), key=lambda f: (f.space['lat'].start, f.space['lon'].start, f.time.start))
+
+    def run(self, max_workers=4):
+        """ Fetch the plan and cut each job's subset from it.
+
+        :param max_workers: threads fetching, their reads take the process's netCDF lock in turn
+        :return: list of xarray.Dataset (time, lat, lon), one per job in order
+        """
+        if self.fetches is None:
+            self.plan()
+        if not self.fetches:
+            return []
+
+        def fetch(f):
+            gridmet = self._gridmet[f.variable]
+            url = gridmet._build_url(f.year, f.variable)
+            index = gridmet._coordinate_index(url)
+            subset = gridmet._open_hyperslab(url, index, gridmet.kwords[f.variable], f.space, f.time).load()
+            return subset.rename({'day': 'time'})
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            subsets = list(pool.map(fetch, self.fetches))
+
+        def within(piece, whole):
+            return slice(piece.start - whole.start, piece.stop - whole.start)
+
+        parts = dict((job, []) for job in range(len(self.jobs)))
+        for f, subset in zip(self.fetches, subsets):
+            for job, space, time in f.pieces:
+                parts[job].append((f.year, subset.isel(time=within(time, f.time),
+                                                       lat=within(space['lat'], f.space['lat']),
+                                                       lon=within(space['lon'], f.space['lon']))))
+
+        results = []
+        for job in range(len(self.jobs)):
+            years = [subset for _, subset in sorted(parts[job], key=lambda p: p[0])]
+            results.append(concat(years, dim='time') if len(years) > 1 else years[0])
+        return results
+
+# ========================= EOF ====================================================================
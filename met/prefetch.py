@@ -0,0 +1,171 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from fiona import open as fiona_open
+from rasterio.warp import transform_bounds
+
+from bounds import GeoBounds
+from met.cache import ChunkCache
+from met.thredds import GridMet, TopoWX
+
+# grid cell size in degrees of each source, for its tiles
+RESOLUTION = {'gridmet': 1. / 24, 'topowx': 1. / 120}
+
+
+def shapefile_bounds(path):
+    """ Geographic bounds of every feature of a shapefile.
+
+    :param path: path of the shapefile
+    :return: GeoBounds
+    """
+    with fiona_open(path) as src:
+        west, south, east, north = src.bounds
+        if src.crs:
+            west, south, east, north = transform_bounds(src.crs, 'EPSG:4326', west, south, east, north)
+    return GeoBounds(west=west, south=south, east=east, north=north)
+
+
+def _source(source, variable, year, bbox, cache, **kwargs):
+    start, end = datetime(year, 1, 1), datetime(year, 12, 31)
+    if source == 'gridmet':
+        thredds = GridMet(variable, start=start, end=end, bbox=bbox, cache=cache, **kwargs)
+        url = thredds._build_url(year)
+        name = thredds.kwords[variable]
+    elif source == 'topowx':
+        thredds = TopoWX(start=start, end=end, bbox=bbox, cache=cache, **kwargs)
+        url = thredds._build_url(variable, year)
+        name = variable
+    else:
+        raise ValueError('Unknown source {}, choose from {}'.format(source, sorted(RESOLUTION)))
+    return thredds, url, name
+
+
+def prefetch(variables, years, bbox, cache_root, source='gridmet', degrees=1., max_workers=4,
+             progress=None, **kwargs):
+    """ Fetch the cache tiles of bbox for every variable and year, ahead of the runs that read them.
+
+    Work is done a tile at a time on max_workers threads, and each tile is written whole
+    or not at all. The server reads take the process's netCDF lock in turn, so threads
+    overlap the work around them rather than the reads. Tiles already in the cache are
+    skipped, so an interrupted prefetch resumes where it stopped when run again. Objects
+    made with cache=ChunkCache.tiles(cache_root) and the same degrees then read the tiles
+    rather than the server.
+
+    :param variables: GridMet or TopoWX variables, e.g. ['pr', 'tmmx'] or ['tmax']
+    :param years: years to fetch, whole years are cached
+    :param bbox: GeoBounds of the area, buffered as the reads that follow will buffer it
+    :param cache_root: directory of the tile cache, see met.cache.ChunkCache.tiles
+    :param source: 'gridmet' or 'topowx'
+    :param degrees: tile edge in degrees
+    :param max_workers: threads fetching tiles
+    :param progress: function of (bytes done, bytes in all), called after each tile
+    :param kwargs: as GridMet or TopoWX, e.g. data_root
+    :return: dict of tiles, tiles already cached, bytes in all, and bytes fetched
+    """
+    cache = ChunkCache.tiles(cache_root, degrees=degrees, resolution=RESOLUTION[source])
+
+    tasks = []
+    for variable in variables:
+        for year in years:
+            thredds, url, name = _source(source, variable, year, bbox, cache, **kwargs)
+            index = thredds._coordinate_index(url)
+            space, _ = index.subset(bbox, buffer=thredds.buffer)
+            time = index.time_slice(datetime(year, 1, 1), datetime(year, 12, 31))
+            days = time.stop - time.start
+            key = (source, variable, year)
+            for chunk in cache.chunks(space):
+                tile = cache._chunk_space([chunk], index.shape)
+                nbytes = ((tile['lat'].stop - tile['lat'].start) * (tile['lon'].stop - tile['lon'].start) *
+                          days * 4)
+                tasks.append((thredds, key, url, index, name, tile, time, nbytes))
+
+    total = sum(task[-1] for task in tasks)
+    report = dict(tiles=len(tasks), cached=0, total_bytes=total, fetched_bytes=0)
+    done = 0
+
+    def fetch(task):
+        thredds, key, url, index, name, tile, time, _ = task
+        return thredds._prefetch_tiles(key, url, index, name, tile, time)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = dict((pool.submit(fetch, task), task) for task in tasks)
+        for future in as_completed(futures):
+            fetched = future.result()
+            report['fetched_bytes'] += fetched
+            if not fetched:
+                report['cached'] += 1
+            done += futures[future][-1]
+            if progress is not None:
+                progress(done, total)
+
+    return report
+
+
+def _years(values):
+    years = []
+    for value in values:
+        if '-' in value:
+            first, last = value.split('-')
+            years.extend(range(int(first), int(last) + 1))
+        else:
+            years.append(int(value))
+    return years
+
+
+def _print_progress(done, total):
+    print('\r{:>10.1f} of {:.1f} MB, {:.1%}'.format(done / 1e6, total / 1e6, done / float(total or 1)),
+          end='', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m met.prefetch',
+                            description='Fetch GridMet or TopoWX tiles into a local cache ahead of a run.')
+    parser.add_argument('cache', help='directory of the tile cache')
+    parser.add_argument('--source', choices=sorted(RESOLUTION), default='gridmet')
+    parser.add_argument('--variables', nargs='+', required=True, help='e.g. pr tmmx, or tmax tmin')
+    parser.add_argument('--years', nargs='+', required=True, help='years or ranges, e.g. 2000-2010 2015')
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument('--bbox', nargs=4, type=float, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    area.add_argument('--shapefile', help='fetch the bounds of its features')
+    parser.add_argument('--degrees', type=float, default=1., help='tile edge in degrees')
+    parser.add_argument('--workers', type=int, default=4, help='threads fetching tiles')
+    parser.add_argument('--data-root', help='local mirror of the server, see GridMet')
+    args = parser.parse_args(argv)
+
+    if args.bbox:
+        west, south, east, north = args.bbox
+        bbox = GeoBounds(west=west, south=south, east=east, north=north)
+    else:
+        bbox = shapefile_bounds(args.shapefile)
+
+    report = prefetch(args.variables, _years(args.years), bbox, args.cache, source=args.source,
+                      degrees=args.degrees, max_workers=args.workers, progress=_print_progress,
+                      data_root=args.data_root)
+    print('', file=sys.stderr)
+    print('{tiles} tiles, {cached} already cached, {fetched_bytes:,} bytes fetched'.format(**report))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+# ========================= EOF ====================================================================
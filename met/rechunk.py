@@ -0,0 +1,139 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import os
+import re
+import sys
+from argparse import ArgumentParser
+from uuid import uuid4
+
+from netCDF4 import Dataset as NetCDFFile, date2num
+from numpy import concatenate
+from xarray import open_dataset
+
+# name of a variable's time-series store in a directory of yearly files, see GridMet
+SERIES_NAME = '{variable}_series.nc'
+TIME_UNITS = 'days since 1900-01-01 00:00:00'
+
+
+def yearly_files(src_dir, variable):
+    """ Yearly {variable}_{year}.nc files of a directory.
+
+    :param src_dir: directory of GridMet yearly files
+    :param variable: GridMet variable, e.g. 'pr'
+    :return: list of (year, path), in order of year
+    """
+    pattern = re.compile(r'^{}_(\d{{4}})\.nc$'.format(re.escape(variable)))
+    files = []
+    for name in os.listdir(src_dir):
+        match = pattern.match(name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(src_dir, name)))
+    return sorted(files)
+
+
+def rechunk(src_dir, variable, out_path=None, years=None, time_chunk=3653, space_chunk=8,
+            complevel=4, max_memory=2 ** 28):
+    """ Join yearly files of a variable into one store chunked for long series of few cells.
+
+    Yearly files are laid out for maps of a day. The store holds every day of the years
+    in (time, lat, lon) chunks of time_chunk days by space_chunk cells a side, so a cell's
+    whole record is a few chunks. It is written a block of whole chunks at a time, each
+    block read from every yearly file, so no chunk is written twice and memory stays near
+    max_memory. The store is written under a temporary name and renamed when complete.
+
+    :param src_dir: directory of {variable}_{year}.nc files
+    :param variable: GridMet variable, e.g. 'pr'
+    :param out_path: path of the store, default SERIES_NAME in src_dir
+    :param years: years to include, default every yearly file in src_dir
+    :param time_chunk: days per chunk
+    :param space_chunk: cells per chunk edge
+    :param complevel: zlib compression level, 1 to 9
+    :param max_memory: bytes of one block held in memory while writing
+    :return: out_path
+    """
+    files = [(year, path) for year, path in yearly_files(src_dir, variable) if years is None or year in years]
+    if not files:
+        raise ValueError('No {}_{{year}}.nc files in {}'.format(variable, src_dir))
+    out_path = out_path or os.path.join(src_dir, SERIES_NAME.format(variable=variable))
+
+    sources = [open_dataset(path) for _, path in files]
+    try:
+        first = sources[0]
+        name = [n for n, var in first.data_vars.items() if 'lat' in var.dims and 'lon' in var.dims][0]
+        time_dim = 'day' if 'day' in first[name].dims else 'time'
+        times = concatenate([src[time_dim].values for src in sources])
+        lat, lon = first.lat.values, first.lon.values
+
+        temp = '{}.{}.tmp'.format(out_path, uuid4().hex)
+        with NetCDFFile(temp, 'w') as nc:
+            nc.createDimension('time', len(times))
+            nc.createDimension('lat', len(lat))
+            nc.createDimension('lon', len(lon))
+            nc.createVariable('lat', 'f8', ('lat',))[:] = lat
+            nc.createVariable('lon', 'f8', ('lon',))[:] = lon
+            time = nc.createVariable('time', 'f8', ('time',))
+            time.units, time.calendar = TIME_UNITS, 'standard'
+            time[:] = date2num(times.astype('datetime64[s]').tolist(), TIME_UNITS, 'standard')
+
+            dtype = first[name].dtype
+            chunks = (min(time_chunk, len(times)), min(space_chunk, len(lat)), min(space_chunk, len(lon)))
+            data = nc.createVariable(name, dtype, ('time', 'lat', 'lon'), zlib=True, complevel=complevel,
+                                     shuffle=True, chunksizes=chunks, fill_value=_fill(dtype))
+            data.setncatts(dict((k, v) for k, v in first[name].attrs.items() if not k.startswith('_')))
+            nc.setncatts({'source_variable': variable, 'years': ' '.join(str(y) for y, _ in files)})
+
+            # a band of chunk rows, as many chunk columns as fit in max_memory
+            row_bytes = len(times) * chunks[1] * chunks[2] * dtype.itemsize
+            cols = max(1, int(max_memory // row_bytes)) * chunks[2]
+            for r0 in range(0, len(lat), chunks[1]):
+                for c0 in range(0, len(lon), cols):
+                    space = dict(lat=slice(r0, r0 + chunks[1]), lon=slice(c0, c0 + cols))
+                    block = concatenate([src[name].isel(**space).transpose(time_dim, 'lat', 'lon').values
+                                         for src in sources])
+                    data[:, space['lat'], space['lon']] = block
+        os.rename(temp, out_path)
+    finally:
+        for src in sources:
+            src.close()
+
+    return out_path
+
+
+def _fill(dtype):
+    return float('nan') if dtype.kind == 'f' else None
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog='python -m met.rechunk',
+                            description='Join yearly GridMet files into one store for point series.')
+    parser.add_argument('src_dir', help='directory of {variable}_{year}.nc files')
+    parser.add_argument('variables', nargs='+', help='GridMet variables, e.g. pr tmmx')
+    parser.add_argument('--time-chunk', type=int, default=3653, help='days per chunk')
+    parser.add_argument('--space-chunk', type=int, default=8, help='cells per chunk edge')
+    args = parser.parse_args(argv)
+
+    for variable in args.variables:
+        path = rechunk(args.src_dir, variable, time_chunk=args.time_chunk, space_chunk=args.space_chunk)
+        print('{}: {}'.format(variable, path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,79 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+from numpy import errstate, fmax, fmin, inf, isfinite, nan, nansum, where
+
+OPERATIONS = ('sum', 'mean', 'min', 'max', 'count')
+
+
+class RunningReduction(object):
+    """ Reductions over time of a stream of (time, row, col) chunks, one chunk in memory.
+
+    NaN is skipped, as in numpy.nansum and numpy.nanmin. Cells with no finite value
+    are NaN in mean, min and max, 0 in sum and count.
+
+    :param operations: any of 'sum', 'mean', 'min', 'max', 'count'
+    """
+
+    def __init__(self, operations=OPERATIONS):
+        for operation in operations:
+            if operation not in OPERATIONS:
+                raise ValueError('Unknown operation {}, choose from {}'.format(operation, OPERATIONS))
+        self.operations = tuple(operations)
+        self.steps = 0
+        self._sum = None
+        self._count = None
+        self._min = None
+        self._max = None
+
+    def update(self, chunk):
+        """ Add a chunk of the stream.
+
+        :param chunk: numpy.ndarray (time, row, col)
+        """
+        finite = isfinite(chunk)
+        count = finite.sum(axis=0)
+        total = nansum(chunk, axis=0, dtype='float64')
+        low = where(count > 0, where(finite, chunk, inf).min(axis=0), nan)
+        high = where(count > 0, where(finite, chunk, -inf).max(axis=0), nan)
+
+        if self._sum is None:
+            self._sum, self._count, self._min, self._max = total, count, low, high
+        else:
+            self._sum = self._sum + total
+            self._count = self._count + count
+            self._min = fmin(self._min, low)
+            self._max = fmax(self._max, high)
+        self.steps += chunk.shape[0]
+
+    def result(self):
+        """ Reductions of everything seen so far.
+
+        :return: dict of numpy.ndarray (1, row, col) by operation
+        """
+        if self._sum is None:
+            raise ValueError('No chunks to reduce')
+
+        with errstate(invalid='ignore', divide='ignore'):
+            mean = where(self._count > 0, self._sum / self._count, nan)
+
+        reductions = {'sum': self._sum, 'mean': mean, 'min': self._min,
+                      'max': self._max, 'count': self._count}
+        return dict((operation, reductions[operation][None]) for operation in self.operations)
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,130 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import os
+import atexit
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+
+
+class ScratchManager(object):
+    """ Scratch space for intermediate files, shared by any number of Thredds objects.
+
+    Files go under one directory made on first use in root, e.g. '/dev/shm' to keep
+    conform stages in RAM. The directory is removed on leaving a with block, on cleanup,
+    or when the interpreter exits.
+
+    :param root: parent directory of the scratch directory, default the system temp dir
+    :param max_bytes: cap on bytes held in scratch at once, None for no cap
+    :param prefix: prefix of the scratch directory name
+    """
+
+    def __init__(self, root=None, max_bytes=None, prefix='met_'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+
+        self.bytes_written = 0
+        self.bytes_in_use = 0
+
+        self._directory = None
+        self._files = {}
+        self._lock = Lock()
+        atexit.register(self.cleanup)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    @property
+    def directory(self):
+        """ The scratch directory, made on first use.
+        """
+        with self._lock:
+            if self._directory is None or not os.path.isdir(self._directory):
+                self._directory = mkdtemp(prefix=self.prefix, dir=self.root)
+            return self._directory
+
+    def mkdtemp(self, prefix='tmp'):
+        """ Make a new directory in scratch, remove it with release.
+
+        :param prefix: prefix of the directory name
+        :return: path
+        """
+        return mkdtemp(prefix=prefix, dir=self.directory)
+
+    def reserve(self, nbytes):
+        """ Claim room for a file about to be written.
+
+        :param nbytes: expected size of the file
+        :return: nbytes, to pass to add once the file is written
+        """
+        with self._lock:
+            if self.max_bytes is not None and self.bytes_in_use + nbytes > self.max_bytes:
+                raise IOError('Scratch {} is full, {} bytes in use of {}, {} more requested'.format(
+                    self._directory, self.bytes_in_use, self.max_bytes, nbytes))
+            self.bytes_in_use += nbytes
+        return nbytes
+
+    def add(self, path, reserved=0):
+        """ Account for a written file, settling any room reserved for it.
+
+        A path that was never written only frees its reserved room.
+
+        :param path: path of the written file
+        :param reserved: bytes reserved for it with reserve
+        :return: size of the file
+        """
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self._lock:
+            self.bytes_in_use += size - reserved
+            if size:
+                self.bytes_written += size
+                self._files[os.path.abspath(path)] = size
+        return size
+
+    def release(self, path):
+        """ Remove a file or directory from scratch and free its room.
+
+        :param path: file, or directory made with mkdtemp
+        """
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+        with self._lock:
+            gone = [f for f in self._files if f == path or f.startswith(path + os.sep)]
+            for f in gone:
+                self.bytes_in_use -= self._files.pop(f)
+
+    def cleanup(self):
+        """ Remove the scratch directory and everything in it.
+        """
+        with self._lock:
+            if self._directory is not None:
+                rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+            self._files.clear()
+            self.bytes_in_use = 0
+
+# ========================= EOF ====================================================================
@@ -20,18 +20,32 @@ from future.standard_library import hooks
 
 import os
 import copy
-from shutil import rmtree
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import mkdtemp
-from numpy import empty, float32, datetime64, timedelta64, argmin, abs, array, floor, mean, sum
+from numpy import empty, float32, float64, int64, datetime64, timedelta64, array, arange, floor, mean, sum
 from rasterio import open as rasopen
+from rasterio.env import Env
+from rasterio.io import MemoryFile
 from rasterio.crs import CRS
-from rasterio.transform import Affine
+from rasterio.transform import Affine, from_bounds
 from rasterio.mask import mask
+from rasterio.features import geometry_mask
 from rasterio.warp import reproject, Resampling
 from rasterio.warp import calculate_default_transform as cdt
 
-from xarray import open_dataset
-from pandas import date_range, DataFrame
+from met.coordinates import CoordinateCache
+from met.handles import DatasetPool
+from met.rechunk import SERIES_NAME
+from met.reduce import RunningReduction
+from met.scratch import ScratchManager
+from met.zonal import ZonalWeights
+from met.warp import WarpPlan, FusedWarpPlan, AlignedPlan, WarpPlanCache, aligned_grid, \
+    warp_plan_key, warp_tiled
+
+from netCDF4 import Dataset as NetCDFFile, date2num
+from xarray import open_dataset, concat, Dataset
+from pandas import date_range, DataFrame, Timestamp
 import warnings
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -46,45 +60,289 @@ class Thredds(object):
     
     """
 
+    # warp plans are shared by every instance, so one target_profile is planned once per process
+    plan_cache = WarpPlanCache()
+    # coordinates, and open datasets, of each url are shared too, see met.coordinates and met.handles;
+    # CoordinateCache(root=directory) keeps the coordinates of remote urls across processes
+    coordinate_cache = CoordinateCache()
+    handles = DatasetPool()
+    # temp GeoTIFFs of the staged conform, shared unless an instance is given its own
+    scratch = ScratchManager()
+
     def __init__(self, start=None, end=None, date=None,
-                 bounds=None, target_profile=None, lat=None, lon=None
-                 ):
+                 bounds=None, target_profile=None, lat=None, lon=None,
+                 in_memory=False, fused=False, tile_size=None, num_threads=2,
+                 gdal_cachemax=None, warp_mem_limit=0, resampling=Resampling.cubic,
+                 scratch=None, max_workers=4, cache=None, lazy=False, data_root=None):
         self.start = start
         self.end = end
         self.date = date
 
         self.src_bounds_wsen = None
 
+        # conform through a cached in-memory plan rather than temp GeoTIFFs
+        self.in_memory = in_memory
+        # resample once from the geographic subset straight to the target grid
+        self.fused = fused
+        # fused conform streamed to out_file in tiles of this many target cells a side
+        self.tile_size = tile_size
+
+        # GDAL performance settings, applied to every warp of conform
+        self.num_threads = num_threads
+        self.gdal_cachemax = gdal_cachemax
+        self.warp_mem_limit = warp_mem_limit
+        self.resampling = resampling
+
+        # threads when a request spans several files, their reads take the process's netCDF lock in turn
+        self.max_workers = max_workers
+        # met.cache.ChunkCache to keep fetched subsets on disk, None to always fetch
+        self.cache = cache
+        # return dask-backed subsets, read chunk by chunk when computed
+        self.lazy = lazy
+        # local mirror of the server's files, read in place of any url it has a file for
+        self.data_root = data_root
+
         self.target_profile = target_profile
+        self.clip_feature = None
+        # staged conform writes under temp_dir if set, else in a directory of scratch
+        self.temp_dir = None
+        if scratch is not None:
+            self.scratch = scratch
         self.bbox = bounds
         self.lat = lat
         self.lon = lon
 
-    def conform(self, subset, out_file=None):
+    def conform(self, subset, out_file=None, src_bounds=None):
+        """ Conform a source array to target_profile.
+
+        Nothing is kept on the instance and the temp GeoTIFF path stages in its own
+        directory, so one object can conform from many threads, see conform_many.
+
+        :param subset: numpy.ndarray (band, row, col) in EPSG:4326
+        :param out_file: path to save the result to
+        :param src_bounds: (west, south, east, north) cell centers of subset, default src_bounds_wsen
+        :return: numpy.ndarray (band, row, col), or out_file when tiled
+        """
         if subset.dtype != float32:
             subset = array(subset, dtype=float32)
-        self._project(subset)
-        self._reproject()
-        self._mask()
-        result = self._resample()
+        if src_bounds is None:
+            src_bounds = self.src_bounds_wsen
+        if self.tile_size:
+            return self.conform_tiled(subset, out_file, tile_size=self.tile_size,
+                                      src_bounds=src_bounds)
+        with self._gdal_env():
+            if self.in_memory or self.fused or self._aligned_grid(subset.shape[1:], src_bounds):
+                plan = self.warp_plan(subset.shape[1:], src_bounds)
+                result = plan.apply(subset, resampling=self._resampling(), **self._warp_options())
+            else:
+                result = self._conform_staged(subset, src_bounds)
         if out_file:
             self.save_raster(result, self.target_profile, output_filename=out_file)
         return result
 
-    def _project(self, subset):
+    def conform_many(self, arrays, out_files=None, src_bounds=None, max_workers=None):
+        """ Conform a list of source arrays on a thread pool.
+
+        GDAL releases the GIL while warping, so arrays conform in parallel.
+
+        :param arrays: list of numpy.ndarray (band, row, col) on the same source grid
+        :param out_files: list of paths, one per array, or None
+        :param src_bounds: (west, south, east, north) cell centers of the arrays
+        :param max_workers: threads in the pool, default from concurrent.futures
+        :return: list of conform results, in the order of arrays
+        """
+        if out_files is None:
+            out_files = [None] * len(arrays)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(self.conform, arr, out_file=out_file, src_bounds=src_bounds)
+                       for arr, out_file in zip(arrays, out_files)]
+            return [future.result() for future in futures]
+
+    def conform_tiled(self, subset, out_file, tile_size=1024, src_bounds=None):
+        """ Fused conform written to out_file one target tile at a time.
+
+        Nothing the size of the target grid is held in memory, so the result is left
+        in out_file rather than returned.
+
+        :param subset: numpy.ndarray (band, row, col) on the source grid
+        :param out_file: path of the raster to write
+        :param tile_size: target tile edge in cells
+        :param src_bounds: (west, south, east, north) cell centers of subset, default src_bounds_wsen
+        :return: out_file
+        """
+        if not out_file:
+            raise ValueError('tiled conform streams to a raster, out_file is required')
+        if subset.dtype != float32:
+            subset = array(subset, dtype=float32)
+        if src_bounds is None:
+            src_bounds = self.src_bounds_wsen
+
+        with self._gdal_env():
+            return warp_tiled(subset, self._src_transform(subset.shape[1:], src_bounds),
+                              CRS({'init': 'epsg:4326'}), self.target_profile, out_file,
+                              clip_feature=self.clip_feature, fill=self._fill(),
+                              tile_size=tile_size, resampling=self._resampling(),
+                              **self._warp_options())
+
+    def warp_plan(self, src_shape, src_bounds=None):
+        """ Get the WarpPlan from a source grid to target_profile, building it on first use.
+
+        :param src_shape: (rows, cols) of the source array
+        :param src_bounds: (west, south, east, north) cell centers of the source, default src_bounds_wsen
+        :return: met.warp.WarpPlan or met.warp.FusedWarpPlan
+        """
+        if src_bounds is None:
+            src_bounds = self.src_bounds_wsen
+
+        aligned = self._aligned_grid(src_shape, src_bounds)
+        if aligned:
+            engine = 'aligned'
+        elif self.fused:
+            engine = 'fused'
+        else:
+            engine = 'staged'
+
+        key = warp_plan_key(src_shape, self._bounds_or_bbox(src_bounds), self.target_profile,
+                            self.clip_feature, engine=engine)
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            if aligned:
+                plan = AlignedPlan(src_shape, self._dst_shape(), *aligned,
+                                   outside=self._outside(), fill=self._fill())
+            elif self.fused:
+                plan = self._build_fused_plan(src_shape, src_bounds)
+            else:
+                plan = self._build_warp_plan(src_shape, src_bounds)
+            self.plan_cache.put(key, plan)
+        return plan
+
+    def _aligned_grid(self, src_shape, src_bounds):
+        """ Line up an EPSG:4326 target_profile with the source grid, see met.warp.aligned_grid.
+
+        Aligned targets, such as the native GridMet grid, are conformed by slicing,
+        replicating or averaging cells, with no warp.
+        """
+        if self.target_profile['crs'] != CRS({'init': 'epsg:4326'}):
+            return None
+        return aligned_grid(self._src_transform(src_shape, src_bounds), src_shape,
+                            self._dst_transform(), self._dst_shape())
+
+    def _dst_transform(self):
+        try:
+            return self.target_profile['affine']
+        except KeyError:
+            return self.target_profile['transform']
+
+    def _dst_shape(self):
+        return self.target_profile['height'], self.target_profile['width']
 
-        proj_path = os.path.join(self.temp_dir, 'tiled_proj.tif')
-        setattr(self, 'projection', proj_path)
+    def _outside(self):
+        if not self.clip_feature:
+            return None
+        return geometry_mask([self.clip_feature], out_shape=self._dst_shape(),
+                             transform=self._dst_transform(), all_touched=True)
 
-        profile = copy.deepcopy(self.target_profile)
-        profile['dtype'] = float32
-        bb = self.bbox.as_tuple()
+    def _gdal_env(self):
+        if self.gdal_cachemax:
+            return Env(GDAL_CACHEMAX=self.gdal_cachemax)
+        return Env()
 
-        if self.src_bounds_wsen:
-            bounds = self.src_bounds_wsen
+    def _warp_options(self):
+        return {'num_threads': self.num_threads, 'warp_mem_limit': self.warp_mem_limit}
+
+    def _resampling(self):
+        try:
+            return Resampling[self.resampling]
+        except KeyError:
+            return self.resampling
+
+    def _conform_staged(self, subset, src_bounds):
+        if self.temp_dir:
+            temp_dir = mkdtemp(prefix='conform_', dir=self.temp_dir)
         else:
-            bounds = (bb[0], bb[1],
-                      bb[2], bb[3])
+            temp_dir = self.scratch.mkdtemp(prefix='conform_')
+        try:
+            stage = self._project(subset, src_bounds, self.target_profile, temp_dir)
+            stage = self._reproject(stage, self.target_profile, temp_dir)
+            stage = self._mask(stage, self.clip_feature, temp_dir)
+            return self._resample(stage, self.target_profile, temp_dir)
+        finally:
+            self.scratch.release(temp_dir)
+
+    def _build_fused_plan(self, src_shape, src_bounds):
+        """ Plan one cubic warp from the EPSG:4326 subset to the target grid.
+
+        Unlike _project, src_bounds are taken as the cell centers they are read from.
+        """
+        return FusedWarpPlan(src_shape, self._src_transform(src_shape, src_bounds),
+                             CRS({'init': 'epsg:4326'}), self._dst_transform(),
+                             self.target_profile['crs'], self._dst_shape(), self._outside(),
+                             self._fill())
+
+    def _src_transform(self, src_shape, src_bounds):
+        rows, cols = src_shape
+        west, south, east, north = self._bounds_or_bbox(src_bounds)
+        if src_bounds and rows > 1 and cols > 1:
+            x_res, y_res = (east - west) / (cols - 1), (north - south) / (rows - 1)
+            west, east = west - x_res / 2., east + x_res / 2.
+            south, north = south - y_res / 2., north + y_res / 2.
+        return from_bounds(west, south, east, north, cols, rows)
+
+    def _build_warp_plan(self, src_shape, src_bounds):
+        """ Trace source cell indices through the in-memory conform stages.
+
+        Indices survive the nearest-neighbour stages unchanged. They are traced in float64,
+        as float32 holds them exactly only for grids under 2 ** 24 cells.
+        """
+        # clipped cells are told apart from uncovered cells by a nodata of -1
+        profile = dict(self.target_profile, nodata=-1.)
+
+        rows, cols = src_shape
+        index = (arange(rows * cols, dtype=float64) + 1.).reshape(1, rows, cols)
+        stage = self._project(index, src_bounds, profile, dtype=float64)
+        stage = self._reproject(stage, profile, dtype=float64)
+        stage = self._mask(stage, self.clip_feature)
+
+        with self._open_stage(stage) as src:
+            index = src.read(1).astype(int64)
+            src_transform, crs = src.transform, src.crs
+        self._release_stage(stage)
+
+        dst_transform, dst_shape = self._resample_geometry(index.shape, src_transform,
+                                                           self.target_profile)
+        row_map = self._fit_map(dst_shape[0], self.target_profile['height'])
+        col_map = self._fit_map(dst_shape[1], self.target_profile['width'])
+
+        return WarpPlan(src_shape, index, self._fill(), src_transform, dst_transform,
+                        crs, dst_shape, row_map, col_map)
+
+    @staticmethod
+    def _fit_map(size, target_size):
+        """ Which of size cells GDAL writes to each of target_size cells, see _resample."""
+        profile = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1,
+                   'width': 1, 'height': target_size, 'transform': Affine(2., 0., 0., 0., -2., 0.)}
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                dst.write(arange(size, dtype=float32).reshape(1, size, 1))
+            with memfile.open() as src:
+                return src.read(1)[:, 0].astype(int64)
+
+    def _fill(self):
+        nodata = self.target_profile.get('nodata')
+        return 0. if nodata is None else nodata
+
+    def _bounds_or_bbox(self, src_bounds):
+        if src_bounds:
+            return src_bounds
+        bb = self.bbox.as_tuple()
+        return bb[0], bb[1], bb[2], bb[3]
+
+    def _project(self, subset, src_bounds, target_profile, temp_dir=None, dtype=float32):
+
+        profile = copy.deepcopy(target_profile)
+        profile['dtype'] = dtype
+        bounds = self._bounds_or_bbox(src_bounds)
 
         dst_affine, dst_width, dst_height = cdt(CRS({'init': 'epsg:4326'}),
                                                 CRS({'init': 'epsg:4326'}),
@@ -99,21 +357,19 @@ class Thredds(object):
                         'height': dst_height})
         if subset.shape[0] > 1:
             profile.update({'count': subset.shape[0]})
-        with rasopen(proj_path, 'w', **profile) as dst:
-            dst.write(subset)
 
-    def _reproject(self):
+        return self._write_stage('tiled_proj.tif', profile, subset, temp_dir)
 
-        reproj_path = os.path.join(self.temp_dir, 'reproj.tif')
-        setattr(self, 'reprojection', reproj_path)
+    def _reproject(self, projection, target_profile, temp_dir=None, dtype=float32):
 
-        with rasopen(self.projection, 'r') as src:
+        with self._open_stage(projection) as src:
             src_profile = src.profile
             src_bounds = src.bounds
-            src_array = src.read(1)
+            src_array = src.read()
+        self._release_stage(projection)
 
-        dst_profile = copy.deepcopy(self.target_profile)
-        dst_profile['dtype'] = float32
+        dst_profile = copy.deepcopy(target_profile)
+        dst_profile['dtype'] = dtype
         bounds = src_bounds
         dst_affine, dst_width, dst_height = cdt(src_profile['crs'],
                                                 dst_profile['crs'],
@@ -124,78 +380,222 @@ class Thredds(object):
         dst_profile.update({'crs': dst_profile['crs'],
                             'transform': dst_affine,
                             'width': dst_width,
-                            'height': dst_height})
+                            'height': dst_height,
+                            'count': src_array.shape[0]})
 
-        with rasopen(reproj_path, 'w', **dst_profile) as dst:
-            dst_array = empty((1, dst_height, dst_width), dtype=float32)
+        # all bands of the stack are warped in one call
+        dst_array = empty((src_array.shape[0], dst_height, dst_width), dtype=dtype)
 
-            reproject(src_array, dst_array, src_transform=src_profile['transform'],
-                      src_crs=src_profile['crs'], dst_crs=self.target_profile['crs'],
-                      dst_transform=dst_affine, resampling=Resampling.nearest,
-                      num_threads=2)
+        reproject(src_array, dst_array, src_transform=src_profile['transform'],
+                  src_crs=src_profile['crs'], dst_crs=target_profile['crs'],
+                  dst_transform=dst_affine, resampling=Resampling.nearest,
+                  **self._warp_options())
 
-            dst.write(dst_array.reshape(1, dst_array.shape[1], dst_array.shape[2]))
+        return self._write_stage('reproj.tif', dst_profile, dst_array, temp_dir)
 
-    def _mask(self):
+    def _mask(self, reprojection, clip_feature, temp_dir=None):
 
-        mask_path = os.path.join(self.temp_dir, 'masked.tif')
-
-        with rasopen(self.reprojection) as src:
-            out_arr, out_trans = mask(src, [self.clip_feature], crop=True,
+        with self._open_stage(reprojection) as src:
+            out_arr, out_trans = mask(src, [clip_feature], crop=True,
                                       all_touched=True)
             out_meta = src.meta.copy()
             out_meta.update({'driver': 'GTiff',
                              'height': out_arr.shape[1],
                              'width': out_arr.shape[2],
                              'transform': out_trans})
+        self._release_stage(reprojection)
 
-        with rasopen(mask_path, 'w', **out_meta) as dst:
-            dst.write(out_arr)
-
-        setattr(self, 'mask', mask_path)
-        delattr(self, 'reprojection')
+        return self._write_stage('masked.tif', out_meta, out_arr, temp_dir)
 
-    def _resample(self):
+    def _resample(self, masked, target_profile, temp_dir=None):
 
         # home = os.path.expanduser('~')
         # resample_path = os.path.join(home, 'images', 'sandbox', 'thredds', 'resamp_twx_{}.tif'.format(var))
 
-        resample_path = os.path.join(self.temp_dir, 'resample.tif')
-
-        with rasopen(self.mask, 'r') as src:
-            array = src.read(1)
+        with self._open_stage(masked) as src:
+            array = src.read()
             profile = src.profile
-            res = src.res
-            try:
-                target_affine = self.target_profile['affine']
-            except KeyError:
-                target_affine = self.target_profile['transform']
-            target_res = target_affine.a
-            res_coeff = res[0] / target_res
-
-            new_array = empty(shape=(1, int(floor(array.shape[0] * res_coeff)),
-                                     int(floor(array.shape[1] * res_coeff))), dtype=float32)
             aff = src.transform
 
-            new_affine = Affine(aff.a / res_coeff, aff.b, aff.c, aff.d, aff.e / res_coeff, aff.f)
+            new_affine, new_shape = self._resample_geometry(array.shape[1:], aff, target_profile)
+            new_array = empty(shape=(array.shape[0],) + new_shape, dtype=float32)
 
-            profile['transform'] = self.target_profile['transform']
-            profile['width'] = self.target_profile['width']
-            profile['height'] = self.target_profile['height']
+            profile['transform'] = target_profile['transform']
+            profile['width'] = target_profile['width']
+            profile['height'] = target_profile['height']
             profile['dtype'] = str(new_array.dtype)
 
-            delattr(self, 'mask')
+            reproject(array, new_array, src_transform=aff, dst_transform=new_affine, src_crs=src.crs,
+                      dst_crs=src.crs, resampling=self._resampling(), **self._warp_options())
 
-            with rasopen(resample_path, 'w', **profile) as dst:
-                reproject(array, new_array, src_transform=aff, dst_transform=new_affine, src_crs=src.crs,
-                          dst_crs=src.crs, resampling=Resampling.cubic)
+        self._release_stage(masked)
 
-                dst.write(new_array)
+        # the round trip through a dataset of the target shape is kept on purpose,
+        # GDAL fits new_array to the target width and height on write
+        resampled = self._write_stage('resample.tif', profile, new_array, temp_dir)
 
-            with rasopen(resample_path, 'r') as src:
-                arr = src.read()
+        with self._open_stage(resampled) as src:
+            arr = src.read()
+        self._release_stage(resampled)
 
-            return arr
+        return arr
+
+    @staticmethod
+    def _resample_geometry(shape, aff, target_profile):
+        """ Affine and shape of the masked grid scaled to the target resolution."""
+        try:
+            target_affine = target_profile['affine']
+        except KeyError:
+            target_affine = target_profile['transform']
+        target_res = target_affine.a
+        res_coeff = aff.a / target_res
+
+        new_shape = int(floor(shape[0] * res_coeff)), int(floor(shape[1] * res_coeff))
+        new_affine = Affine(aff.a / res_coeff, aff.b, aff.c, aff.d, aff.e / res_coeff, aff.f)
+        return new_affine, new_shape
+
+    def _write_stage(self, name, profile, arr, temp_dir=None):
+        """ Write an intermediate conform stage.
+
+        Stages go to temp_dir as GeoTIFF, counted against scratch, or to a rasterio
+        MemoryFile with no temp_dir.
+
+        :param name: file name of the stage in temp_dir
+        :param profile: rasterio profile of the stage
+        :param arr: numpy.ndarray (band, row, col)
+        :param temp_dir: directory for the stage, None to keep it in memory
+        :return: path or rasterio.io.MemoryFile
+        """
+        if temp_dir is None:
+            memfile = MemoryFile()
+            with memfile.open(**profile) as dst:
+                dst.write(arr)
+            return memfile
+
+        path = os.path.join(temp_dir, name)
+        reserved = self.scratch.reserve(arr.nbytes)
+        try:
+            with rasopen(path, 'w', **profile) as dst:
+                dst.write(arr)
+        finally:
+            self.scratch.add(path, reserved)
+        return path
+
+    @staticmethod
+    def _open_stage(stage):
+        if isinstance(stage, MemoryFile):
+            return stage.open()
+        return rasopen(stage, 'r')
+
+    def _release_stage(self, stage):
+        if isinstance(stage, MemoryFile):
+            stage.close()
+        else:
+            self.scratch.release(stage)
+
+    # file names under data_root, relative, formatted with variable and year
+    local_names = ()
+    # degrees read around bbox, for the conform to resample from
+    buffer = 1.
+
+    def _local_path(self, names=None, **fields):
+        """ File of a local mirror under data_root, the first of names that exists.
+
+        :param names: relative paths to try, default local_names
+        :param fields: values to format the names with, e.g. variable='pr', year=2014
+        :return: path, or None if there is no data_root or no such file in it
+        """
+        if not self.data_root:
+            return None
+        for name in (names or self.local_names):
+            path = os.path.join(self.data_root, name.format(**fields))
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _coordinate_index(self, url):
+        """ The cached met.coordinates.CoordinateIndex of url, opened only on first use.
+
+        :param url: url or path of the dataset
+        :return: CoordinateIndex
+        """
+        index = self.coordinate_cache.get(url)
+        if index is None:
+            if self.coordinate_cache.expired(url):
+                # the pooled handle is as old as the index, reopen it for the days added since
+                self.handles.close(url)
+            index = self.coordinate_cache.get(url, self.handles.get(url))
+        return index
+
+    # dask chunks of a lazy open where the file has no chunking of its own
+    lazy_chunks = {'day': 30, 'time': 30}
+
+    def _open_hyperslab(self, url, index, variable, space, time=None):
+        """ Open variable over index slices of space and time.
+
+        The dataset's open handle is sliced, so an OPeNDAP server sends only the hyperslab,
+        with no new DDS and DAS requests after the first. When lazy, it is sliced into dask
+        chunks on the file's own chunk edges, each chunk read on compute.
+
+        :param url: url or path of the dataset
+        :param index: CoordinateIndex of url
+        :param variable: name of the gridded variable
+        :param space: dict of lat and lon slices, see CoordinateIndex.subset
+        :param time: slice of time, see CoordinateIndex.time_slice
+        :return: xarray.Dataset
+        """
+        if time is not None:
+            space = dict(space, **{index.time_dim: time})
+        subset = self.handles.get(url)[[variable]].isel(**space)
+        if self.lazy:
+            subset = subset.chunk(index.aligned_chunks(space, default=self.lazy_chunks))
+        return subset
+
+    def _cached_hyperslab(self, key, url, index, variable, space, time=None, days=None):
+        """ Open variable over space for a year through the chunk cache.
+
+        Missing chunks are fetched with _open_hyperslab for all of time, and days of it
+        are read from them.
+
+        :param key: (source, variable, year) of the cache
+        :param url: url or path of the dataset
+        :param index: CoordinateIndex of url
+        :param variable: name of the gridded variable
+        :param space: dict of lat and lon slices, see CoordinateIndex.subset
+        :param time: slice of the year's days on the time axis, default all of it
+        :param days: slice of the year's days to read, counted from the first of time, default all
+        :return: xarray.Dataset
+        """
+        def fetch(chunk_space):
+            # in the index's layout, a batch shares one index among files that may differ
+            subset = self._open_hyperslab(url, index, variable, chunk_space, time)
+            return subset[variable].transpose(*index.dims).values
+
+        arr = self.cache.read(key, space, index.shape, index.dims, fetch, self._cached_length(index, time), days)
+        coords = dict(lat=index.lat[space['lat']], lon=index.lon[space['lon']])
+        if index.time_dim:
+            coords[index.time_dim] = index.time[time or slice(None)][days or slice(None)]
+        return Dataset({variable: (index.dims, arr)}, coords=coords)
+
+    @staticmethod
+    def _cached_length(index, time=None):
+        """ Days the source holds for a cached year, so chunks of a year still growing are refetched.
+        """
+        if index.time is None:
+            return None
+        return len(index.time[time or slice(None)])
+
+    def _prefetch_tiles(self, key, url, index, variable, space, time=None):
+        """ Fetch the cache's missing tiles of space for a year, see met.cache.ChunkCache.prefetch.
+
+        :param time: slice of the year's days on the time axis, default all of it
+        :return: bytes fetched
+        """
+        def fetch(chunk_space):
+            subset = self._open_hyperslab(url, index, variable, chunk_space, time)
+            return subset[variable].transpose(*index.dims).values
+
+        return self.cache.prefetch(key, space, index.shape, index.dims, fetch, self._cached_length(index, time))
 
     def _date_index(self):
         date_ind = date_range(self.start, self.end, freq='d')
@@ -209,11 +609,11 @@ class Thredds(object):
 
     @staticmethod
     def save_raster(arr, geometry, output_filename):
-        try:
-            arr = arr.reshape(1, arr.shape[1], arr.shape[2])
-        except IndexError:
+        if arr.ndim == 2:
             arr = arr.reshape(1, arr.shape[0], arr.shape[1])
+        geometry = copy.deepcopy(geometry)
         geometry['dtype'] = str(arr.dtype)
+        geometry['count'] = arr.shape[0]
 
         with rasopen(output_filename, 'w', **geometry) as dst:
             dst.write(arr)
@@ -236,13 +636,25 @@ class TopoWX(Thredds):
     :param variables: List  of available variables. At lease one.
     :param date: single-day datetime date object
     :param bounds: met.misc.BBox object representing spatial bounds, default to conterminous US
+    :param in_memory: conform through a cached met.warp.WarpPlan, no intermediate GeoTIFFs
+    :param fused: conform in a single cubic warp from the geographic subset, see met.warp.FusedWarpPlan
+    :param tile_size: stream fused conform to out_file in tiles this many cells a side
+    :param num_threads: GDAL warp threads, default 2
+    :param gdal_cachemax: GDAL block cache size in MB, default GDAL's own
+    :param warp_mem_limit: GDAL warp working memory in MB, default GDAL's own
+    :param resampling: rasterio.warp.Resampling kernel, or its name, of the final resample, default cubic
+    :param scratch: met.scratch.ScratchManager for temp GeoTIFFs, default one shared by all instances
+    :param cache: met.cache.ChunkCache to keep fetched subsets on disk and read them from, default None
+    :param lazy: return subsets as dask-backed xarray.DataArray on the native grid, chunked on the
+        file's own chunks and read in parallel when computed, rather than conformed arrays
+    :param data_root: directory of a local mirror, files found there by local_names are read
+        in place of the server's, which is used for the rest
+    :param buffer: degrees read around bbox, default 1
     :return: numpy.ndarray """
 
     def __init__(self, **kwargs):
         Thredds.__init__(self)
 
-        self.temp_dir = mkdtemp()
-
         for key, val in kwargs.items():
             setattr(self, key, val)
 
@@ -256,43 +668,58 @@ class TopoWX(Thredds):
 
         self.year = self.start.year
 
+    # yearly files of a local mirror, as TopoWX distributes them
+    local_names = ('{variable}_{year}.nc', '{variable}/{variable}_{year}.nc')
+
     def get_data_subset(self, grid_conform=False, var='tmax',
                         out_file=None, temp_units_out='C'):
 
         if var not in self.variables:
             raise TypeError('Must choose from "tmax" or "tmin"..')
 
-        url = self._build_url(var)
-        xray = open_dataset(url)
-
         start = self._dtime_to_dtime64(self.start)
         end = self._dtime_to_dtime64(self.end)
 
         if self.date:
             end = end + timedelta64(1, 'D')
 
-        # find index and value of bounds
-        # 1/100 degree adds a small buffer for this 800 m res data
-        north_ind = argmin(abs(xray.lat.values - (self.bbox.north + 1.)))
-        south_ind = argmin(abs(xray.lat.values - (self.bbox.south - 1.)))
-        west_ind = argmin(abs(xray.lon.values - (self.bbox.west - 1.)))
-        east_ind = argmin(abs(xray.lon.values - (self.bbox.east + 1.)))
-
-        north_val = xray.lat.values[north_ind]
-        south_val = xray.lat.values[south_ind]
-        west_val = xray.lon.values[west_ind]
-        east_val = xray.lon.values[east_ind]
-
-        setattr(self, 'src_bounds_wsen', (west_val, south_val,
-                                          east_val, north_val))
+        # years in local yearly files are read from them, the rest from the one remote dataset
+        urls = []
+        for year in range(self.start.year, self.end.year + 1):
+            url = self._build_url(var, year)
+            if urls and urls[-1][0] == url:
+                urls[-1][1].append(year)
+            else:
+                urls.append((url, [year]))
+
+        subsets = []
+        for url, years in urls:
+            # find index and value of bounds, buffered by a degree
+            index = self._coordinate_index(url)
+            space, src_bounds = index.subset(self.bbox, buffer=self.buffer)
+            setattr(self, 'src_bounds_wsen', src_bounds)
+
+            if self.cache is None:
+                # each source gives only the days of its own years
+                first = max(start, datetime64('{}-01-01'.format(years[0])))
+                last = min(end, datetime64('{}-12-31'.format(years[-1])))
+                subsets.append(self._open_hyperslab(url, index, var, space, index.time_slice(first, last)))
+            else:
+                subsets.extend(self._cached_hyperslab(
+                    ('topowx', var, year), url, index, var, space,
+                    index.time_slice(datetime(year, 1, 1), datetime(year, 12, 31))) for year in years)
 
-        subset = xray.loc[dict(time=slice(start, end),
-                               lat=slice(north_val, south_val),
-                               lon=slice(west_val, east_val))]
+        subset = concat(subsets, dim='time') if len(subsets) > 1 else subsets[0]
+        if self.cache is not None:
+            subset = subset.loc[dict(time=slice(start, end))]
 
         date_ind = self._date_index()
         subset['time'] = date_ind
 
+        if self.lazy:
+            arr = subset[var].transpose('time', 'lat', 'lon')
+            return arr + 273.15 if temp_units_out == 'K' else arr
+
         if not grid_conform:
             setattr(self, var, subset)
 
@@ -307,16 +734,20 @@ class TopoWX(Thredds):
             if temp_units_out == 'K':
                 arr += 273.15
 
-            conformed_array = self.conform(arr, out_file=out_file)
+            conformed_array = self.conform(arr, out_file=out_file, src_bounds=src_bounds)
 
             return conformed_array
 
-    def _build_url(self, var):
+    def _build_url(self, var=None, year=None):
+
+        local = self._local_path(variable=var or 'tmax', year=year or self.year)
+        if local:
+            return local
 
         # ParseResult('scheme', 'netloc', 'path', 'params', 'query', 'fragment')
+        # tmin and tmax are in one dataset, the bbox and dates are sliced from its open handle
         url = urlunparse([self.scheme, self.service,
-                          '/thredds/dodsC/topowx?crs,lat[0:1:3249],lon[0:1:6999],{},'
-                          'time'.format(var),
+                          '/thredds/dodsC/topowx',
                           '', '', ''])
 
         return url
@@ -355,9 +786,26 @@ class GridMet(Thredds):
     :param variables: List  of available variables. At lease one.
     :param date: single-day datetime date object
     :param bbox: met.misc.BBox object representing spatial bounds, default to conterminous US
+    :param in_memory: conform through a cached met.warp.WarpPlan, no intermediate GeoTIFFs
+    :param fused: conform in a single cubic warp from the geographic subset, see met.warp.FusedWarpPlan
+    :param tile_size: stream fused conform to out_file in tiles this many cells a side
+    :param num_threads: GDAL warp threads, default 2
+    :param gdal_cachemax: GDAL block cache size in MB, default GDAL's own
+    :param warp_mem_limit: GDAL warp working memory in MB, default GDAL's own
+    :param resampling: rasterio.warp.Resampling kernel, or its name, of the final resample, default cubic
+    :param scratch: met.scratch.ScratchManager for temp GeoTIFFs, default one shared by all instances
+    :param max_workers: threads fetching yearly files when start and end span years, default 4
+    :param cache: met.cache.ChunkCache to keep fetched subsets on disk and read them from, default None
+    :param lazy: return subsets as dask-backed xarray.DataArray on the native grid, chunked on the
+        file's own chunks and read in parallel when computed, rather than conformed arrays
+    :param data_root: directory of a local mirror, files found there by local_names are read
+        in place of the server's, which is used for the rest
+    :param buffer: degrees read around bbox, default 1
     :return: numpy.ndarray
 
-    Must have either start and end, or date.
+    Must have either start and end, or date. A range across years is read from each
+    yearly file and joined along time. netCDF and OPeNDAP reads share one lock
+    for the process, so the files are read one after another whatever max_workers.
     Must have at least one valid variable. Invalid variables will be excluded gracefully.
 
     note: NetCDF dates are in xl '1900' format, i.e., number of days since 1899-12-31 23:59
@@ -374,8 +822,6 @@ class GridMet(Thredds):
         self.service = 'thredds.northwestknowledge.net:8080'
         self.scheme = 'http'
 
-        self.temp_dir = mkdtemp()
-
         self.variable = variable
         self.available = ['elev', 'pr', 'rmax', 'rmin', 'sph', 'srad',
                           'th', 'tmmn', 'tmmx', 'pet', 'vs', 'erc', 'bi',
@@ -412,62 +858,72 @@ class GridMet(Thredds):
         if not self.bbox and not self.lat:
             self.bbox = GeoBounds()
 
-    def get_data_subset(self, out_filename=None, file_url=None):
-
-        if file_url:
-            xray = open_dataset(file_url)
-        else:
-            url = self._build_url()
-            xray = open_dataset(url)
-
-        north_ind = argmin(abs(xray.lat.values - (self.bbox.north + 1.)))
-        south_ind = argmin(abs(xray.lat.values - (self.bbox.south - 1.)))
-        west_ind = argmin(abs(xray.lon.values - (self.bbox.west - 1.)))
-        east_ind = argmin(abs(xray.lon.values - (self.bbox.east + 1.)))
+    # yearly files of a local mirror, flat as downloaded or laid out as on the server
+    local_names = ('{variable}_{year}.nc', '{variable}/{variable}_{year}.nc')
+    local_elev_names = ('metdata_elevationdata.nc', 'elev/metdata_elevationdata.nc')
+    # bbox subsets of up to this many cells are read from a series store, see met.rechunk
+    series_max_cells = 128 * 128
 
-        north_val = xray.lat.values[north_ind]
-        south_val = xray.lat.values[south_ind]
-        west_val = xray.lon.values[west_ind]
-        east_val = xray.lon.values[east_ind]
-
-        setattr(self, 'src_bounds_wsen', (west_val, south_val,
-                                          east_val, north_val))
+    def get_data_subset(self, out_filename=None, file_url=None):
 
         if self.variable != 'elev':
-            xray = xray.rename({'day': 'time'})
-            subset = xray.loc[dict(time=slice(self.start, self.end),
-                                   lat=slice(north_val, south_val),
-                                   lon=slice(west_val, east_val))]
+            subset, src_bounds = self._subset(file_url)
+            setattr(self, 'src_bounds_wsen', src_bounds)
 
             date_ind = self._date_index()
             subset['time'] = date_ind
             setattr(self, 'width', subset.dims['lon'])
             setattr(self, 'height', subset.dims['lat'])
-            arr = subset[self.kwords[self.variable]].values
-            arr = arr.reshape(arr.shape[1], arr.shape[2]).transpose()
-            arr = arr.reshape(1, arr.shape[0], arr.shape[1])
-            conformed_array = self.conform(arr, out_file=out_filename)
-            rmtree(self.temp_dir)
+            if self.lazy:
+                return subset[self.kwords[self.variable]].transpose('time', 'lat', 'lon')
+            # by name, the server's files are not all laid out (time, lat, lon)
+            arr = subset[self.kwords[self.variable]].transpose('time', 'lat', 'lon').values
+            conformed_array = self.conform(arr, out_file=out_filename, src_bounds=src_bounds)
             return conformed_array
 
         else:
-            subset = xray.loc[dict(lat=slice((self.bbox.north + 1),
-                                             (self.bbox.south - 1)),
-                                   lon=slice((self.bbox.west - 1),
-                                             (self.bbox.east + 1)))]
+            url = file_url or self._build_url()
+            index = self._coordinate_index(url)
+            space, src_bounds = index.subset(self.bbox, buffer=self.buffer)
+            setattr(self, 'src_bounds_wsen', src_bounds)
+
+            subset = self._open_hyperslab(url, index, 'elevation', space)
             setattr(self, 'width', subset.dims['lon'])
             setattr(self, 'height', subset.dims['lat'])
+            if self.lazy:
+                return subset.elevation.transpose('lat', 'lon')
             arr = subset.elevation.values
             arr = arr.reshape(1, arr.shape[0], arr.shape[1])
-            conformed_array = self.conform(arr, out_file=out_filename)
+            conformed_array = self.conform(arr, out_file=out_filename, src_bounds=src_bounds)
             return conformed_array
 
     def get_point_timeseries(self):
-        url = self._build_url()
-        xray = open_dataset(url)
-        subset = xray.sel(lon=self.lon, lat=self.lat, method='nearest')
-        subset = subset.loc[dict(day=slice(self.start, self.end))]
-        subset.rename({'day': 'time'}, inplace=True)  # FUTUREWARNING, going to loose inplace
+
+        name = self.kwords[self.variable]
+        store, index = self._series()
+        if store is not None:
+            row, col = index.nearest('lat', self.lat), index.nearest('lon', self.lon)
+            series = self.handles.get(store)
+            values = series[name].isel(time=index.time_slice(self.start, self.end), lat=row, lon=col).values
+            df = DataFrame(data=values, index=self._date_index().values)
+            df.columns = [self.variable]
+            return df
+
+        def fetch(url):
+            if self.cache is not None:
+                index = self._coordinate_index(url)
+                row, col = index.nearest('lat', self.lat), index.nearest('lon', self.lon)
+                year = int(str(index.time[0])[:4])
+                subset = self._cached_hyperslab(('gridmet', self.variable, year), url, index,
+                                                self.kwords[self.variable],
+                                                dict(lat=slice(row, row + 1), lon=slice(col, col + 1)))
+                subset = subset.isel(lat=0, lon=0)
+            else:
+                subset = self.handles.get(url).sel(lon=self.lon, lat=self.lat, method='nearest')
+            subset = subset.loc[dict(day=slice(self.start, self.end))]
+            return subset.rename({'day': 'time'}).load()
+
+        subset = self._concat_years(fetch)
         date_ind = self._date_index()
         subset['time'] = date_ind
         time = subset['time'].values
@@ -476,29 +932,104 @@ class GridMet(Thredds):
         df.columns = [self.variable]
         return df
 
-    def get_area_timeseries(self, file_url=None, operation=None):
-        if file_url:
-            xray = open_dataset(file_url)
-        else:
-            url = self._build_url()
-            xray = open_dataset(url)
+    def get_points_timeseries(self, lats, lons, names=None, long_format=False):
+        """ Daily series at many points, from one open of each yearly file.
+
+        Points are mapped to their nearest cells in one vectorised step and grouped by
+        the blocks of the grid they fall in. Each block is read once, as one hyperslab
+        covering its points, and the cells are taken from it in memory.
+
+        :param lats: sequence of latitudes
+        :param lons: sequence of longitudes, one per latitude
+        :param names: sequence of point names for the columns, default 0 to n - 1
+        :param long_format: return time, point and value columns rather than (time x point)
+        :return: pandas.DataFrame
+        """
+        name = self.kwords[self.variable]
+        store, _ = self._series()
+
+        def fetch(url):
+            index = self._coordinate_index(url)
+            rows, cols = index.nearest_many('lat', lats), index.nearest_many('lon', lons)
+            time = index.time_slice(self.start, self.end)
+            if self.cache is not None and url != store:
+                year = int(str(index.time[0])[:4])
+                size = (self.cache.chunk_size, self.cache.chunk_size)
+
+                def read(space):
+                    block = self._cached_hyperslab(('gridmet', self.variable, year), url, index, name, space,
+                                                   days=time)
+                    return block[name].transpose(index.time_dim, 'lat', 'lon').values
+            else:
+                size = None
 
-        north_ind = argmin(abs(xray.lat.values - (self.bbox.north + 1.)))
-        south_ind = argmin(abs(xray.lat.values - (self.bbox.south - 1.)))
-        west_ind = argmin(abs(xray.lon.values - (self.bbox.west - 1.)))
-        east_ind = argmin(abs(xray.lon.values - (self.bbox.east + 1.)))
+                def read(space):
+                    block = self.handles.get(url)[name].isel(dict(space, **{index.time_dim: time}))
+                    return block.transpose(index.time_dim, 'lat', 'lon').values
 
-        north_val = xray.lat.values[north_ind]
-        south_val = xray.lat.values[south_ind]
-        west_val = xray.lon.values[west_ind]
-        east_val = xray.lon.values[east_ind]
+            subset = self._block_points(index, name, rows, cols, time, read, size)
+            return subset.rename({'day': 'time'}) if url != store else subset
 
-        xray = xray.rename({'day': 'time'})
-        subset = xray.loc[dict(time=slice(self.start, self.end),
-                               lat=slice(north_val, south_val),
-                               lon=slice(west_val, east_val))]
+        subset = fetch(store) if store is not None else self._concat_years(fetch)
+        series = subset[name].transpose('time', 'point').values
+        df = DataFrame(data=series, index=self._date_index(),
+                       columns=list(names) if names is not None else None)
 
-        arr = subset[self.kwords[self.variable]].values
+        if long_format:
+            df.index.name, df.columns.name = 'time', 'point'
+            df = df.stack().reset_index(name=self.variable)
+        return df
+
+    @staticmethod
+    def _block_points(index, variable, rows, cols, time, read, size=None):
+        """ Cells of many points, reading each block of the grid they touch once.
+
+        Pointwise indexing of a file or url reads it cell by cell, so the points in a block
+        are read as one hyperslab covering them and their cells taken from it in memory.
+
+        :param index: CoordinateIndex of the dataset
+        :param variable: name of the gridded variable
+        :param rows: numpy.ndarray of lat indices of the points
+        :param cols: numpy.ndarray of lon indices of the points
+        :param time: slice of the days read
+        :param read: function of a dict of lat and lon slices returning its (time, lat, lon) values
+        :param size: (rows, cols) of a block, default the file's chunks, at most 64 a side
+        :return: xarray.Dataset of variable over (time, point)
+        """
+        if size is None:
+            chunks = index.chunks or {}
+            size = (min(chunks.get('lat', 64), 64), min(chunks.get('lon', 64), 64))
+
+        blocks = {}
+        for point, (row, col) in enumerate(zip(rows, cols)):
+            blocks.setdefault((row // size[0], col // size[1]), []).append(point)
+
+        values = None
+        for points in blocks.values():
+            r, c = rows[points], cols[points]
+            space = dict(lat=slice(int(r.min()), int(r.max()) + 1), lon=slice(int(c.min()), int(c.max()) + 1))
+            block = read(space)
+            if values is None:
+                values = empty((block.shape[0], len(rows)), dtype=block.dtype)
+            values[:, points] = block[:, r - space['lat'].start, c - space['lon'].start]
+
+        return Dataset({variable: ((index.time_dim, 'point'), values)},
+                       coords={index.time_dim: index.time[time]})
+
+    def get_area_timeseries(self, file_url=None, operation=None):
+
+        subset, src_bounds = self._subset(file_url)
+
+        if self.lazy:
+            setattr(self, 'src_bounds_wsen', src_bounds)
+            arr = subset[self.kwords[self.variable]].transpose('time', 'lat', 'lon')
+            if operation == 'sum':
+                return arr.sum('time')
+            elif operation == 'mean':
+                return arr.mean('time')
+            return arr
+
+        arr = subset[self.kwords[self.variable]].transpose('time', 'lat', 'lon').values
 
         if operation == 'sum':
             arr = arr.sum(axis=0)
@@ -506,37 +1037,384 @@ class GridMet(Thredds):
         elif operation == 'mean':
             arr = mean(arr, axis=0)
             arr = arr.reshape(1, arr.shape[0], arr.shape[1])
-        else:
-            if arr.shape[0] > 1 and arr.shape[2]:
-                raise ValueError('not ready to conform 3D arrays yet')
-            else:
-                pass
 
-        conformed_array = self.conform(arr)
+        # with no operation the (time, lat, lon) cube is conformed band-wise in one warp
+        conformed_array = self.conform(arr, src_bounds=src_bounds)
         return conformed_array
 
-    def _build_url(self):
+    def get_zonal_timeseries(self, features, ids=None, crs=None, operations=('mean',),
+                             weights=None, file_url=None):
+        """ Daily statistics of each polygon over the native grid, no rasters written.
+
+        The bbox should cover the polygons. Coverage weights are built on the bbox subset
+        and kept as zonal_weights, pass them back to reuse them for other dates or
+        variables on the same bbox.
+
+        :param features: polygons, see met.zonal.ZonalWeights
+        :param ids: names of the polygons, default 0 to n - 1
+        :param crs: CRS of the features if not EPSG:4326
+        :param operations: any of 'mean', 'sum', 'count'
+        :param weights: met.zonal.ZonalWeights from an earlier call
+        :param file_url: read this one file rather than the yearly files of the date range
+        :return: dict of pandas.DataFrame (time x polygon) by operation
+        """
+        subset, _ = self._subset(file_url)
+        if weights is None:
+            weights = ZonalWeights.from_coords(subset.lat.values, subset.lon.values, features,
+                                               crs=crs, ids=ids)
+        setattr(self, 'zonal_weights', weights)
+
+        cube = subset[self.kwords[self.variable]].transpose('time', 'lat', 'lon').values
+        return weights.stats(cube, operations=operations, index=self._date_index())
+
+    def iter_area_timeseries(self, chunk_days=30, file_url=None):
+        """ Conform the area series a chunk of days at a time, for periods too long for memory.
+
+        The next chunk is fetched while the current one is conformed, so at most two
+        chunks are held at once, whatever the length of start to end.
+
+        :param chunk_days: days per chunk, at most; chunks do not span yearly files
+        :param file_url: read this one file rather than the yearly files of the date range
+        :return: generator of (pandas.DatetimeIndex, numpy.ndarray (time, row, col))
+        """
+        name = self.kwords[self.variable]
+        jobs = []
+        for url in ([file_url] if file_url else [self._build_url(year) for year in self._years()]):
+            days = self._coordinate_index(url).time_slice(self.start, self.end)
+            jobs += [(url, slice(first, min(first + chunk_days, days.stop)))
+                     for first in range(days.start, days.stop, chunk_days)]
 
-        # ParseResult('scheme', 'netloc', 'path', 'params', 'query', 'fragment')
+        date_ind = self._date_index()
+        done = 0
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = pool.submit(self._fetch_subset, jobs[0][0], time=jobs[0][1])
+            for i in range(len(jobs)):
+                subset, src_bounds = pending.result()
+                if i + 1 < len(jobs):
+                    pending = pool.submit(self._fetch_subset, jobs[i + 1][0], time=jobs[i + 1][1])
+
+                arr = subset[name].transpose('time', 'lat', 'lon').values
+                del subset
+                dates = date_ind[done:done + arr.shape[0]]
+                done += arr.shape[0]
+                yield dates, self.conform(arr, src_bounds=src_bounds)
+
+    def reduce_area_timeseries(self, operations=('mean',), chunk_days=30, file_url=None):
+        """ Running reductions over the conformed area series, see iter_area_timeseries.
+
+        :param operations: any of 'sum', 'mean', 'min', 'max', 'count'
+        :param chunk_days: days per chunk, at most
+        :param file_url: read this one file rather than the yearly files of the date range
+        :return: dict of numpy.ndarray (1, row, col) by operation
+        """
+        reduction = RunningReduction(operations)
+        for _, arr in self.iter_area_timeseries(chunk_days=chunk_days, file_url=file_url):
+            reduction.update(arr)
+        return reduction.result()
+
+    def _subset(self, file_url=None):
+        """ Subset of bbox, buffered by a degree, over the date range.
+
+        :param file_url: read this one file rather than the yearly files of the date range
+        :return: xarray.Dataset (time, lat, lon) loaded into memory unless lazy, (west, south, east, north)
+        """
+        if file_url is None:
+            store, index = self._series()
+            if store is not None:
+                space, src_bounds = index.subset(self.bbox, buffer=self.buffer)
+                cells = (space['lat'].stop - space['lat'].start) * (space['lon'].stop - space['lon'].start)
+                if cells <= self.series_max_cells:
+                    subset = self._open_hyperslab(store, index, self.kwords[self.variable], space,
+                                                  index.time_slice(self.start, self.end))
+                    return (subset if self.lazy else subset.load()), src_bounds
+
+        # every yearly file is on the same grid, so any of their bounds will do
+        bounds = []
+
+        def fetch(url):
+            subset, src_bounds = self._fetch_subset(url)
+            bounds.append(src_bounds)
+            return subset
+
+        subset = self._concat_years(fetch, urls=[file_url] if file_url else None)
+        return subset, bounds[0]
+
+    def _fetch_subset(self, url, variable=None, time=None):
+        variable = variable or self.variable
+        name = self.kwords[variable]
+        index = self._coordinate_index(url)
+        space, src_bounds = index.subset(self.bbox, buffer=self.buffer)
+        if time is None:
+            time = index.time_slice(self.start, self.end)
+
+        if self.cache is None:
+            subset = self._open_hyperslab(url, index, name, space, time)
+        else:
+            # yearly files, the cache keeps each chunk for the whole file and reads the days of it
+            year = int(str(index.time[0])[:4])
+            subset = self._cached_hyperslab(('gridmet', variable, year), url, index, name, space, days=time)
+
+        subset = subset.rename({'day': 'time'})
+        return (subset if self.lazy else subset.load()), src_bounds
+
+    def _years(self):
+        return list(range(self.start.year, self.end.year + 1))
+
+    def prefetch_tiles(self, years=None):
+        """ Fetch every cache tile of bbox, buffered, for whole years, and keep them.
+
+        Later reads of any bbox within the tiles are served from the cache.
+
+        :param years: years to fetch, default those from start to end
+        :return: bytes fetched, 0 if every tile was cached
+        """
+        if self.cache is None:
+            raise ValueError('prefetch_tiles needs a cache, e.g. GridMet(..., cache=ChunkCache.tiles(root))')
+        fetched = 0
+        for year in (years or self._years()):
+            url = self._build_url(year)
+            index = self._coordinate_index(url)
+            space, _ = index.subset(self.bbox, buffer=self.buffer)
+            fetched += self._prefetch_tiles(('gridmet', self.variable, year), url, index,
+                                            self.kwords[self.variable], space)
+        return fetched
+
+    def _series(self):
+        """ Series store of the variable under data_root, if one covers start to end.
+
+        See met.rechunk, a store holds every day of a cell in a few chunks, where the
+        yearly files hold it in one chunk of each year's map.
+
+        :return: path and met.coordinates.CoordinateIndex of the store, or None, None
+        """
         if self.variable == 'elev':
+            return None, None
+        path = self._local_path((SERIES_NAME,), variable=self.variable)
+        if path is None:
+            return None, None
+        index = self._coordinate_index(path)
+        if index.time[0] > datetime64(self.start) or index.time[-1] < datetime64(self.end):
+            return None, None
+        return path, index
+
+    def _concat_years(self, fetch, urls=None):
+        """ Fetch from each yearly file of the date range, joined along time.
+
+        Fetches run on max_workers threads, but their reads hold the process's netCDF lock
+        in turn, so only the work around the reads overlaps.
+
+        :param fetch: function of a url returning an xarray.Dataset with a time dimension
+        :param urls: urls to fetch from, default the yearly files from start to end
+        :return: xarray.Dataset
+        """
+        if urls is None:
+            urls = [self._build_url(year) for year in self._years()]
+        if len(urls) == 1:
+            return fetch(urls[0])
+
+        with ThreadPoolExecutor(max_workers=min(len(urls), self.max_workers)) as pool:
+            datasets = list(pool.map(fetch, urls))
+        return concat(datasets, dim='time')
+
+    def _build_url(self, year=None, variable=None):
+
+        if year is None:
+            year = self.year
+        if variable is None:
+            variable = self.variable
+
+        local = self._local_path(self.local_elev_names if variable == 'elev' else None,
+                                 variable=variable, year=year)
+        if local:
+            return local
+
+        # ParseResult('scheme', 'netloc', 'path', 'params', 'query', 'fragment')
+        if variable == 'elev':
             url = urlunparse([self.scheme, self.service,
-                              '/thredds/dodsC/MET/{0}/metdata_elevationdata.nc'.format(self.variable),
+                              '/thredds/dodsC/MET/{0}/metdata_elevationdata.nc'.format(variable),
                               '', '', ''])
         else:
             url = urlunparse([self.scheme, self.service,
-                              '/thredds/dodsC/MET/{0}/{0}_{1}.nc'.format(self.variable, self.year),
+                              '/thredds/dodsC/MET/{0}/{0}_{1}.nc'.format(variable, year),
                               '', '', ''])
 
         return url
 
-    def write_netcdf(self, outputroot):
-        url = self._build_url()
-        xray = open_dataset(url)
-        if self.variable != 'elev':
-            subset = xray.loc[dict(day=slice(self.start, self.end))]
-            subset.rename({'day': 'time'}, inplace=True)
+    # chunk shapes of write_netcdf, -1 for the whole dimension
+    netcdf_chunks = {'point': {'time': 365, 'lat': 16, 'lon': 16},
+                     'map': {'time': 1, 'lat': -1, 'lon': -1}}
+
+    def write_netcdf(self, outputroot, compression=None, complevel=4, chunks=None, append=False):
+        """ Save the full grid over the date range as NetCDF4, time unlimited.
+
+        With append, an existing file gets only the days after its last one, from start
+        or that day to end, written in place along time; it is made if missing.
+
+        :param outputroot: path of the NetCDF file
+        :param compression: None, 'zlib', or 'zstd' if the netCDF library has the plugin
+        :param complevel: compression level, 1 to 9
+        :param chunks: 'point' for long series of small areas, 'map' for one day of the
+            whole grid, a dict of chunk size by dimension, or None for the library default
+        :param append: add new days to an existing file rather than rewriting it
+        :return: number of days written
+        """
+        if self.variable == 'elev':
+            if append:
+                raise ValueError('elev has no time dimension to append along')
+            # a copy, the encoding is rewritten and the handle is shared
+            subset = self.handles.get(self._build_url()).copy()
+            subset.to_netcdf(path=outputroot, engine='netcdf4',
+                             encoding=self._netcdf_encoding(subset, compression, complevel, chunks))
+            return 0
+
+        start = self.start
+        if append and os.path.isfile(outputroot):
+            with open_dataset(outputroot) as existing:
+                last = Timestamp(existing.time.values[-1]).to_pydatetime()
+            start = max(start, last + timedelta(days=1))
+            if start > self.end:
+                return 0
+
+        def fetch(url):
+            xray = self.handles.get(url)
+            subset = xray.loc[dict(day=slice(start, self.end))]
+            return subset.rename({'day': 'time'}).load()
+
+        subset = self._concat_years(fetch, urls=[self._build_url(year)
+                                                 for year in range(start.year, self.end.year + 1)])
+
+        if append and os.path.isfile(outputroot):
+            self._append_netcdf(outputroot, subset)
         else:
-            subset = xray
-        subset.to_netcdf(path=outputroot, engine='netcdf4')
+            subset.to_netcdf(path=outputroot, engine='netcdf4', unlimited_dims=['time'],
+                             encoding=self._netcdf_encoding(subset, compression, complevel, chunks))
+        return subset.sizes['time']
+
+    def _netcdf_encoding(self, subset, compression, complevel, chunks):
+        if compression not in (None, 'zlib', 'zstd'):
+            raise ValueError('Unknown compression {}, choose from zlib or zstd'.format(compression))
+        if chunks is not None and not isinstance(chunks, dict):
+            if chunks not in self.netcdf_chunks:
+                raise ValueError('Unknown chunks {}, choose from {}'.format(chunks, sorted(self.netcdf_chunks)))
+            chunks = self.netcdf_chunks[chunks]
+
+        encoding = {}
+        for name, var in subset.data_vars.items():
+            if not var.dims:
+                continue
+            # the source's own layout does not fit a subset of it
+            for key in ('chunksizes', 'contiguous', 'original_shape', 'zlib', 'complevel', 'shuffle'):
+                var.encoding.pop(key, None)
+            encoding[name] = {}
+            if compression == 'zlib':
+                encoding[name].update(zlib=True, complevel=complevel, shuffle=True)
+            elif compression == 'zstd':
+                encoding[name].update(compression='zstd', complevel=complevel, shuffle=True)
+            if chunks:
+                # an unlimited time dimension may have chunks longer than it is
+                sizes = [chunks.get(dim, -1) for dim in var.dims]
+                encoding[name]['chunksizes'] = tuple(
+                    size if dim == 'time' and size > 0 else
+                    var.sizes[dim] if size < 1 else min(size, var.sizes[dim])
+                    for dim, size in zip(var.dims, sizes))
+        return encoding
+
+    @staticmethod
+    def _append_netcdf(path, subset):
+        with NetCDFFile(path, 'a') as nc:
+            if not nc.dimensions['time'].isunlimited():
+                raise ValueError('{} was not written with an unlimited time dimension'.format(path))
+            n = len(nc.dimensions['time'])
+            times = nc.variables['time']
+            calendar = getattr(times, 'calendar', 'standard')
+            k = subset.sizes['time']
+            times[n:n + k] = date2num(subset.time.to_index().to_pydatetime(), times.units, calendar)
+            for name, var in subset.data_vars.items():
+                if 'time' not in var.dims:
+                    continue
+                target = nc.variables[name]
+                index = tuple(slice(n, n + k) if dim == 'time' else slice(None) for dim in target.dimensions)
+                target[index] = var.transpose(*target.dimensions).values
+
+
+class GridMetBatch(GridMet):
+    """ U of I Gridmet, many variables over one bbox and date range
+
+    The variables share one coordinate index per year, one bbox slice and one conform
+    plan. Their yearly files are fetched on max_workers threads, though the reads
+    themselves take the process's netCDF lock in turn.
+
+    :param variables: list of GridMet variables, see GridMet, 'elev' excluded
+    :param kwargs: as GridMet
+    :return: dict of numpy.ndarray, or xarray.Dataset
+
+    """
+
+    def __init__(self, variables, **kwargs):
+        GridMet.__init__(self, variables[0], **kwargs)
+
+        if 'elev' in variables:
+            raise ValueError('elev is not a daily variable, use GridMet("elev")')
+        self.variables = list(variables)
+        self._shared_indices = {}
+
+    def get_subsets(self):
+        """ Native-grid subsets of every variable over bbox, buffered by a degree.
+
+        :return: xarray.Dataset (time, lat, lon), variables by their short names
+        """
+        years = self._years()
+        jobs = [(variable, self._build_url(year, variable))
+                for variable in self.variables for year in years]
+
+        # GridMet variables share a grid and days, the first variable's file of a year indexes all;
+        # kept to this batch, the files of other variables are not indexed by it elsewhere
+        self._shared_indices = {}
+        for year in years:
+            index = GridMet._coordinate_index(self, self._build_url(year, self.variables[0]))
+            for variable in self.variables[1:]:
+                self._shared_indices[self._build_url(year, variable)] = index
+
+        with ThreadPoolExecutor(max_workers=min(len(jobs), self.max_workers)) as pool:
+            fetched = list(pool.map(lambda job: self._fetch_subset(job[1], job[0]), jobs))
+
+        src_bounds = fetched[0][1]
+        setattr(self, 'src_bounds_wsen', src_bounds)
+
+        arrays = {}
+        for i, variable in enumerate(self.variables):
+            yearly = [subset[self.kwords[variable]] for subset, _ in
+                      fetched[i * len(years):(i + 1) * len(years)]]
+            arr = yearly[0] if len(yearly) == 1 else concat(yearly, dim='time')
+            arrays[variable] = arr.transpose('time', 'lat', 'lon')
+
+        subsets = Dataset(arrays)
+        subsets['time'] = self._date_index()
+        return subsets
+
+    def _coordinate_index(self, url):
+        index = self._shared_indices.get(url)
+        return index if index is not None else GridMet._coordinate_index(self, url)
+
+    def get_data_subset(self, out_dir=None, as_dataset=False):
+        """ Conform every variable to target_profile.
+
+        :param out_dir: directory to save each variable to as {variable}.tif
+        :param as_dataset: return the native-grid subsets, see get_subsets, without conforming
+        :return: dict of numpy.ndarray (time, row, col) by variable, or xarray.Dataset
+        """
+        subsets = self.get_subsets()
+        if as_dataset:
+            return subsets
+
+        arrays = [subsets[variable].values for variable in self.variables]
+        out_files = None
+        if out_dir:
+            out_files = [os.path.join(out_dir, '{}.tif'.format(variable))
+                         for variable in self.variables]
+        conformed = self.conform_many(arrays, out_files=out_files,
+                                      src_bounds=self.src_bounds_wsen,
+                                      max_workers=self.max_workers)
+        return dict(zip(self.variables, conformed))
 
 # ========================= EOF ====================================================================
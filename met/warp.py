@@ -0,0 +1,419 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+import json
+from hashlib import sha1
+from collections import OrderedDict
+from threading import Lock
+
+from numpy import arange, ceil, empty, zeros, float32
+from rasterio import open as rasopen
+from rasterio.features import geometry_mask
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds, transform as window_transform
+
+# source cells padded around each tile, the kernel radius plus one for rounding, at a
+# target no coarser than the source; GDAL widens the kernel by the ratio of the two
+TILE_HALO = {Resampling.nearest: 1, Resampling.bilinear: 2, Resampling.cubic: 3,
+             Resampling.cubic_spline: 3, Resampling.lanczos: 4}
+
+
+class WarpPlan(object):
+    """ Precomputed mapping from a source grid to a Thredds.target_profile grid.
+
+    The nearest-neighbour reprojection and clip of Thredds.conform are held as flat
+    index arrays, the cubic resample as its source and destination affines, and the
+    final fit to the target shape as row and column maps.  Apply to any (band, row, col)
+    array on the source grid it was built for.
+
+    :param src_shape: (rows, cols) of the source grid
+    :param index: int array on the clipped grid, source flat index + 1, 0 where
+    the source did not cover, -1 where clipped
+    :param fill: value of clipped cells
+    :param src_transform: affine of the clipped grid
+    :param dst_transform: affine of the resample grid
+    :param crs: crs of the clipped and resample grids
+    :param dst_shape: (rows, cols) of the resample grid
+    :param rows: resample grid row of each target row
+    :param cols: resample grid column of each target column
+    """
+
+    def __init__(self, src_shape, index, fill, src_transform, dst_transform,
+                 crs, dst_shape, rows, cols):
+        self.src_shape = tuple(src_shape)
+        self.shape = index.shape
+        self.fill = fill
+
+        self.dst_flat = (index > 0).ravel().nonzero()[0]
+        self.src_flat = index.ravel()[self.dst_flat] - 1
+        self.clip_flat = (index < 0).ravel().nonzero()[0]
+
+        self.src_transform = src_transform
+        self.dst_transform = dst_transform
+        self.crs = crs
+        self.dst_shape = tuple(dst_shape)
+        self.rows = rows
+        self.cols = cols
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.dst_flat, self.src_flat, self.clip_flat,
+                                      self.rows, self.cols))
+
+    def apply(self, subset, resampling=Resampling.cubic, **warp_options):
+        """ Conform a (band, row, col) array on the source grid to the target grid.
+
+        :param subset: numpy.ndarray of src_shape
+        :param resampling: rasterio.warp.Resampling kernel of the resample
+        :param warp_options: num_threads, warp_mem_limit, passed to rasterio.warp.reproject
+        :return: numpy.ndarray (band, target height, target width)
+        """
+        if subset.shape[1:] != self.src_shape:
+            raise ValueError('array of shape {} does not match plan source grid {}'.format(
+                subset.shape[1:], self.src_shape))
+
+        bands = subset.shape[0]
+        flat = subset.reshape(bands, -1)
+
+        clipped = zeros((bands, self.shape[0] * self.shape[1]), dtype=float32)
+        clipped[:, self.dst_flat] = flat[:, self.src_flat]
+        clipped[:, self.clip_flat] = self.fill
+        clipped = clipped.reshape((bands,) + self.shape)
+
+        resampled = empty((bands,) + self.dst_shape, dtype=float32)
+        reproject(clipped, resampled, src_transform=self.src_transform,
+                  dst_transform=self.dst_transform, src_crs=self.crs,
+                  dst_crs=self.crs, resampling=resampling, **warp_options)
+
+        return resampled[:, self.rows[:, None], self.cols]
+
+
+class FusedWarpPlan(object):
+    """ Single-pass warp from the geographic source grid to a Thredds.target_profile grid.
+
+    Goes from the EPSG:4326 subset straight to the target grid in one cubic resample,
+    cells outside the clip feature are set to fill as part of the same pass.
+
+    :param src_shape: (rows, cols) of the source grid
+    :param src_transform: affine of the source grid
+    :param src_crs: crs of the source grid
+    :param dst_transform: affine of the target grid
+    :param dst_crs: crs of the target grid
+    :param dst_shape: (rows, cols) of the target grid
+    :param outside: boolean array of dst_shape, True outside the clip feature, or None
+    :param fill: value of cells outside the clip feature
+    """
+
+    def __init__(self, src_shape, src_transform, src_crs, dst_transform, dst_crs,
+                 dst_shape, outside, fill):
+        self.src_shape = tuple(src_shape)
+        self.src_transform = src_transform
+        self.src_crs = src_crs
+        self.dst_transform = dst_transform
+        self.dst_crs = dst_crs
+        self.dst_shape = tuple(dst_shape)
+        self.outside = outside
+        self.fill = fill
+
+    @property
+    def nbytes(self):
+        if self.outside is None:
+            return 0
+        return self.outside.nbytes
+
+    def apply(self, subset, resampling=Resampling.cubic, **warp_options):
+        """ Conform a (band, row, col) array on the source grid to the target grid.
+
+        :param subset: numpy.ndarray of src_shape
+        :param resampling: rasterio.warp.Resampling kernel of the warp
+        :param warp_options: num_threads, warp_mem_limit, passed to rasterio.warp.reproject
+        :return: numpy.ndarray (band, target height, target width)
+        """
+        if subset.shape[1:] != self.src_shape:
+            raise ValueError('array of shape {} does not match plan source grid {}'.format(
+                subset.shape[1:], self.src_shape))
+
+        dst = empty((subset.shape[0],) + self.dst_shape, dtype=float32)
+        reproject(subset, dst, src_transform=self.src_transform, src_crs=self.src_crs,
+                  dst_transform=self.dst_transform, dst_crs=self.dst_crs,
+                  resampling=resampling, **warp_options)
+
+        if self.outside is not None:
+            dst[:, self.outside] = self.fill
+
+        return dst
+
+
+class AlignedPlan(object):
+    """ Conform to a target grid aligned with the source grid, without a GDAL warp.
+
+    Targets at the source resolution or an integer fraction of it are sliced and their
+    cells replicated, targets at an integer multiple of it are block averaged.
+
+    :param src_shape: (rows, cols) of the source grid
+    :param dst_shape: (rows, cols) of the target grid
+    :param row_offset: first source row under the target, in target cells when
+    replicating and in source cells when averaging
+    :param col_offset: first source column under the target, as row_offset
+    :param factor: target cells per source cell when replicating (>= 1), or
+    source cells per target cell when averaging
+    :param aggregate: average blocks of source cells rather than replicate
+    :param outside: boolean array of dst_shape, True outside the clip feature, or None
+    :param fill: value of cells outside the clip feature
+    """
+
+    def __init__(self, src_shape, dst_shape, row_offset, col_offset, factor,
+                 aggregate, outside, fill):
+        self.src_shape = tuple(src_shape)
+        self.dst_shape = tuple(dst_shape)
+        self.row_offset = row_offset
+        self.col_offset = col_offset
+        self.factor = factor
+        self.aggregate = aggregate
+        self.outside = outside
+        self.fill = fill
+
+        if not aggregate:
+            self.rows = (arange(dst_shape[0]) + row_offset) // factor
+            self.cols = (arange(dst_shape[1]) + col_offset) // factor
+
+    @property
+    def nbytes(self):
+        if self.outside is None:
+            return 0
+        return self.outside.nbytes
+
+    def apply(self, subset, **kwargs):
+        """ Conform a (band, row, col) array on the source grid to the target grid.
+
+        :param subset: numpy.ndarray of src_shape
+        :param kwargs: warp settings, unused as nothing is warped
+        :return: numpy.ndarray (band, target height, target width)
+        """
+        if subset.shape[1:] != self.src_shape:
+            raise ValueError('array of shape {} does not match plan source grid {}'.format(
+                subset.shape[1:], self.src_shape))
+
+        bands = subset.shape[0]
+        rows, cols = self.dst_shape
+
+        if self.aggregate:
+            r0, c0, f = self.row_offset, self.col_offset, self.factor
+            block = subset[:, r0:r0 + rows * f, c0:c0 + cols * f]
+            dst = block.reshape(bands, rows, f, cols, f).mean(axis=(2, 4)).astype(float32)
+        else:
+            row_in = (self.rows >= 0) & (self.rows < self.src_shape[0])
+            col_in = (self.cols >= 0) & (self.cols < self.src_shape[1])
+            dst = zeros((bands, rows, cols), dtype=float32)
+            dst[:, row_in[:, None] & col_in] = subset[:, self.rows[row_in][:, None],
+                                                      self.cols[col_in]].reshape(bands, -1)
+
+        if self.outside is not None:
+            dst[:, self.outside] = self.fill
+
+        return dst
+
+
+def aligned_grid(src_transform, src_shape, dst_transform, dst_shape, tolerance=1e-3):
+    """ Find how a target grid in the source crs lines up with the source grid.
+
+    :param src_transform: affine of the source grid
+    :param src_shape: (rows, cols) of the source grid
+    :param dst_transform: affine of the target grid
+    :param dst_shape: (rows, cols) of the target grid
+    :param tolerance: allowed misalignment, in cells
+    :return: (row_offset, col_offset, factor, aggregate) as taken by AlignedPlan, or None
+    """
+    if src_transform.b or src_transform.d or dst_transform.b or dst_transform.d:
+        return None
+
+    ratios = src_transform.a / dst_transform.a, src_transform.e / dst_transform.e
+    if abs(ratios[0] - ratios[1]) > tolerance * ratios[0]:
+        return None
+
+    ratio = ratios[0]
+    aggregate = ratio < 1.
+    factor = 1. / ratio if aggregate else ratio
+    if abs(factor - round(factor)) > tolerance:
+        return None
+    factor = int(round(factor))
+
+    # offsets in the finer of the two grids
+    fine = src_transform if aggregate else dst_transform
+    col_offset = (dst_transform.c - src_transform.c) / fine.a
+    row_offset = (dst_transform.f - src_transform.f) / fine.e
+    if abs(col_offset - round(col_offset)) > tolerance or abs(row_offset - round(row_offset)) > tolerance:
+        return None
+    col_offset, row_offset = int(round(col_offset)), int(round(row_offset))
+
+    if aggregate:
+        if (row_offset < 0 or col_offset < 0 or row_offset + dst_shape[0] * factor > src_shape[0] or
+                col_offset + dst_shape[1] * factor > src_shape[1]):
+            return None
+
+    return row_offset, col_offset, factor, aggregate
+
+
+def warp_tiled(subset, src_transform, src_crs, target_profile, out_file,
+               clip_feature=None, fill=0., tile_size=1024, resampling=Resampling.cubic,
+               **warp_options):
+    """ Fused warp of a source cube to target_profile, streamed to out_file tile by tile.
+
+    Each target tile is warped from only the source cells under it plus a TILE_HALO, scaled
+    by the source cells per target cell where the target is coarser, so peak memory is set
+    by tile_size and the number of bands, not by the target grid.
+
+    :param subset: numpy.ndarray (band, row, col) in src_crs
+    :param src_transform: affine of the source grid
+    :param src_crs: crs of the source grid
+    :param target_profile: rasterio profile of the target grid
+    :param out_file: path of the raster to write
+    :param clip_feature: GeoJSON-like geometry in the target crs, cells outside are set to fill
+    :param fill: value of cells outside clip_feature
+    :param tile_size: target tile edge in cells
+    :param resampling: rasterio.warp.Resampling kernel of the warp
+    :param warp_options: num_threads, warp_mem_limit, passed to rasterio.warp.reproject
+    :return: out_file
+    """
+    halo = TILE_HALO.get(resampling, 4)
+    try:
+        dst_transform = target_profile['affine']
+    except KeyError:
+        dst_transform = target_profile['transform']
+    dst_crs = target_profile['crs']
+    height, width = target_profile['height'], target_profile['width']
+    bands, src_rows, src_cols = subset.shape
+
+    profile = dict(target_profile)
+    profile.pop('affine', None)
+    profile.update({'transform': dst_transform, 'dtype': 'float32', 'count': bands})
+
+    with rasopen(out_file, 'w', **profile) as dst:
+        for row_off in range(0, height, tile_size):
+            for col_off in range(0, width, tile_size):
+                window = Window(col_off, row_off, min(tile_size, width - col_off),
+                                min(tile_size, height - row_off))
+                tile_transform = window_transform(window, dst_transform)
+                tile = zeros((bands, int(window.height), int(window.width)), dtype=float32)
+
+                west, north = tile_transform * (0, 0)
+                east, south = tile_transform * (window.width, window.height)
+                src_bounds = transform_bounds(dst_crs, src_crs, west, south, east, north,
+                                              densify_pts=21)
+                src_window = from_bounds(*src_bounds, transform=src_transform)
+                scale = max(1., src_window.width / window.width, src_window.height / window.height)
+                pad = int(ceil(halo * scale))
+                r0 = max(int(src_window.row_off) - pad, 0)
+                c0 = max(int(src_window.col_off) - pad, 0)
+                r1 = min(int(src_window.row_off + src_window.height) + pad + 1, src_rows)
+                c1 = min(int(src_window.col_off + src_window.width) + pad + 1, src_cols)
+
+                if r1 > r0 and c1 > c0:
+                    halo_transform = window_transform(Window(c0, r0, c1 - c0, r1 - r0), src_transform)
+                    reproject(subset[:, r0:r1, c0:c1], tile, src_transform=halo_transform,
+                              src_crs=src_crs, dst_transform=tile_transform, dst_crs=dst_crs,
+                              resampling=resampling, **warp_options)
+
+                if clip_feature:
+                    outside = geometry_mask([clip_feature], out_shape=tile.shape[1:],
+                                            transform=tile_transform, all_touched=True)
+                    tile[:, outside] = fill
+
+                dst.write(tile, window=window)
+
+    return out_file
+
+
+class WarpPlanCache(object):
+    """ Least-recently-used store of WarpPlan objects.
+
+    :param max_plans: most plans to hold
+    :param max_bytes: most plan bytes to hold, None for no limit
+    """
+
+    def __init__(self, max_plans=32, max_bytes=None):
+        self.max_plans = max_plans
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def __contains__(self, key):
+        return key in self._plans
+
+    def get(self, key):
+        with self._lock:
+            try:
+                plan = self._plans.pop(key)
+            except KeyError:
+                return None
+            self._plans[key] = plan
+            return plan
+
+    def put(self, key, plan):
+        with self._lock:
+            if key in self._plans:
+                self.nbytes -= self._plans.pop(key).nbytes
+            self._plans[key] = plan
+            self.nbytes += plan.nbytes
+            while self._plans and (len(self._plans) > self.max_plans or
+                                   (self.max_bytes and self.nbytes > self.max_bytes)):
+                _, evicted = self._plans.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.nbytes = 0
+
+
+def warp_plan_key(src_shape, src_bounds, target_profile, clip_feature, engine='staged'):
+    """ Hashable key of a warp plan.
+
+    :param src_shape: (rows, cols) of the source grid
+    :param src_bounds: (west, south, east, north) of the source grid
+    :param target_profile: rasterio profile of the target grid
+    :param clip_feature: GeoJSON-like geometry, or object with __geo_interface__
+    :param engine: 'staged', 'fused' or 'aligned'
+    :return: str
+    """
+    try:
+        transform = target_profile['affine']
+    except KeyError:
+        transform = target_profile['transform']
+
+    geometry = getattr(clip_feature, '__geo_interface__', clip_feature)
+
+    key = [list(src_shape), [float(b) for b in src_bounds],
+           str(target_profile['crs']), [float(t) for t in tuple(transform)[:6]],
+           target_profile['width'], target_profile['height'],
+           repr(target_profile.get('nodata')), geometry, engine]
+
+    return sha1(json.dumps(key, sort_keys=True, default=_listify).encode('utf-8')).hexdigest()
+
+
+def _listify(obj):
+    try:
+        return obj.tolist()
+    except AttributeError:
+        return list(obj)
+
+# ========================= EOF ====================================================================
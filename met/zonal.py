@@ -0,0 +1,149 @@
+# =============================================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function, absolute_import
+
+from numpy import asarray, concatenate, errstate, floor, ceil, full, isfinite, nan, nonzero, where
+from pandas import DataFrame
+from rasterio.crs import CRS
+from rasterio.features import bounds as feature_bounds, rasterize
+from rasterio.transform import Affine
+from rasterio.warp import transform_geom
+from scipy.sparse import csr_matrix
+
+OPERATIONS = ('mean', 'sum', 'count')
+
+
+class ZonalWeights(object):
+    """ Sparse (polygon x cell) matrix of the fraction of each grid cell inside each polygon.
+
+    Fractions come from rasterizing each polygon at supersample x supersample points per
+    cell over its own window of the grid, so the matrix is built once per polygon set and
+    grid. Statistics of a whole (time, row, col) cube are then one sparse matrix product.
+
+    A polygon smaller than a supersampled point gets the cell holding its bounds center.
+
+    :param features: GeoJSON-like geometries or features, or shapely geometries, in crs
+    :param transform: affine.Affine of the grid
+    :param shape: (rows, cols) of the grid
+    :param crs: CRS of the features if not that of the grid, e.g. {'init': 'epsg:32611'}
+    :param grid_crs: CRS of the grid, default EPSG:4326
+    :param ids: names of the polygons, default 0 to n - 1
+    :param supersample: points per cell edge
+    """
+
+    def __init__(self, features, transform, shape, crs=None, grid_crs=None, ids=None, supersample=8):
+        geometries = [self._geometry(f) for f in features]
+        grid_crs = grid_crs or CRS({'init': 'epsg:4326'})
+        if crs is not None:
+            geometries = [transform_geom(crs, grid_crs, g) for g in geometries]
+
+        self.transform = transform
+        self.shape = tuple(shape)
+        self.ids = list(ids) if ids is not None else list(range(len(geometries)))
+        self.supersample = supersample
+
+        rows, cols, data = [], [], []
+        for i, geometry in enumerate(geometries):
+            cells, fractions = self._fractions(geometry)
+            rows.append(full(len(cells), i))
+            cols.append(cells)
+            data.append(fractions)
+
+        self.matrix = csr_matrix((concatenate(data), (concatenate(rows), concatenate(cols))),
+                                 shape=(len(geometries), self.shape[0] * self.shape[1]))
+
+    @classmethod
+    def from_coords(cls, lat, lon, features, **kwargs):
+        """ Weights on a geographic grid given by its cell-center coordinates.
+
+        :param lat: 1-D latitudes of cell centers, descending as in GridMet and TopoWX
+        :param lon: 1-D longitudes of cell centers, ascending
+        :param features: GeoJSON-like geometries or features
+        :param kwargs: as ZonalWeights
+        :return: ZonalWeights
+        """
+        lat, lon = asarray(lat), asarray(lon)
+        if len(lat) < 2 or lat[0] < lat[-1]:
+            raise ValueError('Latitude must descend, as rows of a north-up grid')
+        x_res, y_res = lon[1] - lon[0], lat[1] - lat[0]
+        transform = Affine(x_res, 0., lon[0] - x_res / 2., 0., y_res, lat[0] - y_res / 2.)
+        return cls(features, transform, (len(lat), len(lon)), **kwargs)
+
+    @staticmethod
+    def _geometry(feature):
+        feature = getattr(feature, '__geo_interface__', feature)
+        return feature['geometry'] if feature.get('type') == 'Feature' else feature
+
+    def _fractions(self, geometry):
+        rows, cols = self.shape
+        k = self.supersample
+        west, south, east, north = feature_bounds(geometry)
+        (c0, r0), (c1, r1) = ~self.transform * (west, north), ~self.transform * (east, south)
+        r0, r1 = sorted((r0, r1))
+        c0, c1 = sorted((c0, c1))
+        r0, c0 = max(int(floor(r0)), 0), max(int(floor(c0)), 0)
+        r1, c1 = min(int(ceil(r1)), rows), min(int(ceil(c1)), cols)
+        if r1 <= r0 or c1 <= c0:
+            return asarray([], dtype=int), asarray([], dtype=float)
+
+        window = self.transform * Affine.translation(c0, r0) * Affine.scale(1. / k)
+        inside = rasterize([(geometry, 1)], out_shape=((r1 - r0) * k, (c1 - c0) * k),
+                           transform=window, fill=0, dtype='uint8')
+        fraction = inside.reshape(r1 - r0, k, c1 - c0, k).sum(axis=(1, 3)) / float(k * k)
+
+        rr, cc = nonzero(fraction)
+        if len(rr) == 0:
+            col, row = ~self.transform * ((west + east) / 2., (north + south) / 2.)
+            row, col = min(max(int(floor(row)), 0), rows - 1), min(max(int(floor(col)), 0), cols - 1)
+            return asarray([row * cols + col]), asarray([1.])
+
+        return (rr + r0) * cols + (cc + c0), fraction[rr, cc]
+
+    def stats(self, cube, operations=('mean',), index=None):
+        """ Per-polygon statistics of each time step of a cube on the grid.
+
+        NaN cells are left out. 'mean' is the coverage-weighted mean, 'sum' the
+        coverage-weighted sum and 'count' the covered cells with data, in cells.
+
+        :param cube: numpy.ndarray (time, row, col), or (row, col) for one step
+        :param operations: any of 'mean', 'sum', 'count'
+        :param index: index of the time steps, e.g. pandas.DatetimeIndex
+        :return: dict of pandas.DataFrame (time x polygon) by operation
+        """
+        for operation in operations:
+            if operation not in OPERATIONS:
+                raise ValueError('Unknown operation {}, choose from {}'.format(operation, OPERATIONS))
+
+        cube = asarray(cube)
+        if cube.ndim == 2:
+            cube = cube[None]
+        if cube.shape[1:] != self.shape:
+            raise ValueError('Cube of shape {} is not on the {} grid'.format(cube.shape[1:], self.shape))
+
+        values = cube.reshape(cube.shape[0], -1).T
+        valid = isfinite(values)
+        sums = self.matrix.dot(where(valid, values, 0.)).T
+        counts = self.matrix.dot(valid.astype(float)).T
+
+        with errstate(invalid='ignore', divide='ignore'):
+            means = where(counts > 0, sums / counts, nan)
+        results = {'mean': means, 'sum': sums, 'count': counts}
+
+        return dict((operation, DataFrame(results[operation], index=index, columns=self.ids))
+                    for operation in operations)
+
+# ========================= EOF ====================================================================
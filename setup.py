@@ -56,7 +56,8 @@ setup(name='metio',
       test_suite='tests.test_suite.suite',
       install_requires=['numpy', 'geopy', 'pandas', 'requests', 'fiona',
                         'future', 'xarray', 'pyproj', 'rasterio', 'xlrd',
-                        'SatelliteImage', 'bs4', 'netcdf4', 'refet', 'bounds'],
+                        'SatelliteImage', 'bs4', 'netcdf4', 'refet', 'bounds', 'scipy',
+                        'futures; python_version < "3"'],
       **setup_kwargs)
 
 
@@ -0,0 +1,154 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from netCDF4 import Dataset as NetCDFFile
+from numpy import arange, array_equal, float32
+
+from met.cache import ChunkCache
+
+
+class TestChunkCache(unittest.TestCase):
+    """ Chunked reads of a (day, lon, lat) grid, fetched from an in-memory array.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.dims = ('day', 'lon', 'lat')
+        self.shape = (50, 70)
+        self.grid = arange(3 * 70 * 50, dtype=float32).reshape(3, 70, 50)
+        self.fetched = []
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def fetch(self, space):
+        self.fetched.append(space)
+        return self.grid[:, space['lon'], space['lat']]
+
+    def _read(self, cache, lat, lon):
+        space = dict(lat=slice(*lat), lon=slice(*lon))
+        arr = cache.read(('gridmet', 'pr', 2014), space, self.shape, self.dims, self.fetch)
+        self.assertTrue(array_equal(arr, self.grid[:, space['lon'], space['lat']]))
+
+    def test_fetch_missing_chunks_only(self):
+        """ Test overlapping reads fetch only new chunks, and a new cache finds old chunks.
+        :return:
+        """
+        cache = ChunkCache(self.root, chunk_size=16)
+        self._read(cache, (5, 20), (3, 30))
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(len(cache), 4)
+
+        self._read(cache, (10, 30), (20, 40))
+        self.assertEqual(self.fetched[-1], dict(lat=slice(0, 32), lon=slice(32, 48)))
+        self.assertEqual(len(cache), 6)
+
+        self._read(cache, (0, 32), (0, 32))
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual(cache.hits, 6)
+
+        reopened = ChunkCache(self.root, chunk_size=16)
+        self.assertEqual(len(reopened), 6)
+        self._read(reopened, (45, 50), (60, 70))
+        self.assertEqual(self.fetched[-1], dict(lat=slice(32, 50), lon=slice(48, 70)))
+
+    def test_fetch_around_cached_chunks(self):
+        """ Test chunks cached between missing ones are not fetched again.
+        :return:
+        """
+        cache = ChunkCache(self.root, chunk_size=16)
+        self._read(cache, (0, 16), (16, 32))
+        self._read(cache, (16, 32), (0, 16))
+        fetched = cache.bytes_fetched
+
+        self._read(cache, (0, 32), (0, 32))
+        self.assertEqual(self.fetched[2:], [dict(lat=slice(0, 16), lon=slice(0, 16)),
+                                            dict(lat=slice(16, 32), lon=slice(16, 32))])
+        self.assertEqual(cache.bytes_fetched - fetched, 2 * self.grid[:, 0:16, 0:16].nbytes)
+
+    def test_prefetch_tiles(self):
+        """ Test degree tiles are prefetched once and serve any read within them.
+        :return:
+        """
+        cache = ChunkCache.tiles(self.root)
+        self.assertEqual(cache.chunk_size, 24)
+        space = dict(lat=slice(10, 30), lon=slice(20, 50))
+        fetched = cache.prefetch(('gridmet', 'pr', 2014), space, self.shape, self.dims, self.fetch)
+        self.assertEqual(fetched, self.grid[:, 0:72, 0:48].nbytes)
+        self.assertEqual(cache.prefetch(('gridmet', 'pr', 2014), space, self.shape, self.dims, self.fetch), 0)
+
+        self._read(cache, (2, 40), (30, 70))
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_refetch_grown_year(self):
+        """ Test chunks holding fewer time steps than the source now has are fetched again and replaced.
+        :return:
+        """
+        cache = ChunkCache(self.root, chunk_size=16)
+        key, space = ('gridmet', 'pr', 2014), dict(lat=slice(0, 16), lon=slice(0, 16))
+        short = self.grid[:2]
+        cache.read(key, space, self.shape, self.dims, lambda s: short[:, s['lon'], s['lat']], length=2)
+
+        reopened = ChunkCache(self.root, chunk_size=16)
+        arr = reopened.read(key, space, self.shape, self.dims, self.fetch, length=3)
+        self.assertTrue(array_equal(arr, self.grid[:, 0:16, 0:16]))
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(os.listdir(os.path.dirname(reopened.path(key, (0, 0)))), ['0_0_n3.nc'])
+
+    def test_read_days(self):
+        """ Test a time slice is read from fetched and cached chunks alike, stored in runs of days.
+        :return:
+        """
+        cache = ChunkCache(self.root, chunk_size=16, time_chunk=2)
+        key, space = ('gridmet', 'pr', 2014), dict(lat=slice(5, 20), lon=slice(3, 30))
+        for _ in range(2):
+            arr = cache.read(key, space, self.shape, self.dims, self.fetch, time=slice(1, 3))
+            self.assertTrue(array_equal(arr, self.grid[1:3, 3:30, 5:20]))
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(cache.hits, 4)
+
+        with NetCDFFile(cache.path(key, (0, 0))) as nc:
+            self.assertEqual(nc.variables['data'].chunking(), [2, 16, 16])
+
+    def test_evict_least_recently_used(self):
+        """ Test the byte budget drops the chunks read longest ago.
+        :return:
+        """
+        cache = ChunkCache(self.root, chunk_size=16)
+        self._read(cache, (0, 16), (0, 16))
+        one_chunk = cache.nbytes
+        self._read(cache, (16, 32), (0, 16))
+        self._read(cache, (0, 16), (0, 16))
+
+        cache.max_bytes = one_chunk * 2.5
+        self._read(cache, (32, 48), (0, 16))
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn(cache.path(('gridmet', 'pr', 2014), (0, 1)), cache._files)
+        self.assertIn(cache.path(('gridmet', 'pr', 2014), (0, 0)), cache._files)
+
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
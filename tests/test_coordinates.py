@@ -0,0 +1,160 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from datetime import datetime
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import arange, argmin, abs, array, array_equal, zeros
+from pandas import date_range
+from numpy.random import RandomState
+from xarray import Dataset
+
+from bounds import GeoBounds
+from met.coordinates import CoordinateIndex, CoordinateCache
+
+
+class TestCoordinateIndex(unittest.TestCase):
+    """ Nearest lookups on GridMet-like coordinates, checked against argmin scans.
+    """
+
+    def setUp(self):
+        self.lat = arange(49.4, 25., -1. / 24)
+        self.lon = arange(-124.7, -67., 1. / 24)
+        self.index = CoordinateIndex(self.lat, self.lon)
+
+    def test_nearest_matches_argmin(self):
+        """ Test ascending and descending axes, values off the grid and exact ties.
+        :return:
+        """
+        noise = RandomState(0)
+        for axis, coords, extra in [('lat', self.lat, [49.4, 25.1, 60., 10.]),
+                                    ('lon', self.lon, [-124.7, -67.1, -130., -60.])]:
+            values = noise.uniform(coords.min() - 1., coords.max() + 1., 500)
+            ties = (coords[:-1] + coords[1:]) / 2.
+            lookups = list(values) + list(ties) + extra
+            expected = [argmin(abs(coords - value)) for value in lookups]
+            self.assertEqual([self.index.nearest(axis, value) for value in lookups], expected)
+            self.assertTrue(array_equal(self.index.nearest_many(axis, lookups), expected))
+
+        uneven = CoordinateIndex(array([5., 3., 2.5, 0.]), array([0., 1., 1.5, 4.]))
+        for value in (-1., 0.5, 1.25, 2.75, 3.5, 6.):
+            self.assertEqual(uneven.nearest('lat', value), argmin(abs(uneven.lat - value)))
+            self.assertEqual(uneven.nearest('lon', value), argmin(abs(uneven.lon - value)))
+
+    def test_subset_matches_label_slices(self):
+        """ Test index slices select what the old argmin and .loc slicing did.
+        :return:
+        """
+        bbox = GeoBounds(west=-114.5, south=45.2, east=-112.9, north=46.8)
+        data = Dataset({'pr': (('lat', 'lon'), zeros((len(self.lat), len(self.lon))))},
+                       coords={'lat': self.lat, 'lon': self.lon})
+
+        space, src_bounds = self.index.subset(bbox, buffer=1.)
+
+        north = self.lat[argmin(abs(self.lat - (bbox.north + 1.)))]
+        south = self.lat[argmin(abs(self.lat - (bbox.south - 1.)))]
+        west = self.lon[argmin(abs(self.lon - (bbox.west - 1.)))]
+        east = self.lon[argmin(abs(self.lon - (bbox.east + 1.)))]
+        expected = data.loc[dict(lat=slice(north, south), lon=slice(west, east))]
+
+        self.assertEqual(src_bounds, (west, south, east, north))
+        subset = data.isel(**space)
+        self.assertTrue(array_equal(subset.lat.values, expected.lat.values))
+        self.assertTrue(array_equal(subset.lon.values, expected.lon.values))
+
+    def test_hyperslab_bytes(self):
+        """ Test bbox and dates become index ranges and their bytes in any dimension order.
+        :return:
+        """
+        days = date_range('2014-01-01', '2014-12-31')
+        data = Dataset({'precipitation_amount': (('day', 'lon', 'lat'),
+                                                 zeros((len(days), len(self.lon), len(self.lat))))},
+                       coords={'day': days, 'lat': self.lat, 'lon': self.lon})
+        index = CoordinateIndex.from_dataset(data)
+        self.assertEqual(index.dims, ('day', 'lon', 'lat'))
+
+        bbox = GeoBounds(west=-114.5, south=45.2, east=-112.9, north=46.8)
+        space, _ = index.subset(bbox)
+        time = index.time_slice(datetime(2014, 8, 20), datetime(2014, 8, 22))
+        self.assertEqual(time, slice(231, 234))
+
+        subset = data.isel(day=time, **space)
+        self.assertEqual(index.nbytes(space, time), subset.precipitation_amount.size * 4)
+        self.assertEqual(index.nbytes(), data.precipitation_amount.size * 4)
+        self.assertRaises(ValueError, index.time_slice, datetime(2015, 1, 1), datetime(2015, 1, 2))
+
+    def test_cache_reads_coordinates_once(self):
+        """ Test a cached index is reused without touching the dataset again.
+        :return:
+        """
+        cache = CoordinateCache()
+        data = Dataset(coords={'lat': self.lat, 'lon': self.lon})
+        self.assertIsNone(cache.get('url'))
+        index = cache.get('url', data)
+        self.assertIn('url', cache)
+        self.assertIs(cache.get('url', Dataset()), index)
+        cache.clear()
+        self.assertNotIn('url', cache)
+
+    def test_cache_expires(self):
+        """ Test an index older than max_age is read again from the dataset, in memory too.
+        :return:
+        """
+        cache = CoordinateCache(max_age=-1)
+        index = cache.get('url', Dataset(coords={'lat': self.lat, 'lon': self.lon}))
+        self.assertNotIn('url', cache)
+        self.assertTrue(cache.expired('url'))
+        self.assertIsNone(cache.get('url'))
+
+        grown = cache.get('url', Dataset(coords={'lat': self.lat[:2], 'lon': self.lon}))
+        self.assertIsNot(grown, index)
+        self.assertTrue(array_equal(grown.lat, self.lat[:2]))
+        self.assertFalse(CoordinateCache().expired('url'))
+
+    def test_cache_on_disk(self):
+        """ Test another cache on the same root reads a remote index from disk, local paths stay in memory.
+        :return:
+        """
+        root = mkdtemp()
+        try:
+            url = 'http://server/thredds/dodsC/MET/pr/pr_2014.nc'
+            days = date_range('2014-01-01', '2014-12-31')
+            data = Dataset({'precipitation_amount': (('day', 'lon', 'lat'),
+                                                     zeros((len(days), 3, 2), dtype='float32'))},
+                           coords={'day': days, 'lat': self.lat[:2], 'lon': self.lon[:3]})
+            data.precipitation_amount.encoding['chunksizes'] = (61, 3, 2)
+            CoordinateCache(root=root).get(url, data)
+            CoordinateCache(root=root).get('/data/pr_2014.nc', data)
+            self.assertEqual(len(os.listdir(root)), 1)
+
+            index = CoordinateCache(root=root).get(url)
+            self.assertTrue(array_equal(index.lat, self.lat[:2]))
+            self.assertTrue(array_equal(index.time, days.values))
+            self.assertEqual(index.dims, ('day', 'lon', 'lat'))
+            self.assertEqual(index.time_dim, 'day')
+            self.assertEqual(index.chunks, {'day': 61, 'lon': 3, 'lat': 2})
+
+            self.assertIsNone(CoordinateCache(root=root, max_age=-1).get(url))
+        finally:
+            rmtree(root)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
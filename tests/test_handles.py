@@ -0,0 +1,72 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import arange
+from xarray import Dataset
+
+from met.handles import DatasetPool
+
+
+class TestDatasetPool(unittest.TestCase):
+    """ Shared handles of small local NetCDFs.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.root, '{}.nc'.format(i))
+            Dataset({'data': (('x',), arange(5.) + i)}).to_netcdf(path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_open_once(self):
+        """ Test a path is opened once and its handle shared.
+        :return:
+        """
+        pool = DatasetPool()
+        first = pool.get(self.paths[0])
+        self.assertIs(pool.get(self.paths[0]), first)
+        self.assertEqual((pool.opens, pool.hits), (1, 1))
+        pool.close()
+        self.assertEqual(len(pool), 0)
+
+    def test_evict(self):
+        """ Test idle and least recently used handles close, and their slices still read.
+        :return:
+        """
+        pool = DatasetPool(max_idle=None, max_open=2)
+        view = pool.get(self.paths[0])['data'].isel(x=slice(1, 3))
+        pool.get(self.paths[1])
+        pool.get(self.paths[2])
+        self.assertNotIn(self.paths[0], pool)
+        self.assertEqual(list(view.values), [1., 2.])
+
+        pool.max_idle = -1
+        pool.evict_idle()
+        self.assertEqual(len(pool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,105 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from datetime import datetime
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from numpy import arange, array_equal, float32
+from numpy.random import RandomState
+from pandas import date_range
+from xarray import Dataset
+
+from bounds import GeoBounds
+from met.planner import GridMetPlanner
+from met.thredds import GridMet
+
+
+class TestGridMetPlanner(unittest.TestCase):
+    """ Jobs over local yearly files of the GridMet layout, merged and fanned back out.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        lat = arange(49., 42., -1. / 24)
+        lon = arange(-118., -104., 1. / 24)
+        for year in (2014, 2015):
+            days = date_range('{}-01-01'.format(year), '{}-12-31'.format(year))
+            values = arange(len(days) * len(lon) * len(lat), dtype=float32).reshape(len(days), len(lon), len(lat))
+            Dataset({'precipitation_amount': (('day', 'lon', 'lat'), values + year)},
+                    coords={'day': days, 'lat': lat, 'lon': lon}).to_netcdf(
+                os.path.join(self.root, 'pr_{}.nc'.format(year)))
+
+    def tearDown(self):
+        GridMet.handles.close()
+        rmtree(self.root)
+
+    def test_merge_and_fan_out(self):
+        """ Test overlapping boxes and adjacent windows share fetches and each job gets its own subset.
+        :return:
+        """
+        near = GeoBounds(west=-114., south=45., east=-113., north=46.)
+        beside = GeoBounds(west=-113.5, south=45.2, east=-112.5, north=45.8)
+        far = GeoBounds(west=-107.5, south=44.5, east=-107., north=45.)
+        jobs = [('pr', near, datetime(2014, 6, 1), datetime(2014, 6, 30)),
+                ('pr', near, datetime(2014, 7, 1), datetime(2014, 7, 31)),
+                ('pr', beside, datetime(2014, 6, 1), datetime(2014, 7, 31)),
+                ('pr', far, datetime(2014, 12, 30), datetime(2015, 1, 2))]
+
+        planner = GridMetPlanner(jobs, data_root=self.root)
+        fetches = planner.plan()
+        self.assertEqual(len(fetches), 3)
+        self.assertEqual(sorted(len(f.pieces) for f in fetches), [1, 1, 3])
+        report = planner.report
+        self.assertEqual(report['jobs'], 4)
+        self.assertGreater(report['saved_bytes'], 0)
+        self.assertEqual(report['requested_bytes'] - report['fetched_bytes'], report['saved_bytes'])
+
+        results = planner.run()
+        for (variable, bbox, start, end), result in zip(jobs, results):
+            gridmet = GridMet(variable, start=start, end=end, bbox=bbox, data_root=self.root)
+            expected, _ = gridmet._subset()
+            self.assertTrue(array_equal(result.precipitation_amount.values, expected.precipitation_amount.values))
+            self.assertEqual(list(result.time.to_index()), list(date_range(start, end)))
+
+    def test_plan_many_jobs(self):
+        """ Test hundreds of small boxes plan quickly and leave no two fetches worth merging.
+        :return:
+        """
+        rng = RandomState(0)
+        jobs = []
+        for west, south in zip(rng.uniform(-116., -106.4, 400), rng.uniform(44., 47.8, 400)):
+            bbox = GeoBounds(west=west, south=south, east=west + .2, north=south + .2)
+            jobs.append(('pr', bbox, datetime(2014, 6, 1), datetime(2014, 6, 30)))
+
+        planner = GridMetPlanner(jobs, buffer=0., data_root=self.root)
+        planner._pieces()
+        started = time()
+        fetches = planner.plan()
+        self.assertLess(time() - started, 5.)
+
+        self.assertEqual(sum(len(f.pieces) for f in fetches), 400)
+        for i, f in enumerate(fetches):
+            for other in fetches[i + 1:]:
+                self.assertGreater(f.union(other).cells, f.cells + other.cells)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,96 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from datetime import datetime
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import arange, array_equal, float32
+from pandas import date_range
+from xarray import Dataset
+
+from bounds import GeoBounds
+from met.cache import ChunkCache
+from met.prefetch import main, prefetch
+from met.thredds import GridMet
+
+
+class TestPrefetch(unittest.TestCase):
+    """ Prefetch tiles of local yearly files of the GridMet layout.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.mirror = os.path.join(self.root, 'mirror')
+        self.tiles = os.path.join(self.root, 'tiles')
+        os.mkdir(self.mirror)
+        lat = arange(48., 43., -1. / 24)
+        lon = arange(-116., -110., 1. / 24)
+        for year in (2014, 2015):
+            days = date_range('{}-01-01'.format(year), '{}-12-31'.format(year))
+            values = arange(len(days) * len(lon) * len(lat), dtype=float32).reshape(len(days), len(lon), len(lat))
+            Dataset({'wind_speed': (('day', 'lon', 'lat'), values + year)},
+                    coords={'day': days, 'lat': lat, 'lon': lon}).to_netcdf(
+                os.path.join(self.mirror, 'vs_{}.nc'.format(year)))
+        self.bbox = GeoBounds(west=-114., south=44.5, east=-112., north=46.5)
+
+    def tearDown(self):
+        GridMet.handles.close()
+        rmtree(self.root)
+
+    def test_prefetch_resumes(self):
+        """ Test tiles are fetched once, a lost tile alone is fetched again, and reads use them.
+        :return:
+        """
+        calls = []
+        report = prefetch(['vs'], [2014, 2015], self.bbox, self.tiles, data_root=self.mirror,
+                          progress=lambda done, total: calls.append((done, total)))
+        # rows 12 to 109 and columns 24 to 121 of the mirror touch 5 by 5 tiles a year
+        self.assertEqual(report['tiles'], 50)
+        self.assertEqual(report['cached'], 0)
+        self.assertEqual(report['fetched_bytes'], report['total_bytes'])
+        self.assertEqual(len(calls), 50)
+        self.assertEqual(calls[-1][0], calls[-1][1])
+
+        cache = ChunkCache.tiles(self.tiles)
+        os.remove(cache.path(('gridmet', 'vs', 2015), (2, 3), length=365))
+        report = prefetch(['vs'], [2014, 2015], self.bbox, self.tiles, data_root=self.mirror)
+        self.assertEqual(report['cached'], 49)
+        self.assertEqual(report['fetched_bytes'], 24 * 24 * 365 * 4)
+
+        cache = ChunkCache.tiles(self.tiles)
+        kwargs = dict(start=datetime(2014, 12, 30), end=datetime(2015, 1, 2), bbox=self.bbox,
+                      data_root=self.mirror)
+        subset, _ = GridMet('vs', cache=cache, **kwargs)._subset()
+        self.assertEqual(cache.bytes_fetched, 0)
+        expected, _ = GridMet('vs', **kwargs)._subset()
+        self.assertTrue(array_equal(subset.wind_speed.values, expected.wind_speed.values))
+
+    def test_command(self):
+        """ Test the command line fetches a bbox over a range of years.
+        :return:
+        """
+        main([self.tiles, '--variables', 'vs', '--years', '2014-2015', '--bbox', '-113', '45', '-112.5', '45.5',
+              '--data-root', self.mirror, '--workers', '2'])
+        # a half-degree box buffered by a degree touches 3 by 4 tiles a year
+        self.assertEqual(len(ChunkCache.tiles(self.tiles)), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,74 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from netCDF4 import Dataset as NetCDFFile
+from numpy import arange, array_equal, float32
+from pandas import date_range
+from xarray import Dataset, open_dataset
+
+from met.rechunk import rechunk, yearly_files
+
+
+class TestRechunk(unittest.TestCase):
+    """ Join yearly files of the GridMet (day, lon, lat) layout into one series store.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.lat = arange(48., 47., -1. / 24)
+        self.lon = arange(-114., -112.5, 1. / 24)
+        self.values = {}
+        for year in (2014, 2015):
+            days = date_range('{}-01-01'.format(year), '{}-12-31'.format(year))
+            values = arange(len(days) * len(self.lon) * len(self.lat), dtype=float32).reshape(
+                len(days), len(self.lon), len(self.lat)) + year * 1e6
+            Dataset({'precipitation_amount': (('day', 'lon', 'lat'), values)},
+                    coords={'day': days, 'lat': self.lat, 'lon': self.lon}).to_netcdf(
+                os.path.join(self.root, 'pr_{}.nc'.format(year)))
+            self.values[year] = values.transpose(0, 2, 1)
+        open(os.path.join(self.root, 'pr_notes.nc'), 'w').close()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_rechunk(self):
+        """ Test every day of every cell is in the store, in (time, lat, lon) chunks.
+        :return:
+        """
+        self.assertEqual([year for year, _ in yearly_files(self.root, 'pr')], [2014, 2015])
+        # a tiny memory budget writes one chunk column at a time
+        path = rechunk(self.root, 'pr', time_chunk=400, space_chunk=8, max_memory=1)
+        self.assertEqual(path, os.path.join(self.root, 'pr_series.nc'))
+
+        with NetCDFFile(path) as nc:
+            self.assertEqual(nc.variables['precipitation_amount'].chunking(), [400, 8, 8])
+            self.assertEqual(nc.years, '2014 2015')
+
+        with open_dataset(path) as store:
+            self.assertEqual(store.precipitation_amount.dims, ('time', 'lat', 'lon'))
+            self.assertEqual(list(store.time.to_index()), list(date_range('2014-01-01', '2015-12-31')))
+            self.assertTrue(array_equal(store.precipitation_amount.values[:365], self.values[2014]))
+            self.assertTrue(array_equal(store.precipitation_amount.values[365:], self.values[2015]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
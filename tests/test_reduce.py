@@ -0,0 +1,64 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+
+from numpy import allclose, array_equal, isnan, nan, nanmax, nanmean, nanmin, nansum
+from numpy.random import RandomState
+
+from met.reduce import RunningReduction
+
+
+class TestRunningReduction(unittest.TestCase):
+    """ Chunked reductions against numpy on the whole cube.
+    """
+
+    def test_chunks_match_whole_cube(self):
+        """ Test reductions over uneven chunks with gaps match the nan-aware numpy ones.
+        :return:
+        """
+        cube = RandomState(0).rand(17, 6, 5)
+        cube[3:9, 2, 2] = nan
+        cube[:, 0, 0] = nan
+
+        reduction = RunningReduction()
+        for first, last in [(0, 4), (4, 5), (5, 12), (12, 17)]:
+            reduction.update(cube[first:last])
+        result = reduction.result()
+
+        self.assertEqual(reduction.steps, 17)
+        self.assertTrue(allclose(result['sum'][0], nansum(cube, axis=0)))
+        self.assertTrue(array_equal(result['count'][0], (~isnan(cube)).sum(axis=0)))
+        valid = ~isnan(cube).all(axis=0)
+        self.assertTrue(allclose(result['mean'][0][valid], nanmean(cube[:, valid], axis=0)))
+        self.assertTrue(array_equal(result['min'][0][valid], nanmin(cube[:, valid], axis=0)))
+        self.assertTrue(array_equal(result['max'][0][valid], nanmax(cube[:, valid], axis=0)))
+        self.assertTrue(isnan(result['mean'][0, 0, 0]) and isnan(result['min'][0, 0, 0]))
+
+    def test_operations(self):
+        """ Test only the asked reductions are returned and unknown ones are refused.
+        :return:
+        """
+        reduction = RunningReduction(('max',))
+        self.assertRaises(ValueError, reduction.result)
+        reduction.update(RandomState(1).rand(3, 2, 2))
+        self.assertEqual(list(reduction.result()), ['max'])
+        self.assertRaises(ValueError, RunningReduction, ('median',))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
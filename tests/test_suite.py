@@ -24,11 +24,24 @@ def suite():
     from tests.test_agrimet import TestAgrimet
     from tests.test_eddy_flux import EddyTowerTestCase
     from tests.test_topowx import TestTopoWX
+    from tests.test_thredds import TestThreddsConform, TestGridMetYears
+    from tests.test_warp import TestWarpPlanCache
+    from tests.test_coordinates import TestCoordinateIndex
+    from tests.test_cache import TestChunkCache
+    from tests.test_reduce import TestRunningReduction
+    from tests.test_zonal import TestZonalWeights
+    from tests.test_rechunk import TestRechunk
+    from tests.test_handles import TestDatasetPool
+    from tests.test_planner import TestGridMetPlanner
+    from tests.test_prefetch import TestPrefetch
 
     loader = unittest.TestLoader()
     test_suite = unittest.TestSuite()
 
-    tests = (TestGridMet, TestAgrimet, EddyTowerTestCase, TestTopoWX,)
+    tests = (TestGridMet, TestAgrimet, EddyTowerTestCase, TestTopoWX, TestThreddsConform,
+             TestWarpPlanCache, TestCoordinateIndex, TestGridMetYears,
+             TestChunkCache, TestRunningReduction, TestZonalWeights, TestRechunk,
+             TestDatasetPool, TestGridMetPlanner, TestPrefetch)
 
     for t in tests:
         test_suite.addTest(loader.loadTestsFromTestCase(t))
@@ -0,0 +1,704 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+import os
+from datetime import datetime
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import allclose, arange, argmin, abs, array, array_equal, concatenate, float32, float64, isin, mgrid, \
+    sin, zeros
+from pandas import date_range
+from numpy.random import RandomState
+from pyproj import Proj
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.transform import Affine
+
+from shapely.geometry import box
+from netCDF4 import Dataset as NetCDFFile
+from xarray import Dataset, open_dataset
+
+from bounds import GeoBounds
+from met.cache import ChunkCache
+from met.coordinates import CoordinateCache
+from met.rechunk import rechunk
+from met.scratch import ScratchManager
+from met.thredds import GridMet, GridMetBatch, TopoWX
+
+
+class TestThreddsConform(unittest.TestCase):
+    """ Conform GridMet-like arrays to a synthetic UTM target, no network needed.
+    """
+
+    def setUp(self):
+        self.date = datetime(2014, 8, 20)
+        west, north, res = 400000., 5200000., 120.
+        self.width, self.height = 400, 450
+        east, south = west + self.width * res, north - self.height * res
+
+        self.target_profile = {'driver': 'GTiff', 'dtype': 'float32', 'nodata': None,
+                               'width': self.width, 'height': self.height, 'count': 1,
+                               'crs': CRS({'init': 'epsg:32612'}),
+                               'transform': Affine(res, 0., west, 0., -res, north)}
+
+        utm = Proj(init='epsg:32612')
+        w, n = utm(west, north, inverse=True)
+        e, s = utm(east, south, inverse=True)
+        self.bbox = GeoBounds(west=w, south=s, east=e, north=n)
+
+        self.clip_feature = {'type': 'Polygon',
+                             'coordinates': [[(west + 5000., north - 3000.),
+                                              (east - 4000., north - 8000.),
+                                              (east - 6000., south + 4000.),
+                                              (west + 3000., south + 2000.),
+                                              (west + 5000., north - 3000.)]]}
+
+        # native GridMet grid, buffered by a degree as in GridMet.get_data_subset
+        lat = arange(49.4, 25., -1. / 24)
+        lon = arange(-124.7, -67., 1. / 24)
+        north_ind = argmin(abs(lat - (self.bbox.north + 1.)))
+        south_ind = argmin(abs(lat - (self.bbox.south - 1.)))
+        west_ind = argmin(abs(lon - (self.bbox.west - 1.)))
+        east_ind = argmin(abs(lon - (self.bbox.east + 1.)))
+        self.src_bounds_wsen = (lon[west_ind], lat[south_ind], lon[east_ind], lat[north_ind])
+        self.src_shape = (south_ind - north_ind + 1, east_ind - west_ind + 1)
+
+    def _gridmet(self, **kwargs):
+        gridmet = GridMet('pr', date=self.date, bbox=self.bbox,
+                          target_profile=self.target_profile,
+                          clip_feature=self.clip_feature, **kwargs)
+        gridmet.src_bounds_wsen = self.src_bounds_wsen
+        return gridmet
+
+    def _cube(self, days=1):
+        rows, cols = self.src_shape
+        yy, xx = mgrid[0:rows, 0:cols]
+        noise = RandomState(0)
+        return array([sin(yy / 5. + d) * 10. + xx * 0.3 + noise.rand(rows, cols)
+                      for d in range(days)], dtype=float32)
+
+    def test_conform_in_memory(self):
+        """ Test in-memory conform matches the temp GeoTIFF path and leaves no files.
+        :return:
+        """
+        arr = self._cube()
+        on_disk = self._gridmet().conform(arr)
+        gridmet = self._gridmet(in_memory=True)
+        in_memory = gridmet.conform(arr)
+        self.assertEqual(in_memory.shape, (1, self.height, self.width))
+        self.assertTrue(array_equal(on_disk, in_memory))
+        self.assertEqual(os.listdir(gridmet.scratch.directory), [])
+
+    def test_conform_scratch(self):
+        """ Test staged conform writes to a shared, capped scratch and cleans it up.
+        :return:
+        """
+        arr = self._cube()
+        with ScratchManager(max_bytes=64 * 1024 * 1024) as scratch:
+            first, second = self._gridmet(scratch=scratch), self._gridmet(scratch=scratch)
+            self.assertTrue(array_equal(first.conform(arr), self._gridmet().conform(arr)))
+            written = scratch.bytes_written
+            self.assertGreater(written, arr.nbytes)
+            second.conform(arr)
+            self.assertEqual(scratch.bytes_written, 2 * written)
+            self.assertEqual(scratch.bytes_in_use, 0)
+            self.assertEqual(os.listdir(scratch.directory), [])
+            directory = scratch.directory
+        self.assertFalse(os.path.exists(directory))
+
+        with ScratchManager(max_bytes=arr.nbytes) as scratch:
+            self.assertRaises(IOError, self._gridmet(scratch=scratch).conform, arr)
+            self.assertEqual(scratch.bytes_in_use, 0)
+            self.assertEqual(os.listdir(scratch.directory), [])
+
+    def test_conform_time_stack(self):
+        """ Test a (time, y, x) cube conforms to the same bands as day-by-day calls.
+        :return:
+        """
+        arr = self._cube(days=3)
+        gridmet = self._gridmet(in_memory=True)
+        stack = gridmet.conform(arr)
+        self.assertEqual(stack.shape, (3, self.height, self.width))
+        for day in range(3):
+            single = gridmet.conform(arr[day:day + 1])
+            self.assertTrue(array_equal(stack[day:day + 1], single))
+
+    def test_conform_reuses_warp_plan(self):
+        """ Test in-memory conform plans a target once and matches the staged path.
+        :return:
+        """
+        GridMet.plan_cache.clear()
+        arr = self._cube(days=2)
+        staged = self._gridmet().conform(arr)
+        first = self._gridmet(in_memory=True)
+        planned = first.conform(arr)
+        self.assertTrue(array_equal(staged, planned))
+        self.assertEqual(len(GridMet.plan_cache), 1)
+
+        second = self._gridmet(in_memory=True)
+        plan = second.warp_plan(arr.shape[1:])
+        self.assertIs(plan, first.warp_plan(arr.shape[1:]))
+        self.assertEqual(len(GridMet.plan_cache), 1)
+
+    def test_warp_plan_large_indices(self):
+        """ Test plan stages carry cell indices above 2 ** 24, where float32 would round them.
+        :return:
+        """
+        gridmet = self._gridmet()
+        profile = dict(self.target_profile, nodata=-1.)
+        rows, cols = self.src_shape
+        index = (arange(rows * cols, dtype=float64) + 2 ** 24 + 1.).reshape(1, rows, cols)
+        stage = gridmet._project(index, self.src_bounds_wsen, profile, dtype=float64)
+        stage = gridmet._reproject(stage, profile, dtype=float64)
+        with gridmet._open_stage(stage) as src:
+            traced = src.read(1)
+        gridmet._release_stage(stage)
+
+        traced = traced[traced > 0]
+        self.assertTrue(isin(traced, index).all())
+        self.assertTrue((traced % 2 == 1).any())
+
+    def test_conform_settings(self):
+        """ Test warp settings reach both staged paths alike.
+        :return:
+        """
+        arr = self._cube()
+        settings = dict(num_threads=4, gdal_cachemax=256, warp_mem_limit=64, resampling='bilinear')
+        staged = self._gridmet(**settings).conform(arr)
+        planned = self._gridmet(in_memory=True, **settings).conform(arr)
+        self.assertTrue(array_equal(staged, planned))
+        self.assertFalse(array_equal(staged, self._gridmet().conform(arr)))
+
+    def test_conform_many(self):
+        """ Test one object conforms many arrays on threads, staged on disk and in memory.
+        :return:
+        """
+        arrays = [self._cube(days=2) * (i + 1) for i in range(4)]
+        for kwargs in (dict(), dict(in_memory=True)):
+            gridmet = self._gridmet(**kwargs)
+            expected = [gridmet.conform(arr) for arr in arrays]
+            results = gridmet.conform_many(arrays, max_workers=4)
+            for result, single in zip(results, expected):
+                self.assertTrue(array_equal(result, single))
+            self.assertEqual(os.listdir(gridmet.scratch.directory), [])
+
+    def test_conform_aligned(self):
+        """ Test native-grid targets are sliced, replicated or averaged with no warp.
+        :return:
+        """
+        arr = self._cube(days=2)
+        west, south, east, north = self.src_bounds_wsen
+        res = (east - west) / (self.src_shape[1] - 1)
+        origin_x, origin_y = west - res / 2. + 5 * res, north + res / 2. - 3 * res
+
+        for factor, size, expected in [
+                (1., 40, arr[:, 3:43, 5:45]),
+                (4., 40, arr[:, 3:13, 5:15].repeat(4, axis=1).repeat(4, axis=2)),
+                (0.5, 20, arr[:, 3:43, 5:45].reshape(2, 20, 2, 20, 2).mean(axis=(2, 4)))]:
+            profile = dict(self.target_profile, crs=CRS({'init': 'epsg:4326'}), width=size, height=size,
+                           transform=Affine(res / factor, 0., origin_x, 0., -res / factor, origin_y))
+            gridmet = GridMet('pr', date=self.date, bbox=self.bbox, target_profile=profile)
+            self.assertIsNotNone(gridmet._aligned_grid(self.src_shape, self.src_bounds_wsen))
+            conformed = gridmet.conform(arr, src_bounds=self.src_bounds_wsen)
+            self.assertTrue(allclose(conformed, expected, rtol=0., atol=.25))
+
+    def test_conform_fused(self):
+        """ Test the fused engine fills the target grid and clips to the feature.
+        :return:
+        """
+        arr = self._cube(days=2)
+        fused = self._gridmet(fused=True).conform(arr)
+        self.assertEqual(fused.shape, (2, self.height, self.width))
+        outside = geometry_mask([self.clip_feature], out_shape=(self.height, self.width),
+                                transform=self.target_profile['transform'], all_touched=True)
+        self.assertTrue((fused[:, outside] == 0.).all())
+        self.assertTrue((fused[:, ~outside] != 0.).any())
+
+    def test_conform_tiled(self):
+        """ Test tiled conform streams the fused result to a raster.
+
+        Tiles only differ from one warp by GDAL's approximate transformer, 1/8 source cell.
+        :return:
+        """
+        arr = self._cube(days=2)
+        fused = self._gridmet(fused=True).conform(arr)
+        out_file = os.path.join(mkdtemp(), 'tiled.tif')
+        gridmet = self._gridmet(tile_size=128)
+        self.assertEqual(gridmet.conform(arr, out_file=out_file), out_file)
+        with rasopen(out_file, 'r') as src:
+            tiled = src.read()
+        rmtree(os.path.dirname(out_file))
+        self.assertEqual(tiled.shape, fused.shape)
+        self.assertTrue(array_equal(tiled == 0., fused == 0.))
+        self.assertTrue(allclose(tiled, fused, atol=0.25))
+
+    def test_conform_tiled_coarse(self):
+        """ Test tiles of a target coarser than the source read enough source cells for the wider kernel.
+        :return:
+        """
+        res = 12000.
+        self.target_profile = dict(self.target_profile, width=4, height=4,
+                                   transform=Affine(res, 0., 400000., 0., -res, 5200000.))
+        arr = self._cube()
+        fused = self._gridmet(fused=True).conform(arr)
+        out_file = os.path.join(mkdtemp(), 'tiled.tif')
+        self._gridmet(tile_size=2).conform(arr, out_file=out_file)
+        with rasopen(out_file, 'r') as src:
+            tiled = src.read()
+        rmtree(os.path.dirname(out_file))
+        self.assertTrue(allclose(tiled, fused, rtol=0., atol=0.01))
+
+
+class TestGridMetYears(unittest.TestCase):
+    """ Read a date range across yearly files, here small local NetCDFs of the GridMet layout.
+    """
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.lat = arange(48., 43., -1. / 24)
+        self.lon = arange(-116., -110., 1. / 24)
+        self.paths = {}
+        # vs varies by cell, the others only by day
+        cells = arange(len(self.lat))[:, None] * 1000. + arange(len(self.lon))[None, :]
+        for variable, name, offset in [('pr', 'precipitation_amount', 0.),
+                                       ('tmmx', 'air_temperature', 0.5),
+                                       ('vs', 'wind_speed', cells[None] * 1e-3)]:
+            for year in (2013, 2014, 2015):
+                days = date_range('{}-01-01'.format(year), '{}-12-31'.format(year))
+                values = (arange(len(days), dtype=float32)[:, None, None] + year * 1000. + offset +
+                          zeros((1, len(self.lat), len(self.lon)), dtype=float32))
+                data = Dataset({name: (('day', 'lat', 'lon'), values)},
+                               coords={'day': days, 'lat': self.lat, 'lon': self.lon})
+                path = os.path.join(self.root, '{}_{}.nc'.format(variable, year))
+                data.to_netcdf(path, encoding={name: {'chunksizes': (100, 40, 40)}})
+                self.paths[(variable, year)] = path
+        self.bbox = GeoBounds(west=-114., south=44.5, east=-112., north=46.5)
+
+    def tearDown(self):
+        GridMet.handles.close()
+        rmtree(self.root)
+
+    def _local(self, gridmet):
+        gridmet.data_root = self.root
+        return gridmet
+
+    def _gridmet(self, **kwargs):
+        return self._local(GridMet('pr', **kwargs))
+
+    def test_local_mirror(self):
+        """ Test files under data_root are read in place of the server's, which serves the rest.
+        :return:
+        """
+        gridmet = GridMet('pr', start=datetime(2014, 1, 1), end=datetime(2014, 1, 2), data_root=self.root)
+        self.assertEqual(gridmet._build_url(2014), self.paths[('pr', 2014)])
+        self.assertEqual(gridmet._build_url(2016),
+                         'http://thredds.northwestknowledge.net:8080/thredds/dodsC/MET/pr/pr_2016.nc')
+
+        nested = os.path.join(self.root, 'vs')
+        os.mkdir(nested)
+        os.rename(self.paths[('vs', 2015)], os.path.join(nested, 'vs_2015.nc'))
+        self.assertEqual(gridmet._build_url(2015, 'vs'), os.path.join(nested, 'vs_2015.nc'))
+        self.assertTrue(gridmet._build_url(2013, 'elev').startswith('http://'))
+
+        series = self._gridmet(start=datetime(2013, 12, 31), end=datetime(2014, 1, 1),
+                               lat=45., lon=-113.).get_point_timeseries()
+        self.assertEqual(list(series['pr'].values), [2013364., 2014000.])
+
+    def test_topowx_local_and_remote(self):
+        """ Test a TopoWX range across a local year and the remote dataset takes each day once.
+        :return:
+        """
+        def write(path, start, end, offset):
+            days = date_range(start, end)
+            values = (arange(len(days), dtype=float32)[:, None, None] + offset +
+                      zeros((1, len(self.lat), len(self.lon)), dtype=float32))
+            Dataset({'tmax': (('time', 'lat', 'lon'), values)},
+                    coords={'time': days, 'lat': self.lat, 'lon': self.lon}).to_netcdf(path)
+
+        write(os.path.join(self.root, 'tmax_2013.nc'), '2013-01-01', '2013-12-31', 0.)
+        # the remote dataset, here a file, holds every year
+        remote = os.path.join(self.root, 'topowx.nc')
+        write(remote, '2013-01-01', '2014-12-31', 1000.)
+
+        topowx = TopoWX(start=datetime(2013, 12, 30), end=datetime(2014, 1, 2), bbox=self.bbox,
+                        data_root=self.root)
+        build_url = topowx._build_url
+        topowx._build_url = lambda var=None, year=None: (build_url(var, year) if year == 2013 else remote)
+
+        topowx.get_data_subset(var='tmax')
+        self.assertEqual(list(topowx.tmax.time.to_index()), list(date_range('2013-12-30', '2014-01-02')))
+        self.assertEqual(list(topowx.tmax.tmax.values[:, 0, 0]), [363., 364., 1365., 1366.])
+
+    def test_expired_index_reopens(self):
+        """ Test an expired coordinate index is read again from a freshly opened handle.
+        :return:
+        """
+        gridmet = self._gridmet(start=datetime(2014, 1, 1), end=datetime(2014, 1, 2))
+        gridmet.coordinate_cache = CoordinateCache(max_age=-1)
+        url = self.paths[('pr', 2014)]
+        opens = GridMet.handles.opens
+
+        handle = GridMet.handles.get(url)
+        gridmet._coordinate_index(url)
+        self.assertEqual(GridMet.handles.opens, opens + 1)
+        gridmet._coordinate_index(url)
+        self.assertEqual(GridMet.handles.opens, opens + 2)
+        self.assertIsNot(GridMet.handles.get(url), handle)
+
+    def test_series_store(self):
+        """ Test point and small-area series come from a rechunked store in the mirror.
+        :return:
+        """
+        rechunk(self.root, 'vs', time_chunk=1096, space_chunk=8)
+        kwargs = dict(start=datetime(2013, 12, 31), end=datetime(2015, 1, 1), lat=45., lon=-113.)
+        eager = self._local(GridMet('vs', **kwargs)).get_point_timeseries()
+        for year in (2013, 2014, 2015):
+            os.remove(self.paths[('vs', year)])
+
+        gridmet = self._local(GridMet('vs', **kwargs))
+        self.assertEqual(gridmet._series()[0], os.path.join(self.root, 'vs_series.nc'))
+        series = gridmet.get_point_timeseries()
+        self.assertTrue(array_equal(series['vs'].values, eager['vs'].values))
+        self.assertEqual(list(series.index), list(date_range('2013-12-31', '2015-01-01')))
+
+        points = gridmet.get_points_timeseries([45., 46.], [-113., -112.5])
+        self.assertTrue(array_equal(points[0].values, eager['vs'].values))
+
+        subset, _ = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2015, 1, 2),
+                                        bbox=self.bbox))._subset()
+        self.assertEqual(subset.wind_speed.shape, (4, 97, 97))
+
+        # a range beyond the store goes back to the yearly files
+        self.assertEqual(self._gridmet(start=datetime(2016, 1, 1), end=datetime(2016, 1, 2))._series(),
+                         (None, None))
+
+    def test_subset_across_years(self):
+        """ Test a range across three years is joined in order along time.
+        :return:
+        """
+        gridmet = self._gridmet(start=datetime(2013, 12, 30), end=datetime(2015, 1, 2), bbox=self.bbox)
+        subset, src_bounds = gridmet._subset()
+        values = subset.precipitation_amount.values[:, 0, 0]
+        self.assertEqual(len(values), 369)
+        self.assertEqual(list(values[:3]), [2013363., 2013364., 2014000.])
+        self.assertEqual(list(values[-3:]), [2014364., 2015000., 2015001.])
+        self.assertEqual(src_bounds, (self.lon[24], self.lat[108], self.lon[120], self.lat[12]))
+        self.assertEqual(subset.precipitation_amount.shape, (369, 97, 97))
+
+    def test_point_timeseries_across_years(self):
+        """ Test one point series spans yearly files and the date index.
+        :return:
+        """
+        gridmet = self._gridmet(start=datetime(2014, 12, 31), end=datetime(2015, 1, 1),
+                                lat=45., lon=-113.)
+        series = gridmet.get_point_timeseries()
+        self.assertEqual(list(series['pr'].values), [2014364., 2015000.])
+        self.assertEqual(list(series.index), list(date_range('2014-12-31', '2015-01-01')))
+
+    def test_cached_subsets(self):
+        """ Test cached subsets and point series match direct reads and skip fetching on repeat.
+        :return:
+        """
+        kwargs = dict(start=datetime(2013, 12, 30), end=datetime(2014, 1, 2), bbox=self.bbox)
+        direct, _ = self._gridmet(**kwargs)._subset()
+
+        cache = ChunkCache(os.path.join(self.root, 'cache'), chunk_size=32)
+        cached, _ = self._gridmet(cache=cache, **kwargs)._subset()
+        self.assertTrue(array_equal(cached.precipitation_amount.values,
+                                    direct.precipitation_amount.values))
+        self.assertTrue(array_equal(cached.lat.values, direct.lat.values))
+        misses = cache.misses
+
+        self._gridmet(cache=cache, **kwargs)._subset()
+        series = self._gridmet(cache=cache, start=datetime(2013, 12, 31), end=datetime(2014, 1, 1),
+                               lat=45., lon=-113.).get_point_timeseries()
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(list(series['pr'].values), [2013364., 2014000.])
+
+    def test_cached_year_grows(self):
+        """ Test chunks of a year cached before its file gained days are fetched again.
+        :return:
+        """
+        def write(days):
+            days = date_range('2016-01-01', periods=days)
+            values = arange(len(days), dtype=float32)[:, None, None] + zeros((1, len(self.lat), len(self.lon)),
+                                                                             dtype=float32)
+            Dataset({'precipitation_amount': (('day', 'lat', 'lon'), values)},
+                    coords={'day': days, 'lat': self.lat, 'lon': self.lon}).to_netcdf(path)
+
+        path = os.path.join(self.root, 'pr_2016.nc')
+        write(100)
+        root = os.path.join(self.root, 'cache')
+        self._gridmet(cache=ChunkCache(root, chunk_size=32), start=datetime(2016, 4, 1),
+                      end=datetime(2016, 4, 9), bbox=self.bbox)._subset()
+
+        # a new process, the file now a further 20 days on
+        GridMet.handles.close()
+        GridMet.coordinate_cache.clear()
+        write(120)
+        cache = ChunkCache(root, chunk_size=32)
+        subset, _ = self._gridmet(cache=cache, start=datetime(2016, 4, 1), end=datetime(2016, 4, 29),
+                                  bbox=self.bbox)._subset()
+        self.assertEqual(list(subset.precipitation_amount.values[-2:, 0, 0]), [118., 119.])
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(len(cache), 16)
+
+    def test_prefetch_tiles(self):
+        """ Test prefetched degree tiles serve a different bbox within them with no fetch.
+        :return:
+        """
+        cache = ChunkCache.tiles(os.path.join(self.root, 'tiles'))
+        kwargs = dict(start=datetime(2014, 12, 30), end=datetime(2015, 1, 2), cache=cache)
+        fetched = self._local(GridMet('vs', bbox=self.bbox, **kwargs)).prefetch_tiles()
+        self.assertGreater(fetched, 0)
+        self.assertEqual(cache.bytes_fetched, fetched)
+
+        inner = GeoBounds(west=-113.8, south=44.7, east=-112.3, north=46.1)
+        subset, _ = self._local(GridMet('vs', bbox=inner, **kwargs))._subset()
+        self.assertEqual(cache.bytes_fetched, fetched)
+        expected, _ = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2015, 1, 2),
+                                          bbox=inner))._subset()
+        self.assertTrue(array_equal(subset.wind_speed.values, expected.wind_speed.values))
+
+    def test_points_timeseries(self):
+        """ Test many points in one call match one-point series, direct and cached.
+        :return:
+        """
+        kwargs = dict(start=datetime(2014, 12, 30), end=datetime(2015, 1, 2))
+        lats = [45., 44.02, 47.5, 45.]
+        lons = [-113., -115.3, -110.9, -113.]
+
+        cache = ChunkCache(os.path.join(self.root, 'cache'), chunk_size=32)
+        for gridmet in (self._local(GridMet('vs', **kwargs)),
+                        self._local(GridMet('vs', cache=cache, **kwargs))):
+            points = gridmet.get_points_timeseries(lats, lons, names=['a', 'b', 'c', 'd'])
+            self.assertEqual(points.shape, (4, 4))
+            self.assertEqual(list(points.columns), ['a', 'b', 'c', 'd'])
+            for column, lat, lon in zip(points.columns, lats, lons):
+                single = self._local(GridMet('vs', lat=lat, lon=lon, **kwargs)).get_point_timeseries()
+                self.assertTrue(array_equal(points[column].values, single['vs'].values))
+                self.assertTrue(array_equal(points.index, single.index))
+
+        self.assertEqual(cache.misses, 6)
+        long_format = gridmet.get_points_timeseries(lats, lons, long_format=True)
+        self.assertEqual(list(long_format.columns), ['time', 'point', 'vs'])
+        self.assertEqual(len(long_format), 16)
+
+    def test_points_read_by_block(self):
+        """ Test many points are read a block of the grid at a time and match the file's cells.
+        :return:
+        """
+        rng = RandomState(0)
+        rows, cols = rng.randint(0, len(self.lat), 500), rng.randint(0, len(self.lon), 500)
+        gridmet = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2014, 12, 31)))
+        points = gridmet.get_points_timeseries(self.lat[rows], self.lon[cols])
+        with open_dataset(self.paths[('vs', 2014)]) as src:
+            expected = src.wind_speed.values[-2:, rows, cols]
+        self.assertTrue(array_equal(points.values, expected))
+
+        # the file's 40 cell chunks give 3 blocks by 4, each read once
+        index = gridmet._coordinate_index(self.paths[('vs', 2014)])
+        reads = []
+
+        def read(space):
+            reads.append(space)
+            return zeros((2, space['lat'].stop - space['lat'].start, space['lon'].stop - space['lon'].start))
+
+        GridMet._block_points(index, 'wind_speed', rows, cols, slice(0, 2), read)
+        self.assertEqual(len(reads), 12)
+
+    def _native_profile(self):
+        res = 1. / 24
+        return {'driver': 'GTiff', 'dtype': 'float32', 'nodata': None, 'count': 1,
+                'width': 97, 'height': 97, 'crs': CRS({'init': 'epsg:4326'}),
+                'transform': Affine(res, 0., self.lon[24] - res / 2., 0., -res, self.lat[12] + res / 2.)}
+
+    def test_conform_not_square(self):
+        """ Test an eager subset of more columns than rows is conformed (time, lat, lon) by name.
+        :return:
+        """
+        bbox = GeoBounds(west=-114., south=45., east=-112., north=46.)
+        res = 1. / 24
+        rows, cols = slice(24, 97), slice(24, 121)
+        profile = dict(self._native_profile(), width=97, height=73,
+                       transform=Affine(res, 0., self.lon[24] - res / 2., 0., -res, self.lat[24] + res / 2.))
+        with open_dataset(self.paths[('vs', 2014)]) as src:
+            expected = src.wind_speed.values[-2:, rows, cols]
+
+        gridmet = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2014, 12, 31),
+                                      bbox=bbox, target_profile=profile))
+        conformed = gridmet.get_data_subset()
+        self.assertEqual(conformed.shape, (2, 73, 97))
+        self.assertTrue(allclose(conformed, expected, rtol=0., atol=.25))
+
+        area = gridmet.get_area_timeseries(operation='sum')
+        self.assertTrue(allclose(area, expected.sum(axis=0, keepdims=True), rtol=0., atol=1.))
+
+    def test_stream_area_timeseries(self):
+        """ Test chunks of conformed days join to the whole series and reduce like numpy.
+        :return:
+        """
+        gridmet = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2015, 1, 3),
+                                      bbox=self.bbox, target_profile=self._native_profile()))
+        whole = gridmet.get_area_timeseries()
+
+        chunks = list(gridmet.iter_area_timeseries(chunk_days=2))
+        self.assertEqual([arr.shape[0] for _, arr in chunks], [2, 2, 1])
+        self.assertTrue(array_equal(concatenate([arr for _, arr in chunks]), whole))
+        self.assertEqual(list(concatenate([dates for dates, _ in chunks])),
+                         list(date_range('2014-12-30', '2015-01-03')))
+
+        reduced = gridmet.reduce_area_timeseries(('sum', 'mean', 'min', 'max', 'count'), chunk_days=2)
+        self.assertTrue(allclose(reduced['sum'], whole.sum(axis=0, keepdims=True)))
+        self.assertTrue(allclose(reduced['mean'], whole.mean(axis=0, keepdims=True)))
+        self.assertTrue(array_equal(reduced['min'], whole.min(axis=0, keepdims=True)))
+        self.assertTrue(array_equal(reduced['max'], whole.max(axis=0, keepdims=True)))
+        self.assertTrue((reduced['count'] == 5).all())
+
+        # the same days in files laid out (day, lon, lat) stream to the same arrays
+        GridMet.handles.close()
+        GridMet.coordinate_cache.clear()
+        for year in (2014, 2015):
+            path = self.paths[('vs', year)]
+            with open_dataset(path) as src:
+                swapped = src.transpose('day', 'lon', 'lat').load()
+            swapped.to_netcdf(path, encoding={'wind_speed': {'chunksizes': (100, 40, 40)}})
+
+        gridmet = self._local(GridMet('vs', start=datetime(2014, 12, 30), end=datetime(2015, 1, 3),
+                                      bbox=self.bbox, target_profile=self._native_profile()))
+        chunks = list(gridmet.iter_area_timeseries(chunk_days=2))
+        self.assertTrue(array_equal(concatenate([arr for _, arr in chunks]), whole))
+
+    def test_zonal_timeseries(self):
+        """ Test polygon means over the native grid match the covered cells, across years.
+        :return:
+        """
+        res = 1. / 24
+        polygon = box(self.lon[40] - res / 2., self.lat[33] - res / 2.,
+                      self.lon[43] + res / 2., self.lat[30] + res / 2.)
+        gridmet = self._local(GridMet('vs', start=datetime(2014, 12, 31), end=datetime(2015, 1, 1),
+                                      bbox=self.bbox))
+        stats = gridmet.get_zonal_timeseries([polygon], ids=['field'], operations=('mean', 'count'))
+
+        cells = (arange(30, 34)[:, None] * 1000. + arange(40, 44)[None, :]) * 1e-3
+        expected = [2014364. + cells.mean(), 2015000. + cells.mean()]
+        self.assertTrue(allclose(stats['mean']['field'].values, expected))
+        self.assertTrue(allclose(stats['count']['field'].values, 16.))
+        self.assertEqual(list(stats['mean'].index), list(date_range('2014-12-31', '2015-01-01')))
+        self.assertIsNotNone(gridmet.zonal_weights)
+
+    def test_lazy_subsets(self):
+        """ Test lazy subsets are dask-backed on the files' chunk edges and compute to the eager values.
+        :return:
+        """
+        kwargs = dict(start=datetime(2014, 12, 1), end=datetime(2015, 4, 30), bbox=self.bbox)
+        eager, _ = self._local(GridMet('vs', **kwargs))._subset()
+        gridmet = self._local(GridMet('vs', lazy=True, **kwargs))
+
+        cube = gridmet.get_data_subset()
+        self.assertIsNotNone(cube.chunks)
+        self.assertEqual(cube.dims, ('time', 'lat', 'lon'))
+        # days 334 to 364 of 2014, then 0 to 119 of 2015 cut at day 100; cells cut at 40, 80 and 120
+        self.assertEqual(cube.chunks, ((31, 100, 20), (28, 40, 29), (16, 40, 40, 1)))
+        self.assertTrue(array_equal(cube.values, eager.wind_speed.values))
+
+        mean = gridmet.get_area_timeseries(operation='mean')
+        self.assertIsNotNone(mean.chunks)
+        self.assertTrue(allclose(mean.values, eager.wind_speed.values.mean(axis=0)))
+        self.assertEqual(gridmet.src_bounds_wsen, (self.lon[24], self.lat[108], self.lon[120], self.lat[12]))
+
+    def test_write_netcdf_append(self):
+        """ Test a compressed, chunked file gets only the new days on append.
+        :return:
+        """
+        path = os.path.join(self.root, 'archive.nc')
+        gridmet = self._gridmet(start=datetime(2013, 12, 30), end=datetime(2014, 1, 2))
+        self.assertEqual(gridmet.write_netcdf(path, compression='zlib', chunks='point', append=True), 4)
+
+        with NetCDFFile(path) as nc:
+            var = nc.variables['precipitation_amount']
+            self.assertTrue(var.filters()['zlib'])
+            self.assertEqual(var.chunking(), [365, 16, 16])
+            self.assertTrue(nc.dimensions['time'].isunlimited())
+
+        gridmet = self._gridmet(start=datetime(2013, 12, 30), end=datetime(2014, 1, 5))
+        self.assertEqual(gridmet.write_netcdf(path, append=True), 3)
+        self.assertEqual(gridmet.write_netcdf(path, append=True), 0)
+
+        with open_dataset(path) as written:
+            self.assertEqual(list(written.time.to_index()), list(date_range('2013-12-30', '2014-01-05')))
+            self.assertEqual(list(written.precipitation_amount.values[:, 0, 0]),
+                             [2013363., 2013364., 2014000., 2014001., 2014002., 2014003., 2014004.])
+
+    def test_write_netcdf_keeps_handles(self):
+        """ Test writing leaves the encoding of the pooled source handles as it was.
+        :return:
+        """
+        elevation = Dataset({'elevation': (('lat', 'lon'), zeros((len(self.lat), len(self.lon)), dtype=float32))},
+                            coords={'lat': self.lat, 'lon': self.lon})
+        elevation.to_netcdf(os.path.join(self.root, 'metdata_elevationdata.nc'),
+                            encoding={'elevation': {'chunksizes': (40, 40)}})
+
+        for variable, url, name, chunks in (
+                ('elev', os.path.join(self.root, 'metdata_elevationdata.nc'), 'elevation', (40, 40)),
+                ('pr', self.paths[('pr', 2014)], 'precipitation_amount', (100, 40, 40))):
+            gridmet = self._local(GridMet(variable, start=datetime(2014, 1, 1), end=datetime(2014, 1, 2)))
+            gridmet.write_netcdf(os.path.join(self.root, 'out_{}.nc'.format(variable)), compression='zlib',
+                                 chunks='point')
+            self.assertEqual(GridMet.handles.get(url)[name].encoding['chunksizes'], chunks)
+
+    def test_batch_across_variables(self):
+        """ Test a batch fetches each variable's years and conforms them with one plan.
+        :return:
+        """
+        profile = self._native_profile()
+        batch = self._local(GridMetBatch(['pr', 'tmmx'], start=datetime(2014, 12, 31),
+                                         end=datetime(2015, 1, 1), bbox=self.bbox, target_profile=profile))
+
+        subsets = batch.get_data_subset(as_dataset=True)
+        self.assertEqual(sorted(subsets.data_vars), ['pr', 'tmmx'])
+        self.assertIn(self.paths[('pr', 2015)], GridMet.coordinate_cache)
+        self.assertNotIn(self.paths[('tmmx', 2015)], GridMet.coordinate_cache)
+        self.assertEqual(list(subsets.pr.values[:, 0, 0]), [2014364., 2015000.])
+        self.assertEqual(list(subsets.tmmx.values[:, 0, 0]), [2014364.5, 2015000.5])
+
+        conformed = batch.get_data_subset()
+        for variable in ('pr', 'tmmx'):
+            self.assertTrue(allclose(conformed[variable], subsets[variable].values))
+
+    def test_cached_batch_layouts(self):
+        """ Test a cached batch files each variable's chunks in the shared index's layout.
+        :return:
+        """
+        for year in (2014, 2015):
+            path = self.paths[('vs', year)]
+            with open_dataset(path) as src:
+                swapped = src.transpose('day', 'lon', 'lat').load()
+            swapped.to_netcdf(path, encoding={'wind_speed': {'chunksizes': (100, 40, 40)}})
+
+        kwargs = dict(start=datetime(2014, 12, 31), end=datetime(2015, 1, 1), bbox=self.bbox)
+        expected = self._local(GridMetBatch(['pr', 'vs'], **kwargs)).get_subsets()
+        cache = ChunkCache(os.path.join(self.root, 'cache'), chunk_size=32)
+        subsets = self._local(GridMetBatch(['pr', 'vs'], cache=cache, **kwargs)).get_subsets()
+        self.assertTrue(array_equal(subsets.vs.values, expected.vs.values))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,49 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+
+from met.warp import WarpPlanCache
+
+
+class _Plan(object):
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+class TestWarpPlanCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = WarpPlanCache(max_plans=2)
+        cache.put('a', _Plan(1))
+        cache.put('b', _Plan(1))
+        cache.get('a')
+        cache.put('c', _Plan(1))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_evicts_to_byte_budget(self):
+        cache = WarpPlanCache(max_plans=10, max_bytes=100)
+        cache.put('a', _Plan(60))
+        cache.put('b', _Plan(60))
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.nbytes, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,84 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+import unittest
+
+from numpy import allclose, arange, isnan, nan
+from numpy.random import RandomState
+from pyproj import Proj
+from shapely.geometry import box, mapping
+
+from met.zonal import ZonalWeights
+
+
+class TestZonalWeights(unittest.TestCase):
+    """ Coverage weights and statistics on a small geographic grid of 0.1 degree cells.
+    """
+
+    def setUp(self):
+        self.lat = arange(46.95, 45., -0.1)
+        self.lon = arange(-114.95, -113., 0.1)
+        self.cube = RandomState(0).rand(4, len(self.lat), len(self.lon))
+
+    def test_cell_fractions(self):
+        """ Test whole, half and sub-cell polygons get their covered fractions.
+        :return:
+        """
+        whole = box(-114.8, 46.5, -114.5, 46.7)
+        half = box(-114.05, 45.45, -114.0, 45.55)
+        tiny = box(-113.52, 46.02, -113.519, 46.021)
+        weights = ZonalWeights.from_coords(self.lat, self.lon, [mapping(whole), half, tiny],
+                                           ids=['whole', 'half', 'tiny'])
+        dense = weights.matrix.toarray().reshape(3, len(self.lat), len(self.lon))
+
+        self.assertTrue(allclose(dense[0, 3:5, 2:5], 1.))
+        self.assertAlmostEqual(dense[0].sum(), 6.)
+        self.assertTrue(allclose(dense[1, 14:16, 9], 0.25))
+        self.assertAlmostEqual(dense[1].sum(), 0.5)
+        self.assertEqual(dense[2, 9, 14], 1.)
+
+        stats = weights.stats(self.cube, operations=('mean', 'sum', 'count'))
+        self.assertEqual(list(stats['mean'].columns), ['whole', 'half', 'tiny'])
+        self.assertTrue(allclose(stats['mean']['whole'], self.cube[:, 3:5, 2:5].mean(axis=(1, 2))))
+        self.assertTrue(allclose(stats['sum']['whole'], self.cube[:, 3:5, 2:5].sum(axis=(1, 2))))
+        self.assertTrue(allclose(stats['mean']['half'], self.cube[:, 14:16, 9].mean(axis=1)))
+        self.assertTrue(allclose(stats['mean']['tiny'], self.cube[:, 9, 14]))
+        self.assertTrue(allclose(stats['count']['whole'], 6.))
+
+    def test_projected_features_and_gaps(self):
+        """ Test polygons in another CRS are reprojected and NaN cells are left out.
+        :return:
+        """
+        utm = Proj(init='epsg:32612')
+        x, y = utm(-114.35, 46.25)
+        square = box(x - 2000., y - 2000., x + 2000., y + 2000.)
+        weights = ZonalWeights.from_coords(self.lat, self.lon, [square], crs={'init': 'epsg:32612'},
+                                           supersample=32)
+        self.assertTrue(allclose(weights.matrix.sum(), 16e6 / (0.1 * 111e3 * 0.1 * 77e3), rtol=0.05))
+
+        cube = self.cube.copy()
+        cube[1] = nan
+        stats = weights.stats(cube, operations=('mean', 'count'))
+        self.assertTrue(isnan(stats['mean'][0][1]))
+        self.assertEqual(stats['count'][0][1], 0.)
+        self.assertFalse(isnan(stats['mean'][0][0]))
+        self.assertRaises(ValueError, weights.stats, cube[:, 1:], ('mean',))
+        self.assertRaises(ValueError, weights.stats, cube, ('median',))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -93,26 +93,23 @@ class CatchmetGridmet():
         days = monthrange(self.year, self.month)[1]
         s, e = datetime(self.year, self.month, 1), datetime(self.year, self.month, days)
 
-        kwargs = dict(start=s, end=e, bbox=bounds, clip_feature=clip, target_profile=self.geometry)
+        kwargs = dict(start=s, end=e, bbox=bounds, clip_feature=clip, target_profile=self.geometry,
+                      data_root=self.netcdf)
 
         if self.variable == 'pr':
             self.gridmet = GridMet(self.variable, **kwargs)
-            path = os.path.join(self.netcdf, '{}_{}.nc'.format(self.variable, self.year))
-            self.arr = self.gridmet.get_area_timeseries(file_url=path, operation='sum')
+            self.arr = self.gridmet.get_area_timeseries(operation='sum')
 
         elif self.variable == 'temp':
-            path = os.path.join(self.netcdf, 'tmmx_{}.nc'.format(self.year))
             self.gridmet = GridMet('tmmx', **kwargs)
-            mean_max = self.gridmet.get_area_timeseries(file_url=path, operation='mean')
-            path = os.path.join(self.netcdf, 'tmmn_{}.nc'.format(self.year))
+            mean_max = self.gridmet.get_area_timeseries(operation='mean')
             self.gridmet = GridMet('tmmn', **kwargs)
-            mean_min = self.gridmet.get_area_timeseries(file_url=path, operation='mean')
+            mean_min = self.gridmet.get_area_timeseries(operation='mean')
             self.arr = mean([mean_max, mean_min], axis=0)
 
         elif self.variable == 'elev':
             self.gridmet = GridMet(self.variable, **kwargs)
-            path = os.path.join(self.netcdf, 'metdata_elevationdata.nc'.format(self.variable))
-            self.arr = self.gridmet.get_data_subset(file_url=path)
+            self.arr = self.gridmet.get_data_subset()
 
         else:
             raise NotImplementedError("choose from 'temp', 'pr', or 'elev'")